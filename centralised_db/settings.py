@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 from os import getenv, path
+import json
 import ssl
 from venv import logger
 import dotenv
@@ -182,6 +183,14 @@ if DEVELOPMENT_MODE is True:
     STATIC_ROOT = BASE_DIR / 'static'
     MEDIA_URL = 'media/'
     MEDIA_ROOT = BASE_DIR / 'media'
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        'ingestion_archive': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            'OPTIONS': {'location': getenv('INGESTION_ARCHIVE_ROOT', str(BASE_DIR / 'ingestion_archive'))},
+        },
+    }
 else:
     AWS_S3_ACCESS_KEY_ID = getenv('AWS_S3_ACCESS_KEY_ID')
     AWS_S3_SECRET_ACCESS_KEY = getenv('AWS_S3_SECRET_ACCESS_KEY')
@@ -196,7 +205,12 @@ else:
     AWS_S3_CUSTOM_DOMAIN = getenv('AWS_S3_CUSTOM_DOMAIN')
     STORAGES = {
     'default': { 'BACKEND': 'storages.backends.s3.S3Storage'},
-    'staticfiles': {'BACKEND': 'storages.backends.s3.S3Storage'}
+    'staticfiles': {'BACKEND': 'storages.backends.s3.S3Storage'},
+    # Raw upstream payloads stay private, unlike the public static files
+    'ingestion_archive': {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {'location': 'ingestion-archive', 'default_acl': 'private', 'querystring_auth': True},
+    },
     }
 
 
@@ -306,6 +320,8 @@ CELERY_TASK_ROUTES = {
     'koe_db.tasks.execute_cystat_request': {'queue': 'workflow_queue'},
     'koe_db.tasks.execute_ecb_request': {'queue': 'workflow_queue'},
     'koe_db.tasks.execute_eurostat_request': {'queue': 'workflow_queue'},
+    'koe_db.tasks.dispatch_due_workflows': {'queue': 'workflow_queue'},
+    'koe_db.tasks.recompute_custom_indicators': {'queue': 'workflow_queue'},
 }
 
 REDIS_URL = getenv("REDIS_URL", "redis://127.0.0.1:6379")
@@ -325,6 +341,21 @@ CELERY_TIMEZONE = 'Europe/Nicosia'
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# One beat entry starts every workflow whose next_run is due, instead of one entry per workflow
+WORKFLOW_DISPATCH_INTERVAL = float(getenv("WORKFLOW_DISPATCH_INTERVAL", "60"))
+# Due workflows executed at the same time by one dispatcher run
+WORKFLOW_DISPATCH_WORKERS = int(getenv("WORKFLOW_DISPATCH_WORKERS", "8"))
+
+# Seconds a workflow's single-flight lease outlives its last heartbeat (renewed every third of it)
+WORKFLOW_LEASE_TTL = int(getenv("WORKFLOW_LEASE_TTL", "60"))
+
+CELERY_BEAT_SCHEDULE = {
+    'dispatch-due-workflows': {
+        'task': 'koe_db.tasks.dispatch_due_workflows',
+        'schedule': WORKFLOW_DISPATCH_INTERVAL,
+    },
+}
+
 # REDIS CACHE
 
 
@@ -338,3 +369,51 @@ CACHES = {
         },
     }
 }
+
+# UPSTREAM HTTP CLIENT
+
+HTTP_CONNECT_TIMEOUT = float(getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_MAX_RETRIES = int(getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_RETRY_BACKOFF = float(getenv("HTTP_RETRY_BACKOFF", "0.5"))
+HTTP_POOL_SIZE = int(getenv("HTTP_POOL_SIZE", "10"))
+# Requests one process sends to the same upstream host at the same time
+HTTP_HOST_CONCURRENCY = int(getenv("HTTP_HOST_CONCURRENCY", "4"))
+
+# Workflow fetches per upstream host, shared by all workers through Redis: a token bucket of 'rate'
+# fetches per second holding up to 'burst' tokens, and at most 'concurrency' fetches at a time.
+# Throttled tasks are requeued with a countdown instead of waiting in their worker slot.
+UPSTREAM_RATE_LIMITS = json.loads(getenv(
+    "UPSTREAM_RATE_LIMITS",
+    '{"cystatdb.cystat.gov.cy": {"rate": 0.5, "burst": 4, "concurrency": 2}}'
+))
+# Seconds after which the slot of a fetch that never released it is freed
+UPSTREAM_SLOT_LEASE = int(getenv("UPSTREAM_SLOT_LEASE", "600"))
+# Countdown of a task requeued because every slot of its host is taken
+UPSTREAM_THROTTLE_RETRY_DELAY = float(getenv("UPSTREAM_THROTTLE_RETRY_DELAY", "10"))
+UPSTREAM_THROTTLE_MAX_RETRIES = int(getenv("UPSTREAM_THROTTLE_MAX_RETRIES", "60"))
+
+# Base URL of the ECB SDMX data API
+ECB_API_URL = getenv("ECB_API_URL", "https://data-api.ecb.europa.eu/service/data")
+
+# Remote dataset structures (CyStat variables, ECB/Eurostat dimensions) are cached in Redis for this many seconds
+STRUCTURE_CACHE_TTL = int(getenv("STRUCTURE_CACHE_TTL", "3600"))
+
+# Packed indicator series served to the read endpoints are cached in Redis for this many seconds
+SERIES_CACHE_TTL = int(getenv("SERIES_CACHE_TTL", "86400"))
+
+# Upstream bodies larger than this many bytes are parsed incrementally (ijson) instead of with json.load
+STREAMING_PARSE_THRESHOLD = int(getenv("STREAMING_PARSE_THRESHOLD", str(16 * 1024 * 1024)))
+# Streamed bodies are kept in memory up to this size, then spooled to a temporary file
+STREAMING_SPOOL_MEMORY = int(getenv("STREAMING_SPOOL_MEMORY", str(8 * 1024 * 1024)))
+
+# Changes written per ingestion transaction; a failed run reverts the batches it committed
+INGESTION_COMMIT_BATCH_SIZE = int(getenv("INGESTION_COMMIT_BATCH_SIZE", "5000"))
+
+# Archive the raw upstream payload of every workflow run (gzip, 'ingestion_archive' storage) for replays
+INGESTION_ARCHIVE_ENABLED = getenv("INGESTION_ARCHIVE_ENABLED", "False") == "True"
+
+# PX-Web (CyStat) queries estimated above this many cells are split into period chunks
+CYSTAT_CELL_LIMIT = int(getenv("CYSTAT_CELL_LIMIT", "100000"))
+# Period chunks of one CyStat query fetched at the same time
+CYSTAT_QUERY_CONCURRENCY = int(getenv("CYSTAT_QUERY_CONCURRENCY", "4"))
@@ -2,7 +2,7 @@ import json
 from django.http import JsonResponse
 from django.core.exceptions import FieldDoesNotExist, FieldError
 from django.db.models import Q, ForeignKey
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from koe_db.authentication import CustomJWTAuthentication
 
 from django.apps import apps
@@ -10,9 +10,13 @@ from django.apps import apps
 # TODO: Frequency issue
 
 from .models import (
-    AccessLevel, IndicatorPermission, ActionLog, Country, CustomTable,
+    AccessLevel, IndicatorPermission, ActionLog, Country, CustomTable, DataChange,
     Data, Indicator, Category, Region, CustomIndicator, Unit, UserAccount, UserFavouriteIndicators, UserFavouriteTables, UserFollowsUser, Frequency
 )
+from .ingestion import upsert_data
+from .periods_utils import PERIOD_ORDERING, period_fields
+from . import series_cache, table_cache
+from .data_changes import action_details, change_rows, details_by_log, log_data_update
 from .permissions import (
     check_indicator_permission,
     check_custom_indicator_permission, check_table_view_permission, get_accessible_indicators, get_accessible_tables,
@@ -99,22 +103,29 @@ def duplicate_indicator(indicator_id,request):
         )
         # Copy history
         history = ActionLog.objects.filter(indicator=indicator_to_duplicate)
+        changes_by_log = details_by_log(h.id for h in history if h.action_type == 'DATA_UPDATE')
         for h in history:
-            ActionLog.objects.create(
+            copy = ActionLog.objects.create(
                 user=h.user,
                 indicator=new_indicator,
                 action_type=h.action_type,
                 details=h.details
             )
+            if h.action_type == 'DATA_UPDATE':
+                DataChange.objects.bulk_create(change_rows(copy, changes_by_log[h.id]))
 
         # Copy data
         data = Data.objects.filter(indicator=indicator_to_duplicate)
-        for d in data:
-            Data.objects.create(
+        Data.objects.bulk_create([
+            Data(
                 indicator=new_indicator,
                 period=d.period,
-                value=d.value
+                value=d.value,
+                period_start=d.period_start,
+                period_frequency=d.period_frequency
             )
+            for d in data
+        ])
         # Copy permissions
         permissions = IndicatorPermission.objects.filter(indicator=indicator_to_duplicate)
         for p in permissions:
@@ -376,6 +387,7 @@ def delete_table_indicator(request, table_id, indicator_id):
             if not indicator:
                 return JsonResponse({'error': f'Indicator with id {indicator_id} not found'}, status=404)
             table.indicators.remove(indicator)
+            table_cache.rebuild(table)
             return JsonResponse({'success': f'Indicator {indicator_id} removed from table {table_id}'})
     except Exception as e:
         print(e)
@@ -625,38 +637,15 @@ def tables(request, id):
             table_name = table.name
             table_description = table.description
             # return indicator names and it fields for given table
-            indicators = table.indicators.all()
-            # return data for each indicator, indicator metadata should also be part of the structure
-            data = {}
-            for indicator in indicators:
-                try:
-                    data[indicator.name] = Data.objects.filter(indicator=indicator)
-                except Exception as e:
-                    print(e)
-                    continue
-            # data dictionary should also group by period
-            data_by_period = {}
-            for indicator, values in data.items():
-                for value in values:
-                    period = value.period
-                    if period not in data_by_period:
-                        data_by_period[period] = {}
-                    data_by_period[period][indicator] = value.value
-            # data period is ascending
-            data_by_period = dict(sorted(data_by_period.items()))
-            # data by period should be turned into an array where each row is date, indicator1, indicator2 and so on
-            data_by_indicators = []
-            all_indicators = set(indicators.values_list('name', flat=True))
-            for period, values in data_by_period.items():
-                row = {'period': period}
-                for indicator in all_indicators:
-                    row[indicator] = values.get(indicator, None)
-                data_by_indicators.append(row)
-            print(data_by_indicators)
-            # return metadata for each indicator
+            indicators = table.indicators.select_related('category', 'country', 'region', 'unit')
+            # data is served from the prebuilt period x indicator matrix of the table: each row is
+            # the period and one column per indicator id, in ascending period order
+            matrix = table_cache.get_matrix(table.id, [indicator.id for indicator in indicators])
+            data_by_indicators = list(matrix.rows())
+            # return metadata for each indicator, keyed by id like the data columns
             indicator_metadata = {}
             for indicator in indicators:
-                indicator_metadata[indicator.name] = {
+                indicator_metadata[str(indicator.id)] = {
                     'id': indicator.id,
                     'name': indicator.name,
                     'code': indicator.code,
@@ -773,57 +762,49 @@ def indicator_history(request, indicator_id):
             if not indicator:
                 return JsonResponse({'error': f'Indicator with id {indicator_id} not found'}, status=404)
 
-            action_types = ['DATA_UPDATE', 'INDICATOR_EDIT']
+            action_types = ['INDICATOR_EDIT']
             if indicator.is_custom:
                 action_types.append('FORMULA_UPDATE')
 
-            action_logs = ActionLog.objects.filter(indicator=indicator, action_type__in=action_types).values('timestamp', 'details', 'action_type', 'user')
+            action_logs = ActionLog.objects.filter(indicator=indicator, action_type__in=action_types).values('timestamp', 'details', 'action_type', 'user__email')
 
             grouped_by_timestamp = {}
             for entry in action_logs:
-                timestamp = entry['timestamp']
-                details = entry['details']
-                user_id = entry['user']
-                user = UserAccount.objects.get(id=user_id) if user_id else None
-                user_email = user.email if user else None
-                if timestamp not in grouped_by_timestamp:
-                    grouped_by_timestamp[timestamp] = []
-                grouped_by_timestamp[timestamp].append({'action_type': entry['action_type'], 'details': details, 'user_email': user_email})
-            # sort 'data_update' actions by timestamp from most recent to oldesr
-            # these should be called sorted_du
-            sorted_du = sorted(
-                [(timestamp, details) for timestamp, details in grouped_by_timestamp.items() if any(d['action_type'] == 'DATA_UPDATE' for d in details)],
-                key=lambda x: x[0],
-                reverse=True
+                grouped_by_timestamp.setdefault(entry['timestamp'], []).append({'action_type': entry['action_type'], 'details': entry['details'], 'user_email': entry['user__email']})
+            # point changes of 'data_update' actions by timestamp, from most recent to oldest:
+            # {timestamp: {period: (old value, new value, user email)}}, the latest change of a period wins
+            changes_by_timestamp = {}
+            data_changes = (
+                DataChange.objects.filter(indicator=indicator)
+                .order_by('-timestamp', 'action_log_id', 'id')
+                .values_list('timestamp', 'period', 'old_value', 'new_value', 'action_log__user__email')
             )
-            current_data = Data.objects.filter(indicator=indicator).order_by('period')
+            for timestamp, period, old_value, new_value, user_email in data_changes:
+                changes_by_timestamp.setdefault(timestamp, {})[period] = (old_value, new_value, user_email)
+            current_series = series_cache.get_series(indicator.id)
+            current_data = list(zip(current_series.periods, current_series.formatted_values()))
             data_history = {}
-            # loop through all timestamps in sorted_du
-            for timestamp, details in sorted_du:
-                time_list = [{} for _ in range(len(current_data))]
-                for index, data in enumerate(current_data):
-                    period = data.period
-                    value = data.value
-                    if sorted_du.index((timestamp, details)) == 0:
-                        time_list[index] = {'period': period, 'value': value}
+            previous_list = None
+            # loop through all timestamps with data updates
+            for timestamp, changes in changes_by_timestamp.items():
+                time_list = []
+                for index, (period, value) in enumerate(current_data):
+                    if previous_list is None:
+                        entry = {'period': period, 'value': value}
                     else:
-                        # get previous iteration's timestamp
-                        previous_timestamp = sorted_du[sorted_du.index((timestamp, details)) - 1][0]
                         # get data history in position previous iteration timestamp for given period
-                        previous_value = data_history.get(str(previous_timestamp), [])[index]['value']
+                        previous_value = previous_list[index]['value']
                         # if previous value contains '->' then get what is after '->' and set it as the new value
                         if '->' in str(previous_value):
                             previous_value = previous_value.split('->')[0].strip()
-                        time_list[index] = {'period': period, 'value': previous_value}
-                    for detail in details:
-                        user = detail['user_email']
-                        for change in detail['details']:
-                            if change['period'] == period:
-                                old_value = change['old_value']
-                                new_value = change['new_value']
-                                time_list[index] = {'period': period, 'value': f'{old_value} -> {new_value}', 'user': user}
+                        entry = {'period': period, 'value': previous_value}
+                    if period in changes:
+                        old_value, new_value, user = changes[period]
+                        entry = {'period': period, 'value': f'{old_value} -> {new_value}', 'user': user}
+                    time_list.append(entry)
                 data_history[str(timestamp)] = time_list
-            response = [{'timestamp': timestamp, 'details': details_list} for timestamp, details_list in grouped_by_timestamp.items() if not any(d['action_type'] == 'DATA_UPDATE' for d in details_list)]
+                previous_list = time_list
+            response = [{'timestamp': timestamp, 'details': details_list} for timestamp, details_list in grouped_by_timestamp.items() if timestamp not in changes_by_timestamp]
             response.append({'action_type': 'DATA_UPDATE', 'history': data_history})
             return JsonResponse(response, safe=False)
     except Exception as e:
@@ -838,21 +819,22 @@ def add_indicators_to_table(request, id):
             table = CustomTable.objects.get(id=id)
             if not table:
                 return JsonResponse({'error': f'Table with id {id} not found'}, status=404)
-            # check if selected indicators are already in the table
+            selected = []
             for indicator_id in selected_indicators:
                 indicator = Indicator.objects.get(id=indicator_id)
                 if not indicator:
                     return JsonResponse({'error': f'Indicator with id {indicator_id} not found'}, status=404)
-                # check whether frequency of indicator matches the frequency of other indicators in the table
-                # select one indicator from the table to compare with
-                if table.indicators.all():
-                    first_indicator = table.indicators.first()
-                    if first_indicator.frequency != indicator.frequency:
-                        return JsonResponse({'error': f'Indicator with id {indicator_id} has different data frequency than other indicators in the table'}, status=422)
-                    if indicator not in table.indicators.all():
-                        table.indicators.add(indicator)
-                else:
-                    table.indicators.add(indicator)
+                selected.append(indicator)
+            # check whether frequency of every selected indicator matches the frequency of other indicators
+            # in the table (or of the first selected one for an empty table) before adding any of them,
+            # so a mismatch leaves the table and its cached matrix unchanged
+            first_indicator = table.indicators.first() or (selected[0] if selected else None)
+            for indicator in selected:
+                if first_indicator.frequency != indicator.frequency:
+                    return JsonResponse({'error': f'Indicator with id {indicator.id} has different data frequency than other indicators in the table'}, status=422)
+            # indicators already in the table are left as they are
+            table.indicators.add(*selected)
+            table_cache.rebuild(table)
             return JsonResponse({'success': f'Indicators {selected_indicators} successfully'})
 
     except Exception as e:
@@ -872,23 +854,11 @@ def indicators(request, id):
             if not check_indicator_permission(user, indicator, 'view'):
                 return JsonResponse({'error': 'Permission denied'}, status=403)
 
-            # get all Data entries for this Indicator
-            data_qs = Data.objects.filter(indicator=indicator)
-
-            # Group data by period => single 'value' per period
-            data_by_period = {}
-            for d in data_qs:
-                # Store the value and id.
-                data_by_period[d.period] = {'value': d.value, 'id': d.id}
-
-            # Sort by period (ascending) and build a list of rows
-            data_list = []
-            for period, val in sorted(data_by_period.items()):
-                data_list.append({
-                    'period': period,
-                    'value': val['value'],
-                    'id': val['id']
-                })
+            # get all Data entries for this Indicator, one row per period, ascending
+            data_list = [
+                {'period': point['period'], 'value': point['value'], 'id': point['id']}
+                for point in series_cache.get_series(indicator.id).points()
+            ]
 
 
             # get indicator region:
@@ -925,6 +895,7 @@ def indicators(request, id):
                 check_custom_indicator_permission(user, custom_indicator, 'view')
                 if custom_indicator:
                     basis_indicators = custom_indicator.base_indicators.all()
+                    basis_series = series_cache.get_many(basis_indicator.id for basis_indicator in basis_indicators)
                     basis_indicator_metadata = {}
                     basis_indicator_data = {}
                     for basis_indicator in basis_indicators:
@@ -950,23 +921,11 @@ def indicators(request, id):
                             }
                         except Exception as e:
                             print(f"Error processing basis indicator {basis_indicator.name}: {e}")
-                        data_qs = Data.objects.filter(indicator=basis_indicator)
-
-                        # Group data by period => single 'value' per period
-                        data_by_period = {}
-                        for d in data_qs:
-                            # Store the value and id.
-                            data_by_period[d.period] = {'value': d.value, 'id': d.id}
-
-
-                        # Sort by period (ascending) and build a list of rows
-                        data_l = []
-                        for period, val in sorted(data_by_period.items()):
-                            data_l.append({
-                                'period': period,
-                                'value': val['value'],
-                                'id': val['id']
-                            })
+                        # One row per period, ascending
+                        data_l = [
+                            {'period': point['period'], 'value': point['value'], 'id': point['id']}
+                            for point in basis_series[basis_indicator.id].points()
+                        ]
                         basis_indicator_data[basis_indicator.code] = data_l
                     formula = custom_indicator.formula
                     return JsonResponse({'indicator':indicator_metadata, 'data': data_list, 'basis_indicators': basis_indicator_metadata, 'basis_data': basis_indicator_data, 'formula': formula})
@@ -1114,7 +1073,9 @@ def indicators(request, id):
                     'error': f'Cannot delete: This indicator is used by {dependent_indicators.count()} custom indicators'
                 }, status=400)
 
+            indicator_id = indicator.id
             indicator.delete()
+            series_cache.invalidate([indicator_id])
             return JsonResponse({'success': 'Indicator deleted successfully'}, status=204)
 
         # If none of the above:
@@ -1126,9 +1087,39 @@ def indicators(request, id):
 
 
 
+def recompute_custom_indicator(custom_indicator, periods, user):
+    """
+    Recalculates a Custom Indicator for the given periods and logs the values that changed.
+    """
+    print(f"Recomputing values for Custom Indicator: {custom_indicator.indicator.name}")
+
+    periods = list(periods)
+    current = dict(
+        Data.objects.filter(indicator=custom_indicator.indicator, period__in=periods).values_list('period', 'value')
+    )
+
+    changes = []
+    rows = []
+    for period in periods:
+        old_value = current.get(period)
+        computed_value = custom_indicator.calculate_value(period)
+
+        if old_value is None or f"{old_value:.5f}" != f"{float(computed_value):.5f}":
+            rows.append(Data(indicator=custom_indicator.indicator, period=period, value=computed_value))
+            changes.append({'period': period, 'old_value': str(old_value), 'new_value': str(computed_value)})
+
+        print(period,computed_value)
+    upsert_data(rows)
+    if changes:
+        log_data_update(custom_indicator.indicator, changes, user=user)
+
+    print(f"Updated values for {custom_indicator.indicator.name}")
+
+
 def update_dependent_custom_indicators(updated_indicator,user):
     """
     Recalculate values for Custom Indicators that depend on the updated base indicator.
+    Returns the number of custom indicators recomputed.
     """
     print(f"Checking for dependent custom indicators on {updated_indicator.name}")
 
@@ -1136,42 +1127,11 @@ def update_dependent_custom_indicators(updated_indicator,user):
     dependent_custom_indicators = CustomIndicator.objects.filter(base_indicators=updated_indicator)
 
     for custom_indicator in dependent_custom_indicators:
-        print(f"Recomputing values for Custom Indicator: {custom_indicator.indicator.name}")
-
         # Retrieve all unique periods associated with the updated base indicator
         periods = Data.objects.filter(indicator=updated_indicator).values_list('period', flat=True).distinct()
-        changes = []
-        for period in periods:
-            old_value = Data.objects.filter(indicator=custom_indicator.indicator, period=period).first()
-            old_value = old_value.value if old_value else None
-            computed_value = custom_indicator.calculate_value(period)
-
-            if old_value is None or f"{old_value:.5f}" != f"{float(computed_value):.5f}":
-                data_entries = Data.objects.filter(
-                    indicator=custom_indicator.indicator,
-                    period=period
-                )
-
-                if data_entries.exists():
-                    data_entries.update(value=computed_value)
-                else:
-                    Data.objects.create(
-                        indicator=custom_indicator.indicator,
-                        period=period,
-                        value=computed_value
-                    )
-                changes.append({'period': period, 'old_value': str(old_value), 'new_value': str(computed_value)})
-
-            print(period,computed_value)
-        if changes:
-            ActionLog.objects.create(
-                user=user,
-                indicator=custom_indicator.indicator,
-                action_type='DATA_UPDATE',
-                details=changes
-            )
+        recompute_custom_indicator(custom_indicator, periods, user)
 
-        print(f"Updated values for {custom_indicator.indicator.name}")
+    return len(dependent_custom_indicators)
 
 
 def data(request, indicator_id):
@@ -1203,16 +1163,53 @@ def data(request, indicator_id):
         changes =[]
         user = get_user(request)
 
-        with transaction.atomic():
-            for entry in data:
-                period = entry.get('period')
-                value = entry.get('value')
-                id = entry.get('id')
-                is_estimate = entry.get('is_estimate', False)
-                print(entry)
-                try:
+        # Ids are only looked up among this indicator's points, so an edit can never reach
+        # (or be logged against) a point of another indicator
+        existing = {
+            str(data_id): data_obj
+            for data_id, data_obj in Data.objects.filter(
+                indicator=indicator, id__in=[entry['id'] for entry in data if entry.get('id')]
+            ).in_bulk().items()
+        }
+        missing = [entry['id'] for entry in data if entry.get('id') and str(entry['id']) not in existing]
+        if missing:
+            return JsonResponse({'error': f'Data points {missing} not found for indicator {indicator_id}'}, status=404)
+
+        # A point moved to another period must not land on a period this indicator already has,
+        # unless the point holding it moves away in the same request
+        moves = {
+            str(entry['id']): entry.get('period') for entry in data
+            if entry.get('id') and existing[str(entry['id'])].period != entry.get('period')
+        }
+        vacated = {existing[data_id].period for data_id in moves}
+        occupied = set(
+            Data.objects.filter(indicator=indicator, period__in=list(moves.values())).values_list('period', flat=True)
+        ) - vacated
+        targets = list(moves.values())
+        conflicts = sorted({period for period in targets if period in occupied or targets.count(period) > 1})
+        if conflicts:
+            return JsonResponse({'error': f'Periods {conflicts} already have a data point'}, status=400)
+
+        # Any failure rolls back the whole request: escaping the atomic block is what undoes
+        # the writes already made, including period moves
+        try:
+            with transaction.atomic():
+                # Points submitted without an id may already exist for their period
+                existing_by_period = {
+                    data_obj.period: data_obj
+                    for data_obj in Data.objects.filter(
+                        indicator=indicator, period__in=[entry.get('period') for entry in data if not entry.get('id')]
+                    )
+                }
+                rows = []
+                for entry in data:
+                    period = entry.get('period')
+                    value = entry.get('value')
+                    id = entry.get('id')
+                    is_estimate = entry.get('is_estimate', False)
+                    print(entry)
                     if id:
-                        data_obj = Data.objects.get(id=id)
+                        data_obj = existing[str(id)]
                         old_value = data_obj.value
                         # Check if old_value is None before formatting
                         old_value_formatted = f"{float(old_value):.5f}" if old_value is not None else None
@@ -1223,20 +1220,37 @@ def data(request, indicator_id):
                         print(f"Updating data point: {id}")
                         # Convert value to float only if it's not None
                         float_value = float(value) if value is not None else None
-                        Data.objects.filter(id=id).update(period=period, value=float_value, isEstimate=is_estimate)
+                        if data_obj.period == period:
+                            rows.append(Data(indicator=indicator, period=period, value=float_value, isEstimate=is_estimate))
+                        else:
+                            # Moving a point to another period is the only write keyed by id
+                            Data.objects.filter(id=id).update(
+                                period=period, value=float_value, isEstimate=is_estimate, **period_fields(period)
+                            )
+                            series_cache.invalidate([indicator.id])
                     else:
-                        Data.objects.create(indicator=indicator, period=period, value=value, isEstimate=is_estimate)
-                        changes.append({'period': period, 'data_id':id, 'old_value': 'None', 'new_value': str(value)})
-                except Exception as e:
-                    print(e)
-                    return JsonResponse({'error': str(e)}, status=500)
-        if changes:
-            ActionLog.objects.create(
-                user=user,
-                indicator=indicator,
-                action_type='DATA_UPDATE',
-                details=changes
-            )
+                        data_obj = existing_by_period.get(period)
+                        if data_obj is None:
+                            changes.append({'period': period, 'data_id': None, 'old_value': 'None', 'new_value': str(value)})
+                        else:
+                            old_value = data_obj.value
+                            old_value_formatted = f"{float(old_value):.5f}" if old_value is not None else None
+                            new_value_formatted = f"{float(value):.5f}" if value is not None else None
+                            if old_value_formatted == new_value_formatted and data_obj.isEstimate == is_estimate:
+                                continue
+                            if old_value_formatted != new_value_formatted:
+                                changes.append({'period': period, 'data_id': data_obj.id, 'old_value': str(old_value) if old_value is not None else "None", 'new_value': str(value) if value is not None else "None"})
+                        rows.append(Data(indicator=indicator, period=period, value=value, isEstimate=is_estimate))
+                upsert_data(rows, update_fields=('value', 'isEstimate'))
+                if changes:
+                    log_data_update(indicator, changes, user=user)
+        except IntegrityError as e:
+            # A period written twice in one request, e.g. a point moved onto a new point's period
+            print(e)
+            return JsonResponse({'error': 'A period was given more than one data point'}, status=400)
+        except Exception as e:
+            print(e)
+            return JsonResponse({'error': str(e)}, status=500)
         # **Trigger Recalculation for Dependent Custom Indicators**
         update_dependent_custom_indicators(indicator,user)
 
@@ -1272,6 +1286,11 @@ def restore_indicator_data(request, indicator_id):
 
         changes = []
         with transaction.atomic():
+            current = dict(
+                Data.objects.filter(indicator=indicator, period__in=[entry.get('period') for entry in history_entries])
+                .values_list('period', 'value')
+            )
+            rows = []
             for entry in history_entries:
                 period = entry.get('period')
                 value_string = entry.get('value', '')
@@ -1302,52 +1321,38 @@ def restore_indicator_data(request, indicator_id):
                     except (ValueError, TypeError):
                         float_value = None
 
-                # Find existing data point or create new one
-                data_obj = Data.objects.filter(indicator=indicator, period=period).last()
-
-                if data_obj:
-                    # Update existing data point if value changed
+                # Update the existing data point if its value changed, or create it
+                if period in current:
+                    stored_value = current[period]
                     if float_value is None:
                         # If the value is None, check if the existing value is not None
-                        if data_obj.value is not None:
-                            old_value = str(data_obj.value) if data_obj.value is not None else "None"
+                        if stored_value is not None:
                             changes.append({
                                 'period': period,
-                                'old_value': old_value,
+                                'old_value': str(stored_value),
                                 'new_value': 'None'
                             })
-                            data_obj.value = None
-                            data_obj.save()
-                    elif data_obj.value is None or abs(float(data_obj.value) - float_value) > 0.00001:
-                        old_value = str(data_obj.value) if data_obj.value is not None else "None"
+                            rows.append(Data(indicator=indicator, period=period, value=None))
+                    elif stored_value is None or abs(float(stored_value) - float_value) > 0.00001:
+                        old_value = str(stored_value) if stored_value is not None else "None"
                         changes.append({
                             'period': period,
                             'old_value': old_value,
                             'new_value': str(float_value)
                         })
-                        data_obj.value = float_value
-                        data_obj.save()
+                        rows.append(Data(indicator=indicator, period=period, value=float_value))
                 else:
-                    # Create new data point
-                    Data.objects.create(
-                        indicator=indicator,
-                        period=period,
-                        value=float_value
-                    )
+                    rows.append(Data(indicator=indicator, period=period, value=float_value))
                     changes.append({
                         'period': period,
                         'old_value': 'None',
                         'new_value': str(float_value)
                     })
+            upsert_data(rows)
 
             if changes:
                 # Log the restoration action
-                ActionLog.objects.create(
-                    user=user,
-                    indicator=indicator,
-                    action_type='DATA_UPDATE',
-                    details=changes
-                )
+                log_data_update(indicator, changes, user=user)
 
 
 
@@ -1418,30 +1423,26 @@ def create_custom_indicator(request, indicator_id):
             # Retrieve all unique periods from base indicators
             periods = Data.objects.filter(indicator__in=base_indicators).values_list('period', flat=True).distinct()
 
+            periods = list(periods)
+            current = dict(Data.objects.filter(indicator=indicator, period__in=periods).values_list('period', 'value'))
+
             changes = []
+            rows = []
             # Generate calculated values for the new custom indicator
             for period in periods:
                 computed_value = custom_indicator.calculate_value(period)
                 if computed_value is not None:
-                    data_entry, created = Data.objects.get_or_create(
-                        indicator=indicator,
-                        period=period,
-                        defaults={'value': computed_value}
-                    )
-                    if not created:
-                        old_value = data_entry.value
+                    if period not in current:
+                        rows.append(Data(indicator=indicator, period=period, value=computed_value))
+                    else:
+                        old_value = current[period]
                         if old_value is None or f"{old_value:.5f}" != f"{float(computed_value):.5f}":
                             changes.append({'period': period, 'old_value': str(old_value), 'new_value': str(computed_value)})
-                            data_entry.value = computed_value
-                            data_entry.save()
+                            rows.append(Data(indicator=indicator, period=period, value=computed_value))
+            upsert_data(rows)
 
             if changes:
-                ActionLog.objects.create(
-                    user=get_user(request),
-                    indicator=indicator,
-                    action_type='DATA_UPDATE',
-                    details=changes
-                )
+                log_data_update(indicator, changes, user=get_user(request))
 
 
 
@@ -1565,7 +1566,8 @@ def user_activity(request, user_id):
                 return JsonResponse({'error': f'User with id {user_id} not found'}, status=404)
 
             # Get all action logs for this user
-            action_logs = ActionLog.objects.filter(user=target_user).order_by('-timestamp')
+            action_logs = ActionLog.objects.filter(user=target_user).select_related('indicator').order_by('-timestamp')
+            changes_by_log = details_by_log(log.id for log in action_logs if log.action_type == 'DATA_UPDATE')
 
             # Group by indicators and action types
             grouped_activity = {}
@@ -1587,19 +1589,19 @@ def user_activity(request, user_id):
                     formatted_time = log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
 
                     # Process different types of actions
-                    action_details = {
+                    log_details = action_details(log, changes_by_log)
+                    action = {
                         'action_type': log.action_type,
                         'timestamp': formatted_time,
-                        'details': log.details
+                        'details': log_details
                     }
 
                     # Add specific processing for different action types if needed
                     if log.action_type == 'DATA_UPDATE':
                         # Count the number of data points changed
-                        if isinstance(log.details, list):
-                            action_details['points_changed'] = len(log.details)
+                        action['points_changed'] = len(log_details)
 
-                    grouped_activity[indicator_id]['actions'].append(action_details)
+                    grouped_activity[indicator_id]['actions'].append(action)
 
             # Convert to a format better for frontend rendering
             activity_list = []
@@ -1778,31 +1780,45 @@ def followed_user_activity(request):
             page_size = int(request.GET.get('page_size', 10))
 
             followed_users = UserFollowsUser.objects.get(user=user).followed_users.all()
+            # Newest first; details are only loaded for the requested page
+            action_logs = (
+                ActionLog.objects.filter(user__in=followed_users)
+                .select_related('user', 'indicator')
+                .defer('details')
+                .order_by('-timestamp')
+            )
+            can_view = {}
             activity = []
-            for followed_user in followed_users:
-                action_logs = ActionLog.objects.filter(user=followed_user)
-                for log in action_logs:
-                    if check_indicator_permission(user, log.indicator, 'view'):
-                        activity_item = {
-                            'user': followed_user.email,
-                            'action': log.action_type,
-                            'indicator': log.indicator.name,
-                            'indicator_id': log.indicator.id,
-                            'details': log.details,
-                            'timestamp': log.timestamp
-                        }
-                        activity.append(activity_item)
-
-            # Sort by timestamp, newest first
-            sorted_activity = sorted(activity, key=lambda x: x['timestamp'], reverse=True)
+            for log in action_logs:
+                if log.indicator_id not in can_view:
+                    can_view[log.indicator_id] = check_indicator_permission(user, log.indicator, 'view')
+                if can_view[log.indicator_id]:
+                    activity.append(log)
 
             # Apply pagination
-            total_items = len(sorted_activity)
+            total_items = len(activity)
             start_idx = (page - 1) * page_size
             end_idx = start_idx + page_size
-            paginated_results = sorted_activity[start_idx:end_idx]
+            page_logs = activity[start_idx:end_idx]
             has_more = end_idx < total_items
 
+            changes_by_log = details_by_log(log.id for log in page_logs if log.action_type == 'DATA_UPDATE')
+            other_details = dict(
+                ActionLog.objects.filter(id__in=[log.id for log in page_logs if log.action_type != 'DATA_UPDATE'])
+                .values_list('id', 'details')
+            )
+            paginated_results = [
+                {
+                    'user': log.user.email,
+                    'action': log.action_type,
+                    'indicator': log.indicator.name,
+                    'indicator_id': log.indicator.id,
+                    'details': changes_by_log[log.id] if log.action_type == 'DATA_UPDATE' else other_details.get(log.id),
+                    'timestamp': log.timestamp
+                }
+                for log in page_logs
+            ]
+
             return JsonResponse({
                 'results': paginated_results,
                 'has_more': has_more,
@@ -1842,8 +1858,14 @@ def favourite_indicator_activity(request):
 
             info = []
             data_changes = []
+            logs_by_indicator = {}
+            for log in ActionLog.objects.filter(indicator__in=favourite_indicators).select_related('indicator'):
+                logs_by_indicator.setdefault(log.indicator_id, []).append(log)
+            changes_by_log = details_by_log(
+                log.id for logs in logs_by_indicator.values() for log in logs if log.action_type == 'DATA_UPDATE'
+            )
             for indicator in favourite_indicators:
-                action_logs = ActionLog.objects.filter(indicator=indicator)
+                action_logs = logs_by_indicator.get(indicator.id, [])
                 for log in action_logs:
                     if not check_indicator_permission(user, log.indicator, 'view'):
                         continue
@@ -1857,12 +1879,17 @@ def favourite_indicator_activity(request):
                                 'timestamp': log.timestamp,
                             })
                         elif log.action_type == 'DATA_UPDATE':
-                            for detail in log.details:
+                            log_details = changes_by_log.get(log.id, [])
+                            for detail in log_details:
                                 if detail.get('old_value') == 'None':
-                                    indicator_data_sorted = Data.objects.filter(indicator=indicator).order_by('period')
                                     period_of_change = detail.get('period')
                                     value_of_change = detail.get('new_value')
-                                    previous_period_data = indicator_data_sorted.filter(period__lt=period_of_change).last()
+                                    start_of_change = period_fields(period_of_change)['period_start']
+                                    previous_period_data = (
+                                        Data.objects.filter(indicator=indicator, period_start__lt=start_of_change)
+                                        .order_by(*PERIOD_ORDERING).last()
+                                        if start_of_change else None
+                                    )
                                     if previous_period_data:
                                         try:
                                             prev_value = float(previous_period_data.value)
@@ -1913,15 +1940,15 @@ def favourite_indicator_activity(request):
                                         'type': 'UPDATED',
                                         'indicator_id': log.indicator.id,
                                         'indicator': log.indicator.name,
-                                        'details': log.details,
+                                        'details': log_details,
                                         'period': detail.get('period'),
                                         'percentage_change': percentage_change,
                                         'timestamp': log.timestamp,
                                     })
                             else:
                                 try:
-                                    previous_value = float(log.details[0].get('old_value'))
-                                    new_value = float(log.details[0].get('new_value'))
+                                    previous_value = float(log_details[0].get('old_value'))
+                                    new_value = float(log_details[0].get('new_value'))
                                     if previous_value == 0:
                                         # Handle division by zero
                                         percentage_change = None
@@ -1934,8 +1961,8 @@ def favourite_indicator_activity(request):
                                     'type': 'UPDATED',
                                     'indicator_id': log.indicator.id,
                                     'indicator': log.indicator.name,
-                                    'details': log.details,
-                                    'period': log.details[0].get('period') if log.details and len(log.details) > 0 else None,
+                                    'details': log_details,
+                                    'period': log_details[0].get('period') if log_details and len(log_details) > 0 else None,
                                     'percentage_change': percentage_change,
                                     'timestamp': log.timestamp,
                                 })
@@ -0,0 +1,44 @@
+import gzip
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import storages
+
+# STORAGES alias the raw payloads are written to; it must not be publicly readable
+ARCHIVE_STORAGE = 'ingestion_archive'
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def archive_payload(workflow_run, body):
+    """
+    Stores a raw upstream payload file gzip-compressed under the run's workflow type and id.
+    The body is streamed through a temporary file and left positioned at 0.
+    Returns (storage name, compressed size in bytes).
+    """
+    workflow = workflow_run.workflow
+    name = f"{workflow.workflow_type.lower()}/{workflow.id}/{workflow_run.id}.gz"
+
+    with tempfile.SpooledTemporaryFile(max_size=settings.STREAMING_SPOOL_MEMORY) as compressed:
+        body.seek(0)
+        with gzip.GzipFile(fileobj=compressed, mode='wb') as gzipped:
+            shutil.copyfileobj(body, gzipped, COPY_CHUNK_SIZE)
+        body.seek(0)
+
+        size = compressed.tell()
+        compressed.seek(0)
+        name = storages[ARCHIVE_STORAGE].save(name, File(compressed, name=name))
+    return name, size
+
+
+def open_payload(name):
+    """
+    Returns an archived payload decompressed into a temporary file positioned at 0.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=settings.STREAMING_SPOOL_MEMORY)
+    with storages[ARCHIVE_STORAGE].open(name, 'rb') as stored, gzip.GzipFile(fileobj=stored, mode='rb') as gzipped:
+        shutil.copyfileobj(gzipped, body, COPY_CHUNK_SIZE)
+    body.seek(0)
+    return body
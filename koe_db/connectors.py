@@ -0,0 +1,512 @@
+import io
+import json
+from urllib.parse import parse_qsl, urlsplit
+
+from koe_db import http_client, pxweb, streaming, structure_cache
+from koe_db.ingestion import parse_decimal
+from koe_db.jsonstat import JsonStatCube, stream_select
+from koe_db.models import CyStatRequest, CyStatIndicatorMapping, ECBRequest, ECBIndicatorMapping, EuroStatRequest, EuroStatIndicatorMapping, Indicator
+from koe_db.pipeline import Connector, ConnectorError, SourceUnchanged, register
+from koe_db.sdmx import ecb_data_url, ecb_series, ecb_time_periods, stream_ecb_series
+from koe_db.upstream import (
+    cleared_validators, combined_validators, conditional_headers, fetch_window_start, is_unchanged, last_successful_start,
+    response_validators, with_query_params
+)
+
+
+def compile_cystat_mappings(mappings, variables, column_codes, content_variables, content_variable_order,
+                            content_variable_name, content_variable_mapping):
+    """
+    Precompiles CyStat indicator mappings for hash-based matching of response rows.
+
+    Each mapping is turned into the tuple of key values expected at the non-period positions
+    of a row key, plus the index of its value in the row's values array.
+
+    Returns (index, fixed_positions, incompatible_code) where index maps a key tuple to a list
+    of (indicator_id, value_index) pairs, fixed_positions lists the row key positions the tuple
+    is built from, and incompatible_code names the first variable a mapping no longer covers.
+    """
+    index = {}
+
+    # Key positions are the period and dimension variables in structure order
+    fixed_positions = []
+    key_length = 0
+    for variable in variables:
+        if variable["code"] in ["QUARTER", "MONTH", "YEAR"]:
+            key_length += 1  # Wildcard for the period variable
+        elif variable["code"] in column_codes:
+            fixed_positions.append(key_length)
+            key_length += 1
+
+    for mapping in mappings:
+        indicator = mapping.indicator
+        keys = mapping.key_indices  # Example: {"MEASURE": "1", "TYPE OF DATA": "1", "NA AGGREGATE": "9"}
+
+        # Determine the correct value index for this indicator based on content variable mapping
+        value_index = 0  # Default to first value
+
+        # Look for the content variable in the mapping keys
+        # The content variable name should match what we found in the structure
+        if content_variable_name and content_variable_name in keys:
+            # Get the value for the content variable from the mapping
+            content_var_value = keys[content_variable_name]
+
+            # This value should correspond to an index in the content variable order
+            try:
+                content_var_index = int(content_var_value)
+
+                # Check if this index exists in our content variable mapping
+                if str(content_var_index) in content_variable_mapping:
+                    # Find the position of this content variable in the response
+                    content_var_code_in_response = str(content_var_index)
+                    if content_var_code_in_response in content_variables:
+                        value_index = content_variables[content_var_code_in_response]
+                        print(f"Mapping indicator {indicator.name} to content variable index {value_index} (code: {content_var_code_in_response}, meaning: {content_variable_mapping.get(content_var_code_in_response, 'Unknown')})")
+                    else:
+                        # If not found in response, use the index directly if it's valid
+                        if 0 <= content_var_index < len(content_variable_order):
+                            value_index = content_var_index
+                            print(f"Using direct index {value_index} for indicator {indicator.name}")
+            except (ValueError, TypeError):
+                print(f"Warning: Could not parse content variable value '{content_var_value}' for indicator {indicator.name}")
+                value_index = 0
+        else:
+            # Fallback: try to find content variable mapping in other ways
+            for var_code, var_value in keys.items():
+                if var_code not in column_codes and var_code not in ["QUARTER", "MONTH", "YEAR"]:
+                    try:
+                        expected_index = int(var_value)
+                        if 0 <= expected_index < len(content_variable_order):
+                            value_index = expected_index
+                            print(f"Fallback: Using content variable index {value_index} for indicator {indicator.name}")
+                            break
+                    except (ValueError, TypeError):
+                        continue
+
+        # Construct the expected key values based on column order, skipping the period variable
+        expected_keys = []
+        for variable in variables:
+            variable_code = variable["code"]
+            if variable_code in column_codes and variable_code not in ["QUARTER", "MONTH", "YEAR"]:
+                # This variable is indexed in the key array
+                if keys.get(variable_code, None) is None:
+                    return {}, [], variable_code
+                expected_keys.append(keys[variable_code])
+            # Content variables are not part of the key array
+
+        index.setdefault(tuple(expected_keys), []).append((mapping.indicator_id, value_index))
+
+    return index, fixed_positions, None
+
+
+def cystat_periods(variables):
+    """
+    Finds the time variable of a CyStat structure.
+    Returns (position of the variable, list of normalised periods) or (None, []) if there is none.
+    """
+    for index, variable in enumerate(variables):
+        if variable.get("code") in ["QUARTER", "MONTH", "YEAR"]:
+            raw_periods = variable.get("valueTexts", [])
+            if variable["code"] == "QUARTER":
+                return index, [period[:4] + "-" + period[4:] for period in raw_periods]
+            if variable["code"] == "MONTH":
+                return index, [period[:4] + "-" + period[5:].zfill(2) for period in raw_periods]
+            return index, raw_periods
+    return None, []
+
+
+@register
+class CyStatConnector(Connector):
+    """
+    Posts the PX-Web query of a CyStat request and matches the returned rows to the mapped indicators.
+    """
+    name = "CyStat"
+    workflow_type = "CYSTAT"
+    request_model = CyStatRequest
+
+    @classmethod
+    def upstream_url(cls, source_request):
+        return source_request.url
+
+    def _load_structure(self, refresh=False):
+        url = self.source_request.url
+        json_data = structure_cache.get_structure(url, refresh=refresh)
+        self.variables = json_data.get("variables", [])
+        self.period_index, self.periods = cystat_periods(self.variables)
+
+    def _query(self, first_index):
+        """
+        Runs the query for the periods from first_index onwards, split into period chunks that
+        are fetched concurrently when it is over CYSTAT_CELL_LIMIT cells.
+        Returns (response data, whether a time selection was added to the query).
+        """
+        cystat_request = self.source_request
+        url = cystat_request.url
+        queries = pxweb.plan_queries(cystat_request.request_body, self.variables, first_index)
+        if not queries:
+            print(f"No CyStat periods from index {first_index} onwards")
+            raise SourceUnchanged()
+        time_selected = queries != [cystat_request.request_body]
+        # The stored validators describe the full query; a windowed query neither sends nor replaces them
+        windowed = self.window_start is not None
+
+        if len(queries) == 1:
+            headers = {} if windowed else conditional_headers(cystat_request)
+            response = http_client.post(url, json=queries[0], headers=headers)
+            response.raise_for_status()
+            responses = [response]
+            validators = response_validators(response)
+        else:
+            print(f"Splitting the CyStat query into {len(queries)} period chunks")
+            responses = pxweb.post_queries(url, queries)
+            for response in responses:
+                response.raise_for_status()
+            validators = combined_validators(responses)
+
+        if windowed:
+            self.validators = cleared_validators()
+        else:
+            self.validators = validators
+            if is_unchanged(cystat_request, responses[0], self.validators):
+                raise SourceUnchanged()
+        if len(responses) == 1:
+            return responses[0].json(), time_selected
+        return pxweb.merge_responses([response.json() for response in responses]), time_selected
+
+    def prepare(self):
+        self.mappings = list(CyStatIndicatorMapping.objects.filter(cystat_request=self.source_request).select_related('indicator'))
+
+    def fetch(self):
+        cystat_request = self.source_request
+        url = cystat_request.url
+
+        # Load the variables and periods, usually from the structure cache
+        try:
+            self._load_structure()
+        except Exception as e:
+            raise ConnectorError(f"Failed to fetch structure from {url}: {e}")
+
+        if self.period_index is None:
+            raise ConnectorError(f"No time-based variable (QUARTER, MONTH, or YEAR) found for {self.workflow.name}")
+
+        # Request periods from start_period, or from the newest stored period minus the lookback
+        self.window_start = fetch_window_start(cystat_request, [mapping.indicator_id for mapping in self.mappings])
+        first_index = max(
+            pxweb.first_period_index(self.periods, cystat_request.start_period),
+            pxweb.first_period_index(self.periods, self.window_start),
+        )
+        if 0 < first_index < len(self.periods):
+            print(f"Fetching CyStat periods from {self.periods[first_index]}")
+
+        # Post the query to the CyStat API, split into period chunks if it is over the cell limit
+        try:
+            response_data, time_selected = self._query(first_index)
+        except SourceUnchanged:
+            raise
+        except Exception as e:
+            raise ConnectorError(f"Failed to execute query for {self.workflow.name}: {e}")
+
+        # A cached structure predates periods published since; reload it once if the data is newer
+        newest_period = max(
+            (int(entry["key"][self.period_index]) for entry in response_data.get("data", []) if len(entry.get("key", [])) > self.period_index),
+            default=-1
+        )
+        if newest_period >= len(self.periods):
+            print(f"Cached structure for {url} is missing new periods, reloading it")
+            self._load_structure(refresh=True)
+            if time_selected:
+                # The period selection was built from the stale structure, so run it again
+                response_data, _ = self._query(first_index)
+
+        return response_data
+
+    def dump(self, response_data):
+        # The rows are only meaningful with the structure they were matched against
+        return io.BytesIO(json.dumps({"variables": self.variables, "response": response_data}).encode())
+
+    def load(self, body):
+        archived = json.load(body)
+        self.variables = archived["variables"]
+        self.period_index, self.periods = cystat_periods(self.variables)
+        return archived["response"]
+
+    def parse(self, response_data):
+        print(f"Processing data for workflow: {self.workflow.name}...")
+        variables = self.variables
+        data = response_data.get("data", [])
+        columns = response_data.get("columns", [])
+        self.rows_parsed = len(data)
+
+        # Create mapping from column codes to their positions in the key array
+        column_codes = []
+        content_variables = {}  # Maps content variable codes to their value index
+        content_variable_order = []  # Ordered list of content variable codes
+
+        for col in columns:
+            if col.get("type") == "c":  # Content variable
+                content_variable_order.append(col["code"])
+                content_variables[col["code"]] = len(content_variable_order) - 1  # Index in values array
+            elif col.get("type") in ["t", "d"]:  # Time or dimension variable
+                column_codes.append(col["code"])
+
+        print(f"Column codes in key array: {column_codes}")
+        print(f"Content variables: {content_variables}")
+        print(f"Content variable order: {content_variable_order}")
+
+        # Find the content variable in the structure data (from GET request)
+        # Content variables are those that appear in the GET response but not as dimension/time columns in POST response
+        content_variable_mapping = {}  # Maps content variable code to its meaning/text
+        content_variable_name = None
+
+        # Find variables that are in GET response but not in POST column_codes (and not time variables)
+        for variable in variables:
+            var_code = variable.get("code")
+            if (var_code not in column_codes and
+                var_code not in ["QUARTER", "MONTH", "YEAR"] and
+                var_code is not None):
+                content_variable_name = var_code
+                # Map each value index to its corresponding text
+                for idx, value_text in enumerate(variable.get("valueTexts", [])):
+                    content_variable_mapping[str(idx)] = value_text
+                print(f"Found content variable mapping: {content_variable_name} -> {content_variable_mapping}")
+                break
+
+        # Compile every mapping once into a key tuple so each row is matched with one lookup
+        mapping_index, fixed_positions, incompatible_code = compile_cystat_mappings(
+            self.mappings,
+            variables,
+            column_codes,
+            content_variables,
+            content_variable_order,
+            content_variable_name,
+            content_variable_mapping
+        )
+        if incompatible_code:
+            raise ConnectorError(f"Variable code '{incompatible_code}' is no longer compatible. Please update workflow")
+
+        indicator_values = {}  # { indicator_id: {period: value} }
+        for entry in data:
+            entry_key = entry["key"]
+            try:
+                lookup_key = tuple(entry_key[i] for i in fixed_positions)
+            except IndexError:
+                continue
+
+            matched = mapping_index.get(lookup_key)
+            if not matched:
+                continue
+
+            # Extract the period using the period index
+            period = self.periods[int(entry_key[self.period_index])]
+
+            for indicator_id, value_index in matched:
+                # Convert value to Decimal
+                if value_index >= len(entry["values"]):
+                    continue
+                dec_value = parse_decimal(entry["values"][value_index])
+                if dec_value is None:
+                    continue
+
+                indicator_values.setdefault(indicator_id, {})[period] = dec_value
+
+        return indicator_values
+
+
+@register
+class ECBConnector(Connector):
+    """
+    Fetches an SDMX-JSON dataset from the ECB API. A multi-series request feeds every
+    ECBIndicatorMapping from a single call; legacy requests have a single indicator.
+    """
+    name = "ECB"
+    workflow_type = "ECB"
+    request_model = ECBRequest
+
+    @classmethod
+    def upstream_url(cls, source_request):
+        return ecb_data_url(source_request.table, source_request.parameters)
+
+    def prepare(self):
+        ecb_request = self.source_request
+        self.mappings = list(ECBIndicatorMapping.objects.filter(ecb_request=ecb_request).select_related('indicator'))
+        self.indicator = None
+        if not self.mappings:
+            try:
+                self.indicator = Indicator.objects.get(id=ecb_request.indicator_id)
+            except Indicator.DoesNotExist:
+                raise ConnectorError(f"Indicator with ID {ecb_request.indicator_id} not found for ECB request {ecb_request.id}")
+
+    def fetch(self):
+        ecb_request = self.source_request
+
+        # Construct the URL
+        url = ecb_data_url(ecb_request.table, ecb_request.parameters)
+
+        # Only ask for recent periods once the indicators hold the history
+        indicator_ids = [mapping.indicator_id for mapping in self.mappings] if self.mappings else [self.indicator.id]
+        self.window_start = fetch_window_start(ecb_request, indicator_ids)
+        updated_after = None
+        if self.window_start:
+            window = {'startPeriod': self.window_start}
+            updated_after = last_successful_start(self.workflow)
+            if updated_after:
+                window['updatedAfter'] = updated_after.isoformat()
+            url = with_query_params(url, window)
+            # The stored validators describe the full history, not this window
+            headers = {}
+            print(f"Fetching ECB observations from {self.window_start}")
+        else:
+            headers = conditional_headers(ecb_request)
+            print("Fetching the full ECB history")
+
+        try:
+            response, body, content_hash = http_client.download(url, headers=headers)
+            if response.status_code == 404 and updated_after and ecb_request.last_full_refresh:
+                # The ECB API answers 404 when nothing was revised after updatedAfter; that only
+                # means unchanged once the full series was ingested, otherwise the run fails below
+                raise SourceUnchanged()
+            response.raise_for_status()
+            if self.window_start:
+                self.validators = cleared_validators()
+            else:
+                self.validators = response_validators(response, content_hash)
+                if is_unchanged(ecb_request, response, self.validators):
+                    raise SourceUnchanged()
+        except SourceUnchanged:
+            raise
+        except Exception as e:
+            raise ConnectorError(f"Failed to fetch data from ECB API: {str(e)}")
+        return body
+
+    def parse(self, body):
+        # Large payloads are streamed and only the mapped series are decoded
+        if streaming.is_large(body):
+            print("Streaming ECB response")
+            series_keys = [mapping.series_key for mapping in self.mappings] if self.mappings else None
+            periods, series = stream_ecb_series(body, series_keys)
+        else:
+            response_data = streaming.load_json(body)
+            periods = ecb_time_periods(response_data)
+            series = ecb_series(response_data)
+
+        if not periods:
+            raise ConnectorError("No time periods found in ECB response")
+        self.rows_parsed = sum(len(decoded['values']) for decoded in series.values())
+        print(f"Found {len(periods)} time periods in ECB data")
+
+        # Fan the series out to their indicators
+        series_values = {}  # { indicator_id: {period: value} }
+        if self.mappings:
+            for mapping in self.mappings:
+                mapped_series = series.get(mapping.series_key)
+                if mapped_series is None:
+                    print(f"Series {mapping.series_key} not found in ECB response for indicator {mapping.indicator.name}")
+                    continue
+                series_values[mapping.indicator_id] = mapped_series['values']
+        elif series:
+            # Get values from the first series in the dataset
+            series_values[self.indicator.id] = next(iter(series.values()))['values']
+
+        if not any(series_values.values()):
+            raise ConnectorError("No data values found in ECB response")
+        print(f"Found {sum(len(values) for values in series_values.values())} data points in ECB response")
+
+        # Convert values, skipping missing observations
+        indicator_values = {}
+        for indicator_id, values in series_values.items():
+            decimal_values = {}
+            for period, value in values.items():
+                if value is None:
+                    continue
+                decimal_value = parse_decimal(value)
+                if decimal_value is None:
+                    print(f"Could not convert value {value} to Decimal for period {period}")
+                    continue
+                decimal_values[period] = decimal_value
+            indicator_values[indicator_id] = decimal_values
+        return indicator_values
+
+
+@register
+class EurostatConnector(Connector):
+    """
+    Fetches a JSON-stat dataset from the Eurostat API and selects the observations of each mapping.
+    """
+    name = "Eurostat"
+    workflow_type = "EUROSTAT"
+    request_model = EuroStatRequest
+
+    @classmethod
+    def upstream_url(cls, source_request):
+        return source_request.url
+
+    def prepare(self):
+        self.mappings = list(EuroStatIndicatorMapping.objects.filter(eurostat_request=self.source_request).select_related('indicator'))
+        if not self.mappings:
+            raise ConnectorError(f"No indicator mappings found for Eurostat request {self.source_request.id}")
+
+    def fetch(self):
+        eurostat_request = self.source_request
+
+        # Only ask for recent periods once the indicators hold the history; a URL with its own time filter is kept as is
+        url = eurostat_request.url
+        query_keys = {key for key, _ in parse_qsl(urlsplit(url).query)}
+        if not query_keys & {'time', 'sinceTimePeriod', 'untilTimePeriod', 'lastTimePeriod'}:
+            self.window_start = fetch_window_start(eurostat_request, [mapping.indicator_id for mapping in self.mappings])
+        if self.window_start:
+            url = with_query_params(url, {'sinceTimePeriod': self.window_start})
+            # The stored validators describe the full dataset, not this window
+            headers = {}
+            print(f"Fetching Eurostat observations from {self.window_start}")
+        else:
+            headers = conditional_headers(eurostat_request)
+            print("Fetching the full Eurostat dataset")
+
+        try:
+            response, body, content_hash = http_client.download(url, headers=headers)
+            response.raise_for_status()
+            if self.window_start:
+                self.validators = cleared_validators()
+            else:
+                self.validators = response_validators(response, content_hash)
+                if is_unchanged(eurostat_request, response, self.validators):
+                    raise SourceUnchanged()
+        except SourceUnchanged:
+            raise
+        except Exception as e:
+            raise ConnectorError(f"Failed to fetch data from Eurostat API: {str(e)}")
+        return body
+
+    def parse(self, body):
+        # Select the observations of every mapping in one pass over the dataset
+        selections = {mapping.id: mapping.dimension_values or {} for mapping in self.mappings}
+        if streaming.is_large(body):
+            # Large datasets are streamed in chunks, keeping only the mapped observations
+            print("Streaming Eurostat response")
+            selected = stream_select(body, selections)
+        else:
+            # Decode the flat value index once and select every mapping in one pass
+            cube = JsonStatCube(streaming.load_json(body))
+            self.rows_parsed = len(cube.positions)
+            print(f"Dimension sizes: {cube.dimension_sizes}")
+            print(f"Size products: {cube.size_products}")
+            selected = cube.select_many(selections)
+
+        indicator_values = {}  # { indicator_id: {period: value} }
+        for mapping in self.mappings:
+            try:
+                indicator = mapping.indicator
+                print(f"Processing data for indicator: {indicator.name} ({indicator.id})")
+
+                values = {}
+                for period, value in selected[mapping.id]:
+                    decimal_value = parse_decimal(value)
+                    if decimal_value is None:
+                        print(f"Invalid value {value} for period {period} in indicator {indicator.name}")
+                        continue
+                    values[period] = decimal_value
+
+                indicator_values[indicator.id] = values
+            except Exception as e:
+                print(f"Error processing mapping for indicator {mapping.indicator_id}: {str(e)}")
+        return indicator_values
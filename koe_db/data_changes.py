@@ -0,0 +1,101 @@
+from koe_db.models import ActionLog, Data, DataChange
+
+# Number of change rows inserted per bulk statement
+BULK_BATCH_SIZE = 1000
+
+
+def change_rows(action_log, changes, created_ids=frozenset()):
+    """
+    Returns unsaved DataChange rows for a list of change dicts ('period', 'old_value',
+    'new_value' and optionally 'data_id'), in the format DATA_UPDATE details used to hold.
+    created_ids are the ids of the Data rows the changes inserted.
+    """
+    return [
+        DataChange(
+            action_log=action_log,
+            indicator_id=action_log.indicator_id,
+            period=change.get('period'),
+            data_id=change.get('data_id'),
+            old_value=change.get('old_value'),
+            new_value=change.get('new_value'),
+            created=change.get('data_id') in created_ids,
+            timestamp=action_log.timestamp,
+        )
+        for change in changes
+    ]
+
+
+def log_data_updates(indicator_changes, user=None, run=None, created_ids=frozenset()):
+    """
+    Logs {indicator_id: [change, ...]} as one DATA_UPDATE ActionLog header per indicator with
+    one DataChange row per point. Returns the ActionLogs.
+
+    The DataChange rows of a run are also its rollback record, see run_changes.
+    """
+    action_logs = ActionLog.objects.bulk_create([
+        ActionLog(user=user, indicator_id=indicator_id, run=run, action_type='DATA_UPDATE', details=[])
+        for indicator_id, changes in indicator_changes.items()
+    ])
+    rows = []
+    for action_log, changes in zip(action_logs, indicator_changes.values()):
+        rows.extend(change_rows(action_log, changes, created_ids))
+    DataChange.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+    return action_logs
+
+
+def log_data_update(indicator, changes, user=None):
+    """
+    Logs the changes of one indicator, see log_data_updates.
+    """
+    return log_data_updates({indicator.id: changes}, user=user)[0]
+
+
+def run_changes(workflow_run):
+    """
+    Returns the changes a workflow run committed, read back from its DataChange rows, as
+    (indicator_id, change, created Data row or None) tuples for revert_indicator_changes.
+    """
+    rows = (
+        DataChange.objects.filter(action_log__run=workflow_run, action_log__action_type='DATA_UPDATE')
+        .order_by('id')
+        .values_list('indicator_id', 'period', 'data_id', 'old_value', 'new_value', 'created')
+    )
+    return [
+        (
+            indicator_id,
+            {'period': period, 'data_id': data_id, 'old_value': old_value, 'new_value': new_value},
+            Data(id=data_id, indicator_id=indicator_id, period=period) if created else None,
+        )
+        for indicator_id, period, data_id, old_value, new_value, created in rows.iterator(chunk_size=BULK_BATCH_SIZE)
+    ]
+
+
+def details_by_log(action_log_ids):
+    """
+    Returns {action_log_id: [change, ...]} for DATA_UPDATE ActionLogs, in the format their
+    details used to hold, read from the DataChange index instead of JSON.
+    """
+    details = {action_log_id: [] for action_log_id in action_log_ids}
+    if not details:
+        return details
+    rows = (
+        DataChange.objects.filter(action_log_id__in=list(details))
+        .order_by('action_log_id', 'id')
+        .values_list('action_log_id', 'period', 'data_id', 'old_value', 'new_value')
+    )
+    for action_log_id, period, data_id, old_value, new_value in rows:
+        change = {'period': period, 'old_value': old_value, 'new_value': new_value}
+        if data_id is not None:
+            change['data_id'] = data_id
+        details[action_log_id].append(change)
+    return details
+
+
+def action_details(action_log, changes_by_log):
+    """
+    Returns what an ActionLog's details held: the point changes of DATA_UPDATE logs come from
+    changes_by_log (see details_by_log), other actions keep their details.
+    """
+    if action_log.action_type == 'DATA_UPDATE':
+        return changes_by_log.get(action_log.id, [])
+    return action_log.details
@@ -0,0 +1,194 @@
+import hashlib
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Upstream statuses worth retrying; anything else is returned to the caller as-is
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_sessions = {}  # {scheme://host: requests.Session}
+_sessions_lock = threading.Lock()
+_host_slots = {}  # {host: threading.BoundedSemaphore}
+_recorders = threading.local()
+
+
+def _new_session():
+    retry = Retry(
+        total=settings.HTTP_MAX_RETRIES,
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        # PX-Web queries are POSTed but are read-only, so they are safe to retry
+        allowed_methods=frozenset(['GET', 'HEAD', 'POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.HTTP_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+    return session
+
+
+def get_session(url):
+    """
+    Returns the pooled keep-alive session for the host of the given URL.
+    """
+    parts = urlsplit(url)
+    host_key = f"{parts.scheme}://{parts.netloc}"
+    session = _sessions.get(host_key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(host_key)
+            if session is None:
+                session = _new_session()
+                _sessions[host_key] = session
+    return session
+
+
+def _host_slot(url):
+    # Caps the concurrent requests a process makes to one upstream host
+    host = urlsplit(url).netloc
+    slot = _host_slots.get(host)
+    if slot is None:
+        with _sessions_lock:
+            slot = _host_slots.setdefault(host, threading.BoundedSemaphore(settings.HTTP_HOST_CONCURRENCY))
+    return slot
+
+
+@contextmanager
+def record_calls():
+    """
+    Collects the stats of every upstream call made by this thread inside the block.
+
+        with http_client.record_calls() as calls:
+            http_client.get(url)
+        calls[0]['bytes'], calls[0]['elapsed_ms']
+    """
+    calls = []
+    stack = getattr(_recorders, 'stack', None)
+    if stack is None:
+        stack = _recorders.stack = []
+    stack.append(calls)
+    try:
+        yield calls
+    finally:
+        stack.remove(calls)
+
+
+def bind_recorders(function):
+    """
+    Wraps a function so the upstream calls it makes on another thread (e.g. in a thread pool)
+    are handed to the record_calls() blocks active on the calling thread.
+    """
+    stack = list(getattr(_recorders, 'stack', None) or [])
+
+    def bound(*args, **kwargs):
+        previous = getattr(_recorders, 'stack', None)
+        _recorders.stack = list(stack)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _recorders.stack = previous
+
+    return bound
+
+
+def _record(stats):
+    for calls in getattr(_recorders, 'stack', None) or []:
+        calls.append(stats)
+
+
+def _finish(method, url, response, started, body_bytes, wire_bytes):
+    stats = {
+        'method': method,
+        'host': urlsplit(url).netloc,
+        'status': response.status_code,
+        'bytes': body_bytes,
+        'wire_bytes': wire_bytes,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    _record(stats)
+    print(f"HTTP {method} {stats['host']} {stats['status']}: {body_bytes} bytes ({wire_bytes} on the wire) in {stats['elapsed_ms']} ms")
+
+
+def _timeout(timeout):
+    if timeout is None:
+        return (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    return timeout
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Performs an upstream request through the pooled session of its host.
+
+    Connect/read timeouts default to HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT, failed connections and
+    retryable statuses are retried with exponential backoff, and the response size and latency are
+    printed and handed to any active record_calls() block. At most HTTP_HOST_CONCURRENCY requests
+    per host run at the same time.
+    """
+    with _host_slot(url):
+        started = time.perf_counter()
+        response = get_session(url).request(method, url, timeout=_timeout(timeout), **kwargs)
+
+    body_bytes = len(response.content)
+    try:
+        # Bytes read from the socket, i.e. before gzip decoding
+        wire_bytes = response.raw.tell()
+    except Exception:
+        wire_bytes = body_bytes
+
+    _finish(method, url, response, started, body_bytes, wire_bytes)
+    return response
+
+
+def download(url, method='GET', timeout=None, chunk_size=DOWNLOAD_CHUNK_SIZE, **kwargs):
+    """
+    Streams a response body into a temporary file instead of holding it in memory.
+
+    The file stays in memory up to STREAMING_SPOOL_MEMORY bytes and spills to disk beyond that.
+    Returns (response, body file positioned at 0, SHA-256 hex digest of the body).
+    """
+    with _host_slot(url):
+        started = time.perf_counter()
+        response = get_session(url).request(method, url, timeout=_timeout(timeout), stream=True, **kwargs)
+
+        body = tempfile.SpooledTemporaryFile(max_size=settings.STREAMING_SPOOL_MEMORY)
+        digest = hashlib.sha256()
+        body_bytes = 0
+        try:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                body.write(chunk)
+                digest.update(chunk)
+                body_bytes += len(chunk)
+            try:
+                wire_bytes = response.raw.tell()
+            except Exception:
+                wire_bytes = body_bytes
+        finally:
+            response.close()
+
+    body.seek(0)
+    _finish(method, url, response, started, body_bytes, wire_bytes)
+    return response, body, digest.hexdigest()
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -0,0 +1,236 @@
+import decimal
+from decimal import Decimal
+
+from django.db import connection
+
+from koe_db.models import Data
+from koe_db.periods_utils import period_fields
+from koe_db import series_cache
+
+# Number of rows sent to the database per bulk statement
+BULK_BATCH_SIZE = 500
+
+_VALUE_QUANTUM = Decimal(1).scaleb(-Data._meta.get_field('value').decimal_places)
+
+
+def parse_decimal(value):
+    """
+    Converts a raw upstream value to Decimal, returning None when it is missing or not numeric.
+    """
+    if value is None:
+        return None
+    try:
+        return Decimal(str(value))
+    except (ValueError, TypeError, decimal.InvalidOperation):
+        return None
+
+
+def _stored_form(value):
+    """
+    Rounds a value the same way the Data.value column does, so unchanged values are not rewritten.
+    """
+    if value is None:
+        return None
+    try:
+        return value.quantize(_VALUE_QUANTUM)
+    except decimal.InvalidOperation:
+        return value
+
+
+def upsert_data(rows, update_fields=('value',)):
+    """
+    Writes Data rows keyed by (indicator, period) with INSERT ... ON CONFLICT DO UPDATE, one
+    statement per BULK_BATCH_SIZE rows. Existing rows get update_fields from the new row, unless
+    those already hold the same values, in which case they are not touched at all.
+
+    rows are unsaved Data instances; when a key repeats the last row wins. Their period_start
+    and period_frequency are filled from period.
+    Returns {(indicator_id, period): data_id} of the rows inserted or changed.
+    """
+    by_key = {(row.indicator_id, row.period): row for row in rows}
+    if not by_key:
+        return {}
+
+    quote = connection.ops.quote_name
+    table = quote(Data._meta.db_table)
+    # Periods repeat across indicators, so each one is parsed once
+    parsed = {}
+    for row in by_key.values():
+        if row.period not in parsed:
+            parsed[row.period] = period_fields(row.period)
+        row.period_start = parsed[row.period]['period_start']
+        row.period_frequency = parsed[row.period]['period_frequency']
+
+    fields = [
+        Data._meta.get_field(name)
+        for name in ('indicator', 'period', 'value', 'isEstimate', 'period_start', 'period_frequency')
+    ]
+    columns = ', '.join(quote(field.column) for field in fields)
+    update_columns = [quote(Data._meta.get_field(name).column) for name in update_fields]
+    # SQLite spells IS DISTINCT FROM as IS NOT
+    distinct = 'IS DISTINCT FROM' if connection.vendor == 'postgresql' else 'IS NOT'
+    conflict = (
+        f"ON CONFLICT ({quote('indicator_id')}, {quote('period')}) DO UPDATE SET "
+        + ', '.join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+        + " WHERE "
+        + ' OR '.join(f"{table}.{column} {distinct} EXCLUDED.{column}" for column in update_columns)
+    )
+    row_placeholder = f"({', '.join(['%s'] * len(fields))})"
+
+    written = {}
+    rows = list(by_key.values())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            batch = rows[start:start + BULK_BATCH_SIZE]
+            params = [
+                field.get_db_prep_save(getattr(row, field.attname), connection)
+                for row in batch for field in fields
+            ]
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES {', '.join([row_placeholder] * len(batch))} "
+                f"{conflict} RETURNING {quote('id')}, {quote('indicator_id')}, {quote('period')}",
+                params
+            )
+            for data_id, indicator_id, period in cursor.fetchall():
+                written[(indicator_id, period)] = data_id
+    series_cache.invalidate(indicator_id for indicator_id, _ in written)
+    return written
+
+
+def diff_indicator_values(values_by_indicator):
+    """
+    Compares incoming observations with the stored ones without writing anything.
+
+    values_by_indicator maps an indicator id to a {period: Decimal} dict. The existing
+    (indicator, period) -> value map is loaded with a single query and the diff is computed
+    in memory. Returns (rows to create, rows to update, changes) for apply_indicator_diff.
+    """
+    values_by_indicator = {
+        indicator_id: values for indicator_id, values in values_by_indicator.items() if values
+    }
+    if not values_by_indicator:
+        return [], [], []
+
+    # Load the current values once
+    existing = {}
+    rows = Data.objects.filter(
+        indicator_id__in=list(values_by_indicator.keys())
+    ).order_by('id').values_list('id', 'indicator_id', 'period', 'value')
+    for data_id, indicator_id, period, value in rows.iterator(chunk_size=5000):
+        existing[(indicator_id, period)] = (data_id, value)
+
+    to_update = []
+    to_create = []
+    changes = []  # (indicator_id, change, new row) in input order; data_id filled in after create
+
+    for indicator_id, values in values_by_indicator.items():
+        for period, new_value in values.items():
+            current = existing.get((indicator_id, period))
+            if current:
+                data_id, old_value = current
+                if _stored_form(old_value) == _stored_form(new_value):
+                    continue
+                to_update.append(Data(id=data_id, indicator_id=indicator_id, period=period, value=new_value))
+                changes.append((indicator_id, {
+                    'period': period,
+                    'data_id': data_id,
+                    'old_value': str(old_value),
+                    'new_value': str(new_value)
+                }, None))
+            else:
+                new_data = Data(indicator_id=indicator_id, period=period, value=new_value)
+                to_create.append(new_data)
+                changes.append((indicator_id, {
+                    'period': period,
+                    'data_id': None,
+                    'old_value': 'None',
+                    'new_value': str(new_value)
+                }, new_data))
+
+    return to_create, to_update, changes
+
+
+def apply_indicator_diff(to_create, to_update, changes):
+    """
+    Writes a diff from diff_indicator_values with upsert_data.
+
+    Returns {indicator_id: [change, ...]} where each change has the format logged by
+    data_changes.log_data_updates ('period', 'data_id', 'old_value', 'new_value').
+    """
+    written = upsert_data(to_create + to_update)
+
+    indicator_changes = {}
+    for indicator_id, change, new_data in changes:
+        if new_data is not None:
+            new_data.id = change['data_id'] = written.get((indicator_id, change['period']))
+        indicator_changes.setdefault(indicator_id, []).append(change)
+
+    print(f"Ingestion writer: {len(to_create)} created, {len(to_update)} updated")
+    return indicator_changes
+
+
+def batch_indicator_diff(to_create, to_update, changes, batch_size):
+    """
+    Splits a diff from diff_indicator_values into batches of at most batch_size changes, to be
+    applied in separate transactions. A large indicator spans several batches, each logging its
+    part of the indicator's changes. Yields (rows to create, rows to update, changes) per batch.
+    """
+    updates_by_id = {data.id: data for data in to_update}
+    batch = ([], [], [])
+    for indicator_id, change, new_data in changes:
+        if len(batch[2]) >= batch_size:
+            yield batch
+            batch = ([], [], [])
+        if new_data is not None:
+            batch[0].append(new_data)
+        else:
+            batch[1].append(updates_by_id[change['data_id']])
+        batch[2].append((indicator_id, change, new_data))
+    if batch[2]:
+        yield batch
+
+
+def revert_indicator_changes(changes):
+    """
+    Undoes changes applied by apply_indicator_diff: created rows are deleted and updated rows get
+    their old value back. Rows whose value was edited again since are left alone.
+    Returns the number of rows reverted.
+    """
+    expected = {}  # data_id -> (value written by the run, value to restore, whether the row was created)
+    for _, change, new_data in changes:
+        if change['data_id'] is None:
+            continue
+        expected[change['data_id']] = (
+            _stored_form(parse_decimal(change['new_value'])),
+            parse_decimal(change['old_value']),
+            new_data is not None
+        )
+
+    to_delete = []
+    to_restore = []
+    data_ids = list(expected)
+    for start in range(0, len(data_ids), BULK_BATCH_SIZE):
+        current = Data.objects.filter(id__in=data_ids[start:start + BULK_BATCH_SIZE]).values_list('id', 'value')
+        for data_id, value in current:
+            written, old_value, created = expected[data_id]
+            if _stored_form(value) != written:
+                continue
+            if created:
+                to_delete.append(data_id)
+            else:
+                to_restore.append(Data(id=data_id, value=old_value))
+
+    for start in range(0, len(to_delete), BULK_BATCH_SIZE):
+        Data.objects.filter(id__in=to_delete[start:start + BULK_BATCH_SIZE]).delete()
+    if to_restore:
+        Data.objects.bulk_update(to_restore, ['value'], batch_size=BULK_BATCH_SIZE)
+    series_cache.invalidate(indicator_id for indicator_id, _, _ in changes)
+    return len(to_delete) + len(to_restore)
+
+
+def write_indicator_values(values_by_indicator):
+    """
+    Writes observations for any number of indicators using a fixed number of queries.
+    Returns the changes per indicator, see apply_indicator_diff.
+    """
+    return apply_indicator_diff(*diff_indicator_values(values_by_indicator))
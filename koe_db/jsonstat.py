@@ -0,0 +1,194 @@
+import numpy as np
+
+from koe_db.streaming import json_map_chunks, json_members
+
+# Observations decoded per NumPy batch when a dataset is streamed
+STREAM_CHUNK_SIZE = 200_000
+
+# Top-level members needed to locate observations; 'value' and 'status' are never loaded whole
+METADATA_KEYS = ('version', 'class', 'label', 'title', 'source', 'updated', 'id', 'size', 'dimension')
+
+
+class JsonStatCube:
+    """
+    Vectorized view over a JSON-stat 2.0 dataset (the format returned by the Eurostat API).
+
+    The flat 'value' keys are decoded once into a NumPy integer array and unravelled into
+    per-dimension category positions, so selecting the observations of a mapping is a
+    handful of boolean mask operations instead of a Python loop over every value.
+    """
+
+    def __init__(self, json_data):
+        dimension_data = json_data.get('dimension', {})
+
+        # Dimension order defines the row-major layout of the flat value index
+        self.dimension_keys = list(json_data.get('id') or dimension_data.keys())
+        self.dimension_sizes = {}
+        self.category_indices = {}  # {dimension: {category: position}}
+        self.category_keys = {}  # {dimension: array of categories ordered by position}
+
+        for dim_key in self.dimension_keys:
+            category_index = dimension_data.get(dim_key, {}).get('category', {}).get('index', {})
+            if isinstance(category_index, list):
+                category_index = {cat_key: position for position, cat_key in enumerate(category_index)}
+
+            self.category_indices[dim_key] = dict(category_index)
+            self.dimension_sizes[dim_key] = len(category_index)
+
+            ordered = np.empty(len(category_index), dtype=object)
+            for cat_key, position in category_index.items():
+                ordered[position] = cat_key
+            self.category_keys[dim_key] = ordered
+
+        # Calculate size products (last dimension changes fastest)
+        self.size_products = {}
+        running_product = 1
+        for dim_key in reversed(self.dimension_keys):
+            self.size_products[dim_key] = running_product
+            running_product *= self.dimension_sizes.get(dim_key, 1) or 1
+
+        self.load_values(json_data.get('value', {}))
+
+    def load_values(self, raw_values):
+        """
+        Replaces the observations of the cube, e.g. with the next chunk of a streamed dataset.
+        """
+        self.positions, self.values = self._decode_values(raw_values)
+        self._coordinates = {}
+
+    @staticmethod
+    def _decode_values(raw_values):
+        if isinstance(raw_values, list):
+            positions = np.arange(len(raw_values), dtype=np.int64)
+            observations = raw_values
+        else:
+            positions = np.fromiter((int(key) for key in raw_values.keys()), dtype=np.int64, count=len(raw_values))
+            observations = list(raw_values.values())
+
+        try:
+            values = np.array([np.nan if value is None else value for value in observations], dtype=np.float64)
+        except (ValueError, TypeError):
+            # Non-numeric observations are kept as-is and rejected later by the Decimal conversion
+            values = np.array(observations, dtype=object)
+
+        return positions, values
+
+    def coordinates(self, dim_key):
+        """
+        Returns the category position of every observation along one dimension.
+        """
+        if dim_key not in self._coordinates:
+            size = self.dimension_sizes.get(dim_key, 0)
+            if size > 0:
+                self._coordinates[dim_key] = (self.positions // self.size_products[dim_key]) % size
+            else:
+                self._coordinates[dim_key] = np.zeros(len(self.positions), dtype=np.int64)
+        return self._coordinates[dim_key]
+
+    def select(self, dimension_values, time_dimension='time'):
+        """
+        Returns [(period, value), ...] for the observations matching the given
+        {dimension: category} selection. Missing (null) observations are skipped.
+        """
+        mask = np.ones(len(self.positions), dtype=bool)
+
+        for dim_key in self.dimension_keys:
+            if dim_key == time_dimension or dim_key not in dimension_values:
+                continue
+            if self.dimension_sizes.get(dim_key, 0) == 0:
+                continue
+
+            category_position = self.category_indices[dim_key].get(dimension_values[dim_key])
+            if category_position is None:
+                return []
+            mask &= self.coordinates(dim_key) == category_position
+
+        if self.values.dtype == np.float64:
+            mask &= ~np.isnan(self.values)
+        else:
+            mask &= np.array([value is not None for value in self.values], dtype=bool)
+
+        if self.dimension_sizes.get(time_dimension, 0) == 0:
+            return []
+
+        periods = self.category_keys[time_dimension][self.coordinates(time_dimension)[mask]]
+        return list(zip(periods.tolist(), self.values[mask].tolist()))
+
+
+    def select_many(self, selections, time_dimension='time'):
+        """
+        Selects the observations of many {dimension: category} selections in one pass.
+
+        Each observation's categories along the selected dimensions are combined into one code,
+        the observations are sorted by it once and every selection is then a binary search, instead
+        of a mask over all observations per selection. selections maps any key to a selection;
+        returns {key: [(period, value), ...]} with the same content and order as select().
+        """
+        selected = {key: [] for key in selections}
+        if self.dimension_sizes.get(time_dimension, 0) == 0 or len(self.positions) == 0:
+            return selected
+
+        if self.values.dtype == np.float64:
+            present = ~np.isnan(self.values)
+        else:
+            present = np.array([value is not None for value in self.values], dtype=bool)
+        present_indices = np.flatnonzero(present)
+        periods = self.category_keys[time_dimension][self.coordinates(time_dimension)[present_indices]]
+        values = self.values[present_indices]
+
+        # Selections constraining the same dimensions share one code per observation
+        groups = {}
+        for key, dimension_values in selections.items():
+            dimensions = tuple(
+                dim_key for dim_key in self.dimension_keys
+                if dim_key != time_dimension and dim_key in dimension_values and self.dimension_sizes.get(dim_key, 0)
+            )
+            groups.setdefault(dimensions, []).append(key)
+
+        for dimensions, keys in groups.items():
+            codes = np.zeros(len(present_indices), dtype=np.int64)
+            for dim_key in dimensions:
+                codes = codes * self.dimension_sizes[dim_key] + self.coordinates(dim_key)[present_indices]
+            order = np.argsort(codes, kind='stable')
+            sorted_codes = codes[order]
+
+            for key in keys:
+                code = 0
+                for dim_key in dimensions:
+                    category_position = self.category_indices[dim_key].get(selections[key][dim_key])
+                    if category_position is None:
+                        break
+                    code = code * self.dimension_sizes[dim_key] + category_position
+                else:
+                    start, end = np.searchsorted(sorted_codes, [code, code + 1])
+                    matched = order[start:end]
+                    selected[key] = list(zip(periods[matched].tolist(), values[matched].tolist()))
+        return selected
+
+
+def jsonstat_metadata(body, sample_size=5):
+    """
+    Reads the dimensions and labels of a JSON-stat file without materializing its observations.
+    Only the first sample_size entries of 'value' are kept, for previews.
+    """
+    metadata = json_members(body, METADATA_KEYS)
+    metadata['value'] = next(json_map_chunks(body, 'value', sample_size), {})
+    return metadata
+
+
+def stream_select(body, selections, time_dimension='time', chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Streaming counterpart of JsonStatCube.select for a JSON-stat file.
+
+    selections maps any key to a {dimension: category} selection. Observations are read in
+    chunks of chunk_size and only those matched by a selection are kept, so peak memory is
+    bounded by the chunk size and the mapped data rather than by the dataset size.
+    Returns {key: [(period, value), ...]}.
+    """
+    cube = JsonStatCube(json_members(body, ('id', 'dimension')))
+    selected = {key: [] for key in selections}
+    for raw_values in json_map_chunks(body, 'value', chunk_size):
+        cube.load_values(raw_values)
+        for key, values in cube.select_many(selections, time_dimension).items():
+            selected[key].extend(values)
+    return selected
@@ -0,0 +1,398 @@
+import gc
+import json
+import math
+import multiprocessing
+import os
+import subprocess
+import time
+import tracemalloc
+from contextlib import nullcontext, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from koe_db.celery import app
+from koe_db.models import (
+    CyStatIndicatorMapping, CyStatRequest, ECBIndicatorMapping, ECBRequest, EuroStatIndicatorMapping,
+    EuroStatRequest, Indicator, Workflow, WorkflowRun
+)
+from koe_db.tasks import execute_cystat_request, execute_ecb_request, execute_eurostat_request
+
+SOURCES = ('cystat', 'ecb', 'eurostat')
+
+# Periods of a generated dataset, i.e. 20 years of monthly data, before more series are added
+GENERATED_PERIODS = 240
+
+# Each scenario ingests the dataset, then a revision of every value, then the same revision again
+PHASES = (('insert', 0), ('update', 1), ('unchanged', 1))
+
+
+def _period(position):
+    return f"{2000 + position // 12}-{position % 12 + 1:02d}"
+
+
+def _value(series, period, version):
+    return f"{((series * 31 + period * 7 + version * 13) % 9973) / 7:.4f}"
+
+
+def _cystat_structure(series, periods):
+    return {
+        "title": "Generated table",
+        "variables": [
+            {"code": "INDICATOR", "text": "Indicator", "values": [str(s) for s in range(series)],
+             "valueTexts": [f"Series {s}" for s in range(series)]},
+            {"code": "MONTH", "text": "Month", "values": [str(t) for t in range(periods)],
+             "valueTexts": [_period(t).replace("-", "M") for t in range(periods)], "time": True},
+        ],
+    }
+
+
+def _cystat_data(series, periods, version, query):
+    """
+    Answers a PX-Web query, honouring 'item' and 'top' selections of either variable.
+    """
+    selected = {"INDICATOR": list(range(series)), "MONTH": list(range(periods))}
+    for item in query.get("query", []):
+        selection = item.get("selection", {})
+        positions = selected.get(item.get("code"))
+        if positions is None:
+            continue
+        if selection.get("filter") == "top":
+            positions = positions[-int(selection["values"][0]):]
+        elif selection.get("filter") == "item":
+            positions = [int(value) for value in selection.get("values", [])]
+        selected[item["code"]] = positions
+
+    parts = ['{"columns":[{"code":"INDICATOR","text":"Indicator","type":"d"},'
+             '{"code":"MONTH","text":"Month","type":"t"},{"code":"VALUE","text":"Value","type":"c"}],"data":[']
+    rows = (
+        f'{{"key":["{s}","{t}"],"values":["{_value(s, t, version)}"]}}'
+        for s in selected["INDICATOR"] for t in selected["MONTH"]
+    )
+    parts.append(",".join(rows))
+    parts.append("]}")
+    return "".join(parts)
+
+
+def _ecb_data(series, periods, version):
+    structure = {
+        "dimensions": {
+            "series": [{"id": "SERIES", "values": [{"id": f"S{s}"} for s in range(series)]}],
+            "observation": [{"id": "TIME_PERIOD", "values": [{"id": _period(t)} for t in range(periods)]}],
+        },
+        "attributes": {"series": []},
+    }
+    parts = ['{"dataSets":[{"series":{']
+    parts.append(",".join(
+        f'"{s}":{{"observations":{{' + ",".join(f'"{t}":[{_value(s, t, version)}]' for t in range(periods)) + '}}'
+        for s in range(series)
+    ))
+    parts.append('}}],"structure":')
+    parts.append(json.dumps(structure))
+    parts.append("}")
+    return "".join(parts)
+
+
+def _eurostat_data(series, periods, version):
+    def category(codes):
+        return {"index": {code: position for position, code in enumerate(codes)}, "label": {code: code for code in codes}}
+
+    parts = ['{"version":"2.0","class":"dataset","label":"Generated dataset","value":{']
+    parts.append(",".join(
+        f'"{s * periods + t}":{_value(s, t, version)}' for s in range(series) for t in range(periods)
+    ))
+    parts.append('},"id":["geo","time"],"size":')
+    parts.append(json.dumps([series, periods]))
+    parts.append(',"dimension":')
+    parts.append(json.dumps({
+        "geo": {"label": "Geopolitical entity", "category": category([f"G{s}" for s in range(series)])},
+        "time": {"label": "Time", "category": category([_period(t) for t in range(periods)])},
+    }))
+    parts.append("}")
+    return "".join(parts)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves generated upstream payloads. The dataset shape is part of the path,
+    /<source>/<series>/<periods>/<version>/..., so the server keeps no state.
+    """
+
+    def _shape(self):
+        parts = urlsplit(self.path).path.strip("/").split("/")
+        return parts[0], int(parts[1]), int(parts[2]), int(parts[3])
+
+    def _send(self, body):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        source, series, periods, version = self._shape()
+        if source == "cystat":
+            self._send(json.dumps(_cystat_structure(series, periods)))
+        elif source == "ecb":
+            self._send(_ecb_data(series, periods, version))
+        elif source == "eurostat":
+            self._send(_eurostat_data(series, periods, version))
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        source, series, periods, version = self._shape()
+        query = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if source != "cystat":
+            self.send_error(405)
+            return
+        self._send(_cystat_data(series, periods, version, query))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(port_pipe):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    port_pipe.send(server.server_address[1])
+    server.serve_forever()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks the CyStat, ECB and Eurostat ingestion tasks against generated payloads served by a "
+        "local stub server, on a throwaway database. Reports wall time, query count, peak memory and "
+        "rows per second per scenario and phase, and saves them as JSON for comparison across commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', default=','.join(SOURCES), help='Comma-separated sources to benchmark')
+        parser.add_argument(
+            '--observations', default='1000,10000,100000,1000000',
+            help='Comma-separated dataset sizes in observations'
+        )
+        parser.add_argument('--mappings', default='1,20,200', help='Comma-separated numbers of mapped indicators')
+        parser.add_argument('--output', default='ingestion_benchmark.json', help='Path of the JSON results')
+        parser.add_argument('--compare', help='Path of earlier JSON results to compare wall times with')
+        parser.add_argument(
+            '--threshold', type=float, default=1.2,
+            help='Wall time ratio over the earlier results reported as a regression'
+        )
+        parser.add_argument(
+            '--no-memory', action='store_true',
+            help='Skip tracemalloc, whose bookkeeping slows allocations down considerably'
+        )
+        parser.add_argument('--verbose', action='store_true', help='Show the output of the ingestion tasks')
+
+    def handle(self, *args, **options):
+        sources = [source for source in options['sources'].split(',') if source]
+        unknown = set(sources) - set(SOURCES)
+        if unknown:
+            raise CommandError(f"Unknown sources: {', '.join(sorted(unknown))}")
+        try:
+            sizes = [int(size) for size in options['observations'].split(',')]
+            mapping_counts = [int(count) for count in options['mappings'].split(',')]
+        except ValueError:
+            raise CommandError('--observations and --mappings take comma-separated integers')
+        previous = self._load_results(options['compare']) if options['compare'] else None
+        # Jobs queued by the tasks, e.g. custom indicator recomputation, run inline without a broker
+        app.conf.task_always_eager = True
+
+        context = multiprocessing.get_context('fork')
+        receiver, sender = context.Pipe(duplex=False)
+        server = context.Process(target=_serve, args=(sender,), daemon=True)
+        server.start()
+        base_url = f"http://127.0.0.1:{receiver.recv()}"
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = []
+        try:
+            with override_settings(
+                CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                ECB_API_URL=f"{base_url}/ecb",
+                INGESTION_ARCHIVE_ENABLED=False,
+            ):
+                for source in sources:
+                    for observations in sizes:
+                        for mappings in mapping_counts:
+                            results.extend(self._run_scenario(base_url, source, observations, mappings, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            server.terminate()
+
+        report = {
+            'commit': self._git_commit(),
+            'created': timezone.now().isoformat(),
+            'memory_traced': not options['no_memory'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(f"Saved {len(results)} results to {options['output']}")
+
+        if previous is not None:
+            if previous.get('memory_traced') != report['memory_traced']:
+                self.stdout.write("Warning: only one of the runs traced memory, wall times are not comparable")
+            self._compare(previous, results, options['threshold'])
+
+    def _run_scenario(self, base_url, source, observations, mappings, options):
+        series = max(mappings, math.ceil(observations / GENERATED_PERIODS))
+        periods = max(1, observations // series)
+        setup, execute = {
+            'cystat': (self._create_cystat, execute_cystat_request),
+            'ecb': (self._create_ecb, execute_ecb_request),
+            'eurostat': (self._create_eurostat, execute_eurostat_request),
+        }[source]
+
+        label = f"{source}-{series * periods}-{mappings}"
+        workflow = Workflow.objects.create(name=label, workflow_type=source.upper(), is_active=False)
+        indicators = Indicator.objects.bulk_create([
+            Indicator(name=f"{label} {position}", code=f"{label}-{position}", description='', source=source)
+            for position in range(mappings)
+        ])
+        source_request = setup(workflow, indicators)
+
+        results = []
+        try:
+            for phase, version in PHASES:
+                self._point_at(source, source_request, base_url, series, periods, version)
+                results.append(self._measure(
+                    execute, source_request.id, workflow, options,
+                    source=source, observations=series * periods, mappings=mappings, phase=phase,
+                ))
+                result = results[-1]
+                memory = f"{result['peak_memory_mb']:8.1f} MB" if result['peak_memory_mb'] is not None else "       - MB"
+                self.stdout.write(
+                    f"{label:>24} {phase:>9}: {result['wall_seconds']:8.2f} s, {result['queries']:6} queries, "
+                    f"peak {memory}, {result['rows_per_second']:10.0f} rows/s ({result['status']})"
+                )
+        finally:
+            workflow.delete()
+            Indicator.objects.filter(id__in=[indicator.id for indicator in indicators]).delete()
+        return results
+
+    @staticmethod
+    def _create_cystat(workflow, indicators):
+        # The query selects the mapped series only, as the mapping screen builds it
+        cystat_request = CyStatRequest.objects.create(
+            workflow=workflow, url='', frequency='Monthly', start_period='', full_refresh_days=0,
+            request_body={
+                "query": [{"code": "INDICATOR", "selection": {"filter": "item", "values": [str(s) for s in range(len(indicators))]}}],
+                "response": {"format": "json"},
+            },
+        )
+        CyStatIndicatorMapping.objects.bulk_create([
+            CyStatIndicatorMapping(cystat_request=cystat_request, indicator=indicator, key_indices={"INDICATOR": str(position)})
+            for position, indicator in enumerate(indicators)
+        ])
+        return cystat_request
+
+    @staticmethod
+    def _create_ecb(workflow, indicators):
+        ecb_request = ECBRequest.objects.create(
+            workflow=workflow, table='', parameters='BENCH', frequency='Monthly', full_refresh_days=0
+        )
+        ECBIndicatorMapping.objects.bulk_create([
+            ECBIndicatorMapping(ecb_request=ecb_request, indicator=indicator, series_key=f"S{position}")
+            for position, indicator in enumerate(indicators)
+        ])
+        return ecb_request
+
+    @staticmethod
+    def _create_eurostat(workflow, indicators):
+        eurostat_request = EuroStatRequest.objects.create(workflow=workflow, url='', frequency='Monthly', full_refresh_days=0)
+        EuroStatIndicatorMapping.objects.bulk_create([
+            EuroStatIndicatorMapping(eurostat_request=eurostat_request, indicator=indicator, dimension_values={"geo": f"G{position}"})
+            for position, indicator in enumerate(indicators)
+        ])
+        return eurostat_request
+
+    @staticmethod
+    def _point_at(source, source_request, base_url, series, periods, version):
+        """
+        Points the request at the stub dataset of the given shape and revision.
+        """
+        shape = f"{series}/{periods}/{version}"
+        if source == 'ecb':
+            source_request.table = shape
+            source_request.save(update_fields=['table'])
+        else:
+            source_request.url = f"{base_url}/{source}/{shape}/BENCH"
+            source_request.save(update_fields=['url'])
+
+    @staticmethod
+    def _measure(execute, source_request_id, workflow, options, **scenario):
+        gc.collect()
+        if not options['no_memory']:
+            tracemalloc.start()
+        peak = None
+        try:
+            with open(os.devnull, 'w') as devnull, CaptureQueriesContext(connection) as queries, \
+                    (nullcontext() if options['verbose'] else redirect_stdout(devnull)):
+                started = time.perf_counter()
+                execute(source_request_id)
+                elapsed = time.perf_counter() - started
+            if not options['no_memory']:
+                peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            if not options['no_memory']:
+                tracemalloc.stop()
+
+        run = WorkflowRun.objects.filter(workflow=workflow).latest('id')
+        rows = run.metrics.get('rows', {})
+        return {
+            **scenario,
+            'status': run.status_message or run.status,
+            'wall_seconds': round(elapsed, 3),
+            'queries': len(queries),
+            'peak_memory_mb': round(peak / 1024 / 1024, 1) if peak is not None else None,
+            'rows': rows,
+            'rows_per_second': round(rows.get('matched', 0) / elapsed, 1) if elapsed else 0,
+            'stages_ms': run.metrics.get('stages_ms', {}),
+            'http': run.metrics.get('http', {}),
+        }
+
+    @staticmethod
+    def _load_results(path):
+        try:
+            with open(path) as previous:
+                return json.load(previous)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not read earlier results from {path}: {e}")
+
+    def _compare(self, previous, results, threshold):
+        def key(result):
+            return result['source'], result['observations'], result['mappings'], result['phase']
+
+        earlier = {key(result): result for result in previous.get('results', [])}
+        self.stdout.write(f"Compared with {previous.get('commit') or 'unknown commit'}:")
+        regressions = 0
+        for result in results:
+            before = earlier.get(key(result))
+            if before is None or not before['wall_seconds']:
+                continue
+            ratio = result['wall_seconds'] / before['wall_seconds']
+            flag = ''
+            if ratio > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            self.stdout.write(
+                f"{'-'.join(str(part) for part in key(result)):>34}: {before['wall_seconds']:8.2f} s -> "
+                f"{result['wall_seconds']:8.2f} s ({ratio:5.2f}x), queries {before['queries']} -> {result['queries']}{flag}"
+            )
+        self.stdout.write(f"{regressions} regressions over {threshold}x")
+
+    @staticmethod
+    def _git_commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
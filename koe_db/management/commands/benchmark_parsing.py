@@ -0,0 +1,149 @@
+import gc
+import json
+import math
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from koe_db.jsonstat import JsonStatCube, stream_select
+from koe_db.sdmx import ecb_series, stream_ecb_series
+from koe_db.streaming import json_members
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares peak memory and time of in-memory and streaming parsing on a recorded "
+        "Eurostat (JSON-stat) or ECB (SDMX-JSON) payload."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('payload', nargs='?', help='Path to a recorded response body')
+        parser.add_argument('--format', choices=['eurostat', 'ecb'], default='eurostat')
+        parser.add_argument(
+            '--select',
+            help='JSON list of Eurostat {dimension: category} selections, or of ECB series keys. '
+                 'Defaults to the first category of every dimension / the first series.'
+        )
+        parser.add_argument(
+            '--generate', type=int, metavar='OBSERVATIONS',
+            help='Benchmark a generated Eurostat dataset of this many observations instead of a recorded payload'
+        )
+
+    def handle(self, *args, **options):
+        payload = options['payload']
+        if options['generate']:
+            payload = self._generate_eurostat(options['generate'])
+            options['format'] = 'eurostat'
+        if not payload:
+            raise CommandError('Pass a recorded payload path or --generate OBSERVATIONS')
+
+        with open(payload, 'rb') as body:
+            body.seek(0, 2)
+            self.stdout.write(f"Payload: {payload} ({body.tell() / 1024 / 1024:.1f} MB)")
+            body.seek(0)
+
+            selections = json.loads(options['select']) if options['select'] else None
+            if options['format'] == 'eurostat':
+                selections = selections or [self._default_eurostat_selection(body)]
+                runs = [
+                    ('in-memory', lambda: self._eurostat_in_memory(body, selections)),
+                    ('streaming', lambda: self._eurostat_streaming(body, selections)),
+                ]
+            else:
+                runs = [
+                    ('in-memory', lambda: self._ecb_in_memory(body, selections)),
+                    ('streaming', lambda: self._ecb_streaming(body, selections)),
+                ]
+
+            for name, run in runs:
+                # Timed without tracemalloc, whose bookkeeping slows allocations down considerably
+                body.seek(0)
+                gc.collect()
+                started = time.perf_counter()
+                observations = run()
+                elapsed = time.perf_counter() - started
+
+                body.seek(0)
+                gc.collect()
+                tracemalloc.start()
+                run()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stdout.write(
+                    f"{name:>10}: {elapsed:8.2f} s, peak {peak / 1024 / 1024:8.1f} MB, {observations} observations selected"
+                )
+
+    @staticmethod
+    def _default_eurostat_selection(body):
+        dimensions = json_members(body, ('dimension',)).get('dimension', {})
+        selection = {}
+        for dim_key, dim_data in dimensions.items():
+            if dim_key == 'time':
+                continue
+            category_index = dim_data.get('category', {}).get('index', {})
+            if isinstance(category_index, list):
+                category_index = {cat_key: position for position, cat_key in enumerate(category_index)}
+            if category_index:
+                selection[dim_key] = min(category_index, key=category_index.get)
+        return selection
+
+    @staticmethod
+    def _eurostat_in_memory(body, selections):
+        cube = JsonStatCube(json.load(body))
+        return sum(len(cube.select(selection)) for selection in selections)
+
+    @staticmethod
+    def _eurostat_streaming(body, selections):
+        selected = stream_select(body, dict(enumerate(selections)))
+        return sum(len(values) for values in selected.values())
+
+    @staticmethod
+    def _ecb_in_memory(body, series_keys):
+        series = ecb_series(json.load(body))
+        if series_keys is None:
+            series = dict(list(series.items())[:1])
+        else:
+            series = {key: series[key] for key in series_keys if key in series}
+        return sum(len(data['values']) for data in series.values())
+
+    @staticmethod
+    def _ecb_streaming(body, series_keys):
+        _, series = stream_ecb_series(body, series_keys)
+        return sum(len(data['values']) for data in series.values())
+
+    def _generate_eurostat(self, observations):
+        """
+        Writes a JSON-stat dataset shaped like a wide Eurostat table (freq x geo x unit x time),
+        with 'value' first as Eurostat sends it, and returns its path.
+        """
+        geos = [f"G{i:02d}" for i in range(40)]
+        units = [f"U{i:02d}" for i in range(25)]
+        periods = [str(2000 + i // 12) + f"-{i % 12 + 1:02d}" for i in range(max(1, math.ceil(observations / (len(geos) * len(units)))))]
+        size = [1, len(geos), len(units), len(periods)]
+        total = len(geos) * len(units) * len(periods)
+
+        def category(codes):
+            return {'index': {code: position for position, code in enumerate(codes)}, 'label': {code: code for code in codes}}
+
+        payload = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        with payload:
+            payload.write('{"version":"2.0","class":"dataset","label":"Generated dataset","value":{')
+            for position in range(total):
+                if position:
+                    payload.write(',')
+                payload.write(f'"{position}":{(position % 9973) / 7:.4f}')
+            payload.write('},"id":["freq","geo","unit","time"],"size":')
+            payload.write(json.dumps(size))
+            payload.write(',"dimension":')
+            payload.write(json.dumps({
+                'freq': {'label': 'Frequency', 'category': category(['M'])},
+                'geo': {'label': 'Geopolitical entity', 'category': category(geos)},
+                'unit': {'label': 'Unit of measure', 'category': category(units)},
+                'time': {'label': 'Time', 'category': category(periods)},
+            }))
+            payload.write('}')
+
+        self.stdout.write(f"Generated {total} observations in {payload.name}")
+        return payload.name
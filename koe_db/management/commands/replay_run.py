@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from koe_db.models import WorkflowRun
+from koe_db.pipeline import ConnectorError, replay_run
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-runs parsing and diffing of a workflow run from its archived upstream payload, "
+        "without network access and without writing to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('run_ids', nargs='+', type=int, help='WorkflowRun ids with an archived payload')
+        parser.add_argument('--json', action='store_true', help='Print the metrics of each replay as JSON')
+
+    def handle(self, *args, **options):
+        results = []
+        for run_id in options['run_ids']:
+            try:
+                metrics = replay_run(run_id)
+            except WorkflowRun.DoesNotExist:
+                raise CommandError(f"Workflow run {run_id} does not exist")
+            except ConnectorError as e:
+                raise CommandError(str(e))
+            results.append(metrics)
+
+            if not options['json']:
+                rows = metrics['rows']
+                stages = ', '.join(f"{stage} {ms:.1f} ms" for stage, ms in metrics['stages_ms'].items())
+                self.stdout.write(
+                    f"Run {run_id}: {rows['matched']} values matched, {rows['inserted']} new, "
+                    f"{rows['updated']} changed, {rows['unchanged']} unchanged ({stages})"
+                )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-16 21:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ecbrequest',
+            name='indicator',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ecb_requests', to='koe_db.indicator'),
+        ),
+        migrations.CreateModel(
+            name='ECBIndicatorMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series_key', models.CharField(max_length=255)),
+                ('ecb_request', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indicator_mappings', to='koe_db.ecbrequest')),
+                ('indicator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ecb_mappings', to='koe_db.indicator')),
+            ],
+            options={
+                'unique_together': {('ecb_request', 'indicator')},
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.6 on 2026-10-16 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0002_alter_ecbrequest_indicator_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='last_modified',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='status_message',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-16 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0003_upstream_validators'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='full_refresh_days',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='last_full_refresh',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ecbrequest',
+            name='revision_lookback',
+            field=models.PositiveIntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='full_refresh_days',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='last_full_refresh',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eurostatrequest',
+            name='revision_lookback',
+            field=models.PositiveIntegerField(default=3),
+        ),
+    ]
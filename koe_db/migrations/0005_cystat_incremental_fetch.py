@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0004_incremental_fetch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='full_refresh_days',
+            field=models.PositiveIntegerField(default=30),
+        ),
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='last_full_refresh',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cystatrequest',
+            name='revision_lookback',
+            field=models.PositiveIntegerField(default=3),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:22
+
+from datetime import datetime
+
+from croniter import croniter
+from django.db import migrations, models
+from django.utils import timezone
+
+LEGACY_TASKS = (
+    'koe_db.tasks.execute_cystat_request',
+    'koe_db.tasks.execute_ecb_request',
+    'koe_db.tasks.execute_eurostat_request',
+)
+
+
+def move_to_dispatcher(apps, schema_editor):
+    # Per-workflow beat entries would run workflows a second time next to dispatch_due_workflows
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTask.objects.filter(task__in=LEGACY_TASKS).delete()
+
+    Workflow = apps.get_model('koe_db', 'Workflow')
+    now = timezone.localtime()
+    for workflow in Workflow.objects.filter(is_active=True, next_run__isnull=True):
+        if croniter.is_valid(workflow.schedule_cron):
+            workflow.next_run = croniter(workflow.schedule_cron, now).get_next(datetime)
+            workflow.save(update_fields=['next_run'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0005_cystat_incremental_fetch'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='workflow',
+            name='next_run',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(move_to_dispatcher, migrations.RunPython.noop),
+    ]
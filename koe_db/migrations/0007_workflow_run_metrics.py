@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0006_workflow_dispatcher'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowrun',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
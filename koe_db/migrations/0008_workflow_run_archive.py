@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0007_workflow_run_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowrun',
+            name='archive_path',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
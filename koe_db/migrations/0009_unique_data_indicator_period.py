@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-16 22:43
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def delete_duplicate_data(apps, schema_editor):
+    # Keep the latest row of every (indicator, period); rows without a period are not unique
+    Data = apps.get_model('koe_db', 'Data')
+    latest = (
+        Data.objects.filter(period__isnull=False)
+        .values('indicator_id', 'period')
+        .annotate(latest_id=Max('id'))
+        .values('latest_id')
+    )
+    deleted, _ = Data.objects.filter(period__isnull=False).exclude(id__in=latest).delete()
+    if deleted:
+        print(f"Deleted {deleted} duplicate data rows")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0008_workflow_run_archive'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_data, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='data',
+            constraint=models.UniqueConstraint(fields=('indicator', 'period'), name='unique_data_indicator_period'),
+        ),
+    ]
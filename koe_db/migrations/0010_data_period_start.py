@@ -0,0 +1,90 @@
+# Generated by Django 5.1.6 on 2026-10-16 23:58
+
+import re
+from datetime import datetime
+
+from django.db import migrations, models
+
+# Frozen copy of periods_utils.parse_period as of this migration, so later parser changes
+# cannot change what the backfill does
+_PERIOD_PATTERNS = [
+    (re.compile(r'^(?P<year>\d{4})$'), 'ANNUAL'),
+    (re.compile(r'^(?P<year>\d{4})-?S(?P<sub>[12])$'), 'SEMIANNUAL'),
+    (re.compile(r'^(?P<year>\d{4})-?T(?P<sub>[1-3])$'), 'TRIANNUAL'),
+    (re.compile(r'^(?P<year>\d{4})-?Q(?P<sub>[1-4])$'), 'QUARTERLY'),
+    (re.compile(r'^(?P<year>\d{4})(?:-M|-|M)(?P<sub>\d{1,2})$'), 'MONTHLY'),
+    (re.compile(r'^(?P<sub>\d{1,2})-(?P<year>\d{4})$'), 'MONTHLY'),
+    (re.compile(r'^(?P<year>\d{4})-?W(?P<week>\d{1,2})$'), 'WEEKLY'),
+    (re.compile(r'^Week (?P<label_week>\d{1,2}) - (?P<year>\d{4})$'), 'WEEKLY'),
+    (re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})$'), 'DAILY'),
+    (re.compile(r'^(?P<day>\d{2})-(?P<month>\d{2})-(?P<year>\d{4})$'), 'DAILY'),
+]
+
+_MONTHS_PER_SUBPERIOD = {'SEMIANNUAL': 6, 'TRIANNUAL': 4, 'QUARTERLY': 3, 'MONTHLY': 1}
+
+
+def _parse_period(period):
+    period = period.strip()
+    for pattern, frequency in _PERIOD_PATTERNS:
+        match = pattern.match(period)
+        if not match:
+            continue
+        groups = match.groupdict()
+        try:
+            year = int(groups['year'])
+            if frequency == 'ANNUAL':
+                return datetime(year, 1, 1), frequency
+            if groups.get('week'):
+                return datetime.fromisocalendar(year, int(groups['week']), 1), frequency
+            if groups.get('label_week'):
+                return datetime.strptime(f"{year} {groups['label_week']} 0", "%Y %U %w"), frequency
+            if frequency == 'DAILY':
+                return datetime(year, int(groups['month']), int(groups['day'])), frequency
+            month = (int(groups['sub']) - 1) * _MONTHS_PER_SUBPERIOD[frequency] + 1
+            return datetime(year, month, 1), frequency
+        except ValueError:
+            return None
+    try:
+        return datetime.fromisoformat(period), None
+    except ValueError:
+        return None
+
+
+def fill_period_start(apps, schema_editor):
+    Data = apps.get_model('koe_db', 'Data')
+    batch = []
+    for row in Data.objects.filter(period__isnull=False).only('id', 'period').iterator(chunk_size=5000):
+        parsed = _parse_period(row.period) if row.period else None
+        row.period_start = parsed[0].date() if parsed else None
+        row.period_frequency = parsed[1] if parsed else None
+        batch.append(row)
+        if len(batch) >= 5000:
+            Data.objects.bulk_update(batch, ['period_start', 'period_frequency'])
+            batch = []
+    if batch:
+        Data.objects.bulk_update(batch, ['period_start', 'period_frequency'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0009_unique_data_indicator_period'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='period_start',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='period_frequency',
+            field=models.CharField(blank=True, choices=[('MINUTE', 'Per Minute'), ('HOURLY', 'Hourly'), ('DAILY', 'Daily'), ('WEEKLY', 'Weekly'), ('BIWEEKLY', 'Biweekly'), ('MONTHLY', 'Monthly'), ('BIMONTHLY', 'Every 2 Months'), ('QUARTERLY', 'Quarterly'), ('TRIANNUAL', 'Every 4 Months'), ('SEMIANNUAL', 'Semiannual / Biannual'), ('ANNUAL', 'Annual'), ('CUSTOM', 'Custom / Other')], max_length=20, null=True),
+        ),
+        migrations.RunPython(fill_period_start, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='data',
+            index=models.Index(fields=['indicator', 'period_start'], name='data_indicator_period_start'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.1.6 on 2026-10-17 01:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 5000
+
+
+def _data_id(value):
+    # Legacy details took data_id from request bodies, so it may be a string such as "123",
+    # None or garbage; anything that is not an integer is stored as NULL
+    try:
+        data_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return data_id if -2 ** 63 <= data_id < 2 ** 63 else None
+
+
+def move_changes_to_table(apps, schema_editor):
+    # One DataChange row per entry of the DATA_UPDATE details lists, which are then emptied
+    ActionLog = apps.get_model('koe_db', 'ActionLog')
+    DataChange = apps.get_model('koe_db', 'DataChange')
+    rows = []
+    emptied = []
+    logs = ActionLog.objects.filter(action_type='DATA_UPDATE').only('id', 'indicator_id', 'timestamp', 'details')
+    for log in logs.iterator(chunk_size=500):
+        if not isinstance(log.details, list):
+            continue
+        for change in log.details:
+            if not isinstance(change, dict):
+                continue
+            period, old_value, new_value = change.get('period'), change.get('old_value'), change.get('new_value')
+            rows.append(DataChange(
+                action_log_id=log.id,
+                indicator_id=log.indicator_id,
+                period=str(period)[:20] if period is not None else None,
+                data_id=_data_id(change.get('data_id')),
+                old_value=str(old_value) if old_value is not None else None,
+                new_value=str(new_value) if new_value is not None else None,
+                timestamp=log.timestamp,
+            ))
+        log.details = []
+        emptied.append(log)
+        if len(rows) >= BATCH_SIZE:
+            DataChange.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+            rows = []
+        if len(emptied) >= 500:
+            ActionLog.objects.bulk_update(emptied, ['details'])
+            emptied = []
+    DataChange.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    ActionLog.objects.bulk_update(emptied, ['details'])
+
+
+def move_changes_to_details(apps, schema_editor):
+    ActionLog = apps.get_model('koe_db', 'ActionLog')
+    DataChange = apps.get_model('koe_db', 'DataChange')
+    details = {}
+    rows = DataChange.objects.order_by('action_log_id', 'id').values_list(
+        'action_log_id', 'period', 'data_id', 'old_value', 'new_value'
+    )
+    for action_log_id, period, data_id, old_value, new_value in rows.iterator(chunk_size=BATCH_SIZE):
+        change = {'period': period, 'old_value': old_value, 'new_value': new_value}
+        if data_id is not None:
+            change['data_id'] = data_id
+        details.setdefault(action_log_id, []).append(change)
+    logs = []
+    for log in ActionLog.objects.filter(id__in=list(details)).only('id'):
+        log.details = details[log.id]
+        logs.append(log)
+    ActionLog.objects.bulk_update(logs, ['details'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0010_data_period_start'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(blank=True, max_length=20, null=True)),
+                ('data_id', models.BigIntegerField(blank=True, null=True)),
+                ('old_value', models.TextField(blank=True, null=True)),
+                ('new_value', models.TextField(blank=True, null=True)),
+                ('timestamp', models.DateTimeField()),
+                ('action_log', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='data_changes', to='koe_db.actionlog')),
+                ('indicator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='koe_db.indicator')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['indicator', 'period', 'timestamp'], name='datachange_indicator_period'), models.Index(fields=['indicator', 'timestamp'], name='datachange_indicator_time')],
+            },
+        ),
+        migrations.RunPython(move_changes_to_table, move_changes_to_details),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-17 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0011_datachange'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='eurostatrequest',
+            name='frequency',
+            field=models.CharField(help_text="Data frequency (e.g., 'Annual', 'Monthly', 'Quarterly')", max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='eurostatrequest',
+            name='url',
+            field=models.URLField(help_text='The Eurostat API URL to fetch data from', max_length=2500),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-17 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('koe_db', '0012_alter_eurostatrequest_frequency_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datachange',
+            name='created',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -189,6 +189,26 @@ class Data(models.Model):
     period = models.CharField(max_length=20, blank=True, null=True)  # Period description for non-date data
     value = models.DecimalField(max_digits=20, decimal_places=5, null=True)
     isEstimate = models.BooleanField(default=False)
+    # Normalised start and frequency of period, for ordering and range filters; see periods_utils.period_fields
+    period_start = models.DateField(blank=True, null=True)
+    period_frequency = models.CharField(max_length=20, choices=Frequency.choices, blank=True, null=True)
+
+    class Meta:
+        # One value per indicator and period; writes go through ingestion.upsert_data
+        constraints = [
+            models.UniqueConstraint(fields=['indicator', 'period'], name='unique_data_indicator_period'),
+        ]
+        indexes = [
+            models.Index(fields=['indicator', 'period_start'], name='data_indicator_period_start'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from koe_db import series_cache
+        from koe_db.periods_utils import period_fields
+        for field, value in period_fields(self.period).items():
+            setattr(self, field, value)
+        super().save(*args, **kwargs)
+        series_cache.invalidate([self.indicator_id])
 
 class CustomTable(models.Model):
     name = models.CharField(max_length=255)
@@ -263,6 +283,26 @@ class ActionLog(models.Model):
     def __str__(self):
         return f"{self.action_type} on {self.indicator} by {self.user}"
 
+class DataChange(models.Model):
+    """
+    One data point changed by a DATA_UPDATE ActionLog, which is the header row of its changes.
+    Values are kept as logged, e.g. "1.5" or "None"; see data_changes.log_data_update.
+    """
+    action_log = models.ForeignKey(ActionLog, on_delete=models.CASCADE, related_name='data_changes')
+    indicator = models.ForeignKey(Indicator, on_delete=models.CASCADE)
+    period = models.CharField(max_length=20, blank=True, null=True)
+    data_id = models.BigIntegerField(blank=True, null=True)  # Data row written, when known; it may have been deleted since
+    old_value = models.TextField(blank=True, null=True)
+    new_value = models.TextField(blank=True, null=True)
+    created = models.BooleanField(default=False)  # The change inserted the Data row; rolling back its run deletes it
+    timestamp = models.DateTimeField()  # Copy of the ActionLog timestamp, so time ranges need no join
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['indicator', 'period', 'timestamp'], name='datachange_indicator_period'),
+            models.Index(fields=['indicator', 'timestamp'], name='datachange_indicator_time'),
+        ]
+
 class UserFavouriteTables(models.Model):
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
     tables = models.ManyToManyField(CustomTable)
@@ -287,7 +327,7 @@ class Workflow(models.Model):
     workflow_type = models.CharField(max_length=20, choices=WORKFLOW_TYPES)
     is_active = models.BooleanField(default=True)
     schedule_cron = models.CharField(max_length=100, default="0 0 1 * *")
-    next_run = models.DateTimeField(null=True, blank=True)
+    next_run = models.DateTimeField(null=True, blank=True, db_index=True)  # dispatch_due_workflows starts the workflow once due
     last_run = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
@@ -302,32 +342,96 @@ class WorkflowRun(models.Model):
     status = models.CharField(max_length=20, default="PENDING")  # PENDING, IN_PROGRESS, COMPLETED, FAILED
     start_time = models.DateTimeField(null=True, blank=True)  # Start time of the workflow execution
     end_time = models.DateTimeField(null=True, blank=True)  # End time of the workflow execution
+    status_message = models.CharField(max_length=255, null=True, blank=True)  # Outcome details, e.g. "No upstream change"
+    metrics = models.JSONField(default=dict, blank=True)  # HTTP, row and stage timing stats recorded by run_pipeline
+    archive_path = models.CharField(max_length=255, blank=True, default="")  # Raw upstream payload in the 'ingestion_archive' storage
     def __str__(self):
         return f"Run for {self.workflow.name} at {self.run_time}"
 
 
-class ECBRequest(models.Model):
+class UpstreamValidators(models.Model):
+    """
+    HTTP validators of the last successfully ingested upstream response.
+    They are sent back as If-None-Match / If-Modified-Since so unchanged sources can be skipped;
+    the content hash covers sources that send neither header.
+    """
+    etag = models.CharField(max_length=255, blank=True, default="")
+    last_modified = models.CharField(max_length=255, blank=True, default="")
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+
+    class Meta:
+        abstract = True
+
+    def clear_validators(self):
+        """Forget the stored validators so the next run ingests the full response."""
+        self.etag = ""
+        self.last_modified = ""
+        self.content_hash = ""
+
+
+class IncrementalFetch(models.Model):
+    """
+    Lets a connector request only recent periods: from the newest stored period of its
+    indicators minus revision_lookback periods. Every full_refresh_days the whole history
+    is requested again to pick up deep revisions.
+    """
+    revision_lookback = models.PositiveIntegerField(default=3)  # Periods re-requested before the newest stored one
+    full_refresh_days = models.PositiveIntegerField(default=30)  # 0 disables incremental fetching
+    last_full_refresh = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+
+class ECBRequest(UpstreamValidators, IncrementalFetch):
     workflow = models.OneToOneField(Workflow, on_delete=models.CASCADE, related_name="ecb_request")
     table = models.CharField(max_length=100)
     parameters = models.CharField(max_length=255)
     frequency = models.CharField(max_length=20)
+    # Single-series requests store their indicator here; multi-series requests use ECBIndicatorMapping
     indicator = models.ForeignKey(
         Indicator,
         on_delete=models.CASCADE,
-        related_name="ecb_requests"
+        related_name="ecb_requests",
+        null=True,
+        blank=True
     )
 
     def __str__(self):
-        return f"ECB Request for {self.indicator.name}"
+        if self.indicator:
+            return f"ECB Request for {self.indicator.name}"
+        return f"ECB Request for {self.workflow.name}"
+
+
+class ECBIndicatorMapping(models.Model):
+    """
+    Maps one series of a multi-series ECB request to an indicator.
+    A single SDMX call with a wildcard or '+'-joined key can then feed many indicators.
+    """
+    ecb_request = models.ForeignKey(
+        ECBRequest, on_delete=models.CASCADE, related_name="indicator_mappings"
+    )
+    indicator = models.ForeignKey(
+        Indicator, on_delete=models.CASCADE, related_name="ecb_mappings"
+    )
+
+    # Full series key without the dataflow id, for example "M.U2.EUR.4F.KR.MRR_FR.LEV"
+    series_key = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('ecb_request', 'indicator')
+
+    def __str__(self):
+        return f"{self.indicator.name}: {self.series_key}"
 
-class CyStatRequest(models.Model):
+class CyStatRequest(UpstreamValidators, IncrementalFetch):
     workflow = models.OneToOneField(
         Workflow, on_delete=models.CASCADE, related_name="cystat_request"
     )
     url = models.URLField()
     request_body = models.JSONField()
     frequency = models.CharField(max_length=20)
-    start_period = models.CharField(max_length=20)
+    start_period = models.CharField(max_length=20)  # First period ingested; earlier periods are never requested
 
     def __str__(self):
         return f"CyStat Request for {self.workflow.name}"
@@ -355,7 +459,7 @@ class CyStatIndicatorMapping(models.Model):
     def __str__(self):
         return f"{self.indicator.name}: {self.key_indices}"
 
-class EuroStatRequest(models.Model):
+class EuroStatRequest(UpstreamValidators, IncrementalFetch):
     """
     Stores information about a Eurostat data request workflow.
     """
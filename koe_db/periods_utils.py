@@ -1,6 +1,8 @@
+import re
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from django.db.models import F
 from koe_db.models import Frequency
 
 def format_label(date: datetime, frequency: str) -> str:
@@ -70,3 +72,92 @@ def is_valid_period(target_date: datetime, start_date: datetime, frequency: str)
         current += delta
 
     return False  # Prevent infinite loop on bad input
+
+# Period keys as stored in Data.period by the connectors, e.g. "2024", "2024-Q1", "2024-03", "2024-M03",
+# "2024-03-15", and the labels of format_label, e.g. "03-2024", "Week 05 - 2024", "15-03-2024"
+_PERIOD_PATTERNS = [
+    (re.compile(r'^(?P<year>\d{4})$'), Frequency.ANNUAL),
+    (re.compile(r'^(?P<year>\d{4})-?S(?P<sub>[12])$'), Frequency.SEMIANNUAL),
+    (re.compile(r'^(?P<year>\d{4})-?T(?P<sub>[1-3])$'), Frequency.TRIANNUAL),
+    (re.compile(r'^(?P<year>\d{4})-?Q(?P<sub>[1-4])$'), Frequency.QUARTERLY),
+    (re.compile(r'^(?P<year>\d{4})(?:-M|-|M)(?P<sub>\d{1,2})$'), Frequency.MONTHLY),
+    (re.compile(r'^(?P<sub>\d{1,2})-(?P<year>\d{4})$'), Frequency.MONTHLY),
+    (re.compile(r'^(?P<year>\d{4})-?W(?P<week>\d{1,2})$'), Frequency.WEEKLY),
+    (re.compile(r'^Week (?P<label_week>\d{1,2}) - (?P<year>\d{4})$'), Frequency.WEEKLY),
+    (re.compile(r'^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})$'), Frequency.DAILY),
+    (re.compile(r'^(?P<day>\d{2})-(?P<month>\d{2})-(?P<year>\d{4})$'), Frequency.DAILY),
+]
+
+_MONTHS_PER_SUBPERIOD = {
+    Frequency.SEMIANNUAL: 6,
+    Frequency.TRIANNUAL: 4,
+    Frequency.QUARTERLY: 3,
+    Frequency.MONTHLY: 1,
+}
+
+def parse_period(period: str) -> Tuple[datetime, str] | None:
+    """Returns (start date, frequency) of a period key, or None if the format is not recognised."""
+    if not period:
+        return None
+    period = period.strip()
+    for pattern, frequency in _PERIOD_PATTERNS:
+        match = pattern.match(period)
+        if not match:
+            continue
+        groups = match.groupdict()
+        try:
+            year = int(groups['year'])
+            if frequency == Frequency.ANNUAL:
+                return datetime(year, 1, 1), frequency
+            if groups.get('week'):
+                return datetime.fromisocalendar(year, int(groups['week']), 1), frequency
+            if groups.get('label_week'):
+                # format_label numbers weeks from the first Sunday (%U)
+                return datetime.strptime(f"{year} {groups['label_week']} 0", "%Y %U %w"), frequency
+            if frequency == Frequency.DAILY:
+                return datetime(year, int(groups['month']), int(groups['day'])), frequency
+            month = (int(groups['sub']) - 1) * _MONTHS_PER_SUBPERIOD[frequency] + 1
+            return datetime(year, month, 1), frequency
+        except ValueError:
+            return None
+    try:
+        # Periods of other frequencies are labelled with isoformat()
+        return datetime.fromisoformat(period), None
+    except ValueError:
+        return None
+
+# Chronological order of Data rows; periods that could not be parsed come last, by name
+PERIOD_ORDERING = (F('period_start').asc(nulls_last=True), 'period')
+
+def period_fields(period: str) -> Dict:
+    """Returns the period_start and period_frequency of Data for a period key."""
+    parsed = parse_period(period)
+    if parsed is None:
+        return {'period_start': None, 'period_frequency': None}
+    date, frequency = parsed
+    return {'period_start': date.date(), 'period_frequency': frequency}
+
+def period_key(date: datetime, frequency: str) -> str:
+    """Formats the period starting at date the way the connectors store it."""
+    if frequency == Frequency.ANNUAL:
+        return str(date.year)
+    if frequency == Frequency.SEMIANNUAL:
+        return f"{date.year}-S{(date.month - 1) // 6 + 1}"
+    if frequency == Frequency.TRIANNUAL:
+        return f"{date.year}-T{(date.month - 1) // 4 + 1}"
+    if frequency == Frequency.QUARTERLY:
+        return f"{date.year}-Q{(date.month - 1) // 3 + 1}"
+    if frequency == Frequency.MONTHLY:
+        return date.strftime("%Y-%m")
+    if frequency == Frequency.WEEKLY:
+        year, week, _ = date.isocalendar()
+        return f"{year}-W{week:02d}"
+    return date.strftime("%Y-%m-%d")
+
+def shift_period(period: str, steps: int) -> str | None:
+    """Moves a period key by a number of periods of its own frequency (negative goes back in time)."""
+    parsed = parse_period(period)
+    if parsed is None or parsed[1] is None:
+        return None
+    date, frequency = parsed
+    return period_key(date + get_delta(frequency) * steps, frequency)
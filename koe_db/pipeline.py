@@ -0,0 +1,478 @@
+import io
+import json
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from koe_db import archive, http_client, rate_limits, workflow_leases
+from koe_db.data_changes import log_data_updates, run_changes
+from koe_db.ingestion import apply_indicator_diff, batch_indicator_diff, diff_indicator_values, revert_indicator_changes
+from koe_db.models import ActionLog, CustomIndicator, Data, IncrementalFetch, WorkflowRun
+from koe_db.upstream import NO_UPSTREAM_CHANGE, mark_full_refresh, store_validators
+
+# Connector class per Workflow.workflow_type, filled by @register
+CONNECTORS = {}
+
+STALE_RUN_MESSAGE = "The worker stopped during the run; its committed batches were rolled back"
+
+
+class SourceUnchanged(Exception):
+    """Raised by Connector.fetch when the upstream data has not changed since the last ingestion."""
+
+
+class ConnectorError(Exception):
+    """Raised by a connector to fail the run; the message becomes WorkflowRun.error_message."""
+
+
+class Connector:
+    """
+    A source of indicator data. Subclasses only fetch and parse; run_pipeline owns the run
+    bookkeeping, diffing, bulk writes, change logging and dependent-indicator propagation.
+
+    fetch() returns the upstream payload, raising SourceUnchanged or ConnectorError as needed.
+    parse(payload) returns {indicator_id: {period: Decimal}}. prepare() loads the database state
+    parse() needs, and dump() / load() convert a payload to and from an archived file so a run
+    can be replayed without network access.
+    """
+    name = None  # Source label used in log and error messages
+    workflow_type = None  # Key in Workflow.WORKFLOW_TYPES
+    request_model = None  # Model holding the source configuration of a workflow
+
+    def __init__(self, source_request, workflow_run):
+        self.source_request = source_request
+        self.workflow = source_request.workflow
+        self.workflow_run = workflow_run
+        self.validators = None  # Validators of the fetched response, stored after a successful run
+        self.window_start = None  # First period requested; None when the full history was fetched
+        self.rows_parsed = None  # Upstream rows or observations read by parse(), when the source knows it
+
+    @classmethod
+    def upstream_url(cls, source_request):
+        """
+        URL whose host the fetch is rate limited under, see UPSTREAM_RATE_LIMITS.
+        """
+        return None
+
+    def prepare(self):
+        pass
+
+    def fetch(self):
+        raise NotImplementedError
+
+    def parse(self, payload):
+        raise NotImplementedError
+
+    def dump(self, payload):
+        """
+        Returns the fetched payload as a binary file for the archive.
+        """
+        if hasattr(payload, 'read'):
+            payload.seek(0)
+            return payload
+        return io.BytesIO(json.dumps(payload).encode())
+
+    def load(self, body):
+        """
+        Turns an archived payload file back into what fetch() returned.
+        """
+        return body
+
+    def finish(self):
+        """
+        Called inside the write transaction once the data is stored.
+        """
+        if self.validators:
+            store_validators(self.source_request, self.validators)
+        self.record_full_refresh()
+
+    def record_full_refresh(self):
+        """
+        Records a full fetch as a full refresh, also when it found nothing new, so the following
+        runs fetch incrementally again.
+        """
+        if self.window_start is None and isinstance(self.source_request, IncrementalFetch):
+            mark_full_refresh(self.source_request)
+
+
+def register(connector_class):
+    """
+    Class decorator that makes a connector the executor of its workflow type.
+    """
+    CONNECTORS[connector_class.workflow_type] = connector_class
+    return connector_class
+
+
+@contextmanager
+def timed(timings, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def complete_run(workflow_run, workflow, status_message=None):
+    """
+    Marks a run as completed and moves the workflow to its next scheduled run.
+    """
+    workflow_run.status = "COMPLETED"
+    workflow_run.status_message = status_message
+    workflow_run.success = True
+    workflow_run.end_time = timezone.now()
+    workflow_run.save()
+
+    workflow.last_run = timezone.now()
+    workflow.last_run_success = True
+    try:
+        from koe_db.workflow_views import calculate_next_run
+        workflow.next_run = calculate_next_run(workflow.schedule_cron)
+    except Exception as e:
+        print(f"Error calculating next run: {str(e)}")
+    workflow.save()
+
+
+def fail_run(workflow_run, error_message):
+    print(error_message)
+    workflow_run.status = "FAILED"
+    workflow_run.success = False
+    workflow_run.error_message = error_message
+    workflow_run.end_time = timezone.now()
+    workflow_run.save()
+
+
+def fail_throttled_run(connector_class, source_request_id, error_message):
+    """
+    Records a FAILED WorkflowRun for a source request whose task gave up waiting for its
+    throttled upstream host, so the skipped ingestion shows in the workflow's history.
+    """
+    workflow_id = (
+        connector_class.request_model.objects.filter(id=source_request_id)
+        .values_list('workflow_id', flat=True).first()
+    )
+    if workflow_id is None:
+        print(error_message)
+        return None
+    workflow_run = WorkflowRun.objects.create(
+        workflow_id=workflow_id,
+        start_time=timezone.now(),
+        status="RUNNING",
+        success=False
+    )
+    fail_run(workflow_run, error_message)
+    return workflow_run
+
+
+def log_changes(workflow_run, indicator_changes, created_ids=frozenset()):
+    """
+    Creates one DATA_UPDATE ActionLog per indicator with changes, with a DataChange row per point.
+    """
+    log_data_updates(indicator_changes, run=workflow_run, created_ids=created_ids)
+
+
+def write_batches(workflow_run, to_create, to_update, changes, metrics):
+    """
+    Applies a diff in batches of INGESTION_COMMIT_BATCH_SIZE changes, each in its own transaction
+    together with its ActionLogs, so row locks are only held briefly. The DataChange rows of each
+    batch commit with its data and are the record rollback_run reverts from.
+    Returns {indicator_id: [change, ...]} for all batches.
+    """
+    indicator_changes = {}
+    metrics['write_batches'] = 0
+    for batch in batch_indicator_diff(to_create, to_update, changes, settings.INGESTION_COMMIT_BATCH_SIZE):
+        with transaction.atomic():
+            batch_changes = apply_indicator_diff(*batch)
+            log_changes(workflow_run, batch_changes, {data.id for data in batch[0]})
+        for indicator_id, changes_of_indicator in batch_changes.items():
+            indicator_changes.setdefault(indicator_id, []).extend(changes_of_indicator)
+        metrics['write_batches'] += 1
+    return indicator_changes
+
+
+def rollback_run(workflow_run):
+    """
+    Reverts the batches a run already committed and deletes their ActionLogs, so the run leaves
+    the data as it found it. The changes are read back from the run's DataChange rows, so a run
+    whose worker died can be rolled back by another one.
+    Returns the number of rows reverted.
+    """
+    changes = run_changes(workflow_run)
+    if not changes:
+        return 0
+    print(f"Rolling back {len(changes)} changes of workflow run {workflow_run.id}")
+    with transaction.atomic():
+        reverted = revert_indicator_changes(changes)
+        ActionLog.objects.filter(run=workflow_run, action_type='DATA_UPDATE').delete()
+    return reverted
+
+
+def recover_stale_runs():
+    """
+    Rolls back and fails the RUNNING runs whose workflow lease expired, i.e. whose worker died
+    or was killed between batches, so their committed batches do not stay applied.
+    Returns the number of runs recovered.
+    """
+    running = list(WorkflowRun.objects.filter(status="RUNNING").values_list('id', 'workflow_id'))
+    if not running:
+        return 0
+    leases = workflow_leases.current_many({workflow_id for _, workflow_id in running})
+
+    recovered = 0
+    for run_id, workflow_id in running:
+        lease = leases.get(workflow_id)
+        # A lease without a run id may belong to this run, created but not attached yet
+        if lease is not None and lease.get('run_id') in (run_id, None):
+            continue
+        with transaction.atomic():
+            # Runs set their final status before releasing the lease, so a run that finished
+            # since it was listed is no longer RUNNING here
+            workflow_run = (
+                WorkflowRun.objects.select_for_update(skip_locked=True)
+                .filter(id=run_id, status="RUNNING").first()
+            )
+            if workflow_run is None:
+                continue
+            rollback_run(workflow_run)
+            fail_run(workflow_run, STALE_RUN_MESSAGE)
+        recovered += 1
+    return recovered
+
+
+def dependent_custom_indicators(indicator_changes):
+    """
+    Returns {custom indicator id: [changed periods of its base indicators]} for the changes of a run
+    ({indicator id: [change]}), so a custom indicator built on several changed indicators is
+    recomputed once over the union of their changed periods.
+    """
+    dependents = {}
+    links = CustomIndicator.base_indicators.through.objects.filter(indicator_id__in=list(indicator_changes))
+    for custom_indicator_id, indicator_id in links.values_list('customindicator_id', 'indicator_id'):
+        periods = dependents.setdefault(custom_indicator_id, set())
+        periods.update(change['period'] for change in indicator_changes[indicator_id])
+    return {custom_indicator_id: sorted(periods) for custom_indicator_id, periods in dependents.items()}
+
+
+def queue_propagation(workflow_run, indicator_changes):
+    """
+    Queues one recompute_custom_indicators job for the custom indicators depending on the changed
+    indicators, sent once the ingestion transaction commits so no row locks are held meanwhile.
+    Returns the number of custom indicators queued.
+    """
+    from koe_db.tasks import recompute_custom_indicators
+
+    dependents = dependent_custom_indicators(indicator_changes)
+    if dependents:
+        transaction.on_commit(lambda: recompute_custom_indicators.delay(workflow_run.id, dependents), robust=True)
+    return len(dependents)
+
+
+def recompute_dependents(workflow_run_id, dependents):
+    """
+    Recomputes every queued custom indicator once, over the changed periods of its base indicators,
+    each in its own transaction. The count and duration are added to the run's metrics.
+    Returns the number of custom indicators recomputed.
+    """
+    from koe_db.api_views import recompute_custom_indicator
+
+    started = time.perf_counter()
+    custom_indicators = CustomIndicator.objects.select_related('indicator').in_bulk([int(key) for key in dependents])
+    recomputed = 0
+    for custom_indicator_id, periods in dependents.items():
+        custom_indicator = custom_indicators.get(int(custom_indicator_id))
+        if custom_indicator is None:
+            continue
+        with transaction.atomic():
+            recompute_custom_indicator(custom_indicator, periods, None)
+        recomputed += 1
+
+    with transaction.atomic():
+        workflow_run = WorkflowRun.objects.select_for_update().filter(id=workflow_run_id).first()
+        if workflow_run is not None:
+            workflow_run.metrics['custom_indicators_recomputed'] = recomputed
+            workflow_run.metrics.setdefault('stages_ms', {})['recompute'] = round((time.perf_counter() - started) * 1000, 1)
+            workflow_run.save(update_fields=['metrics'])
+    return recomputed
+
+
+def http_metrics(calls):
+    """
+    Sums the upstream calls collected by http_client.record_calls().
+    """
+    return {
+        'requests': len(calls),
+        'bytes': sum(call['bytes'] for call in calls),
+        'wire_bytes': sum(call['wire_bytes'] for call in calls),
+        'latency_ms': round(sum(call['elapsed_ms'] for call in calls), 1),
+    }
+
+
+def row_metrics(connector, indicator_values, to_create, to_update):
+    matched = sum(len(values) for values in indicator_values.values())
+    return {
+        'parsed': connector.rows_parsed if connector.rows_parsed is not None else matched,
+        'matched': matched,
+        'inserted': len(to_create),
+        'updated': len(to_update),
+        'unchanged': matched - len(to_create) - len(to_update),
+    }
+
+
+def archive_fetched_payload(connector, payload, metrics):
+    """
+    Stores the raw payload of a run for replay_run; a failed upload does not fail the run.
+    """
+    workflow_run = connector.workflow_run
+    try:
+        workflow_run.archive_path, metrics['archive_bytes'] = archive.archive_payload(workflow_run, connector.dump(payload))
+        WorkflowRun.objects.filter(pk=workflow_run.pk).update(archive_path=workflow_run.archive_path)
+    except Exception as e:
+        print(f"Failed to archive the payload of run {workflow_run.id}: {str(e)}")
+
+
+def run_pipeline(connector_class, source_request_id):
+    """
+    Runs one ingestion: fetch -> parse -> diff -> write -> propagate, recorded as a WorkflowRun.
+
+    The run holds the workflow's single-flight lease; if another run of the workflow is in
+    progress nothing is started and its WorkflowRun id is returned as metrics['running_run_id'].
+
+    The fetch holds a token and slot of the upstream host's rate limit; when none is free
+    rate_limits.Throttled is raised before the run is created, for the caller to requeue it.
+
+    No locks are held while fetching, parsing and diffing. The changes are written in batch
+    transactions and a failed run reverts the batches it committed (see rollback_run); runs
+    whose worker died are rolled back by recover_stale_runs.
+
+    WorkflowRun.metrics receives the upstream traffic, row counts, queued custom indicators
+    and the duration of each stage in milliseconds; the metrics are also returned.
+    Dependent custom indicators are recomputed by recompute_custom_indicators after commit.
+    """
+    metrics = {'http': http_metrics([]), 'rows': {}, 'stages_ms': {}}
+    try:
+        source_request = connector_class.request_model.objects.select_related('workflow').get(id=source_request_id)
+    except connector_class.request_model.DoesNotExist:
+        print(f"{connector_class.request_model.__name__} with ID {source_request_id} does not exist.")
+        return metrics
+
+    # Only one run per workflow at a time, whichever trigger started it
+    workflow = source_request.workflow
+    try:
+        workflow_lease = workflow_leases.acquire(workflow.id)
+    except workflow_leases.WorkflowRunning as e:
+        print(f"Workflow {workflow.name} is already running (run {e.run_id}), not starting it again")
+        metrics['running_run_id'] = e.run_id
+        return metrics
+
+    try:
+        return _run_leased(connector_class, source_request, workflow_lease, metrics)
+    finally:
+        workflow_lease.release()
+
+
+def _run_leased(connector_class, source_request, workflow_lease, metrics):
+    timings = metrics['stages_ms']
+    lease = rate_limits.acquire(connector_class.upstream_url(source_request))
+
+    workflow = source_request.workflow
+    workflow_run = WorkflowRun.objects.create(
+        workflow=workflow,
+        start_time=timezone.now(),
+        status="RUNNING",
+        success=False,
+        metrics=metrics
+    )
+    workflow_lease.attach(workflow_run.id)
+    connector = connector_class(source_request, workflow_run)
+    print(f"Executing {connector.name} request for workflow: {workflow.name}")
+
+    started = time.perf_counter()
+    try:
+        with http_client.record_calls() as calls, timed(timings, 'fetch'):
+            try:
+                connector.prepare()
+                payload = connector.fetch()
+            finally:
+                rate_limits.release(lease)
+                metrics['http'] = http_metrics(calls)
+        if settings.INGESTION_ARCHIVE_ENABLED:
+            with timed(timings, 'archive'):
+                archive_fetched_payload(connector, payload, metrics)
+        with timed(timings, 'parse'):
+            indicator_values = connector.parse(payload)
+        del payload
+
+        # Nothing is locked while diffing; the diff is then written in short batch transactions
+        with timed(timings, 'diff'):
+            to_create, to_update, changes = diff_indicator_values(indicator_values)
+        metrics['rows'] = row_metrics(connector, indicator_values, to_create, to_update)
+        del indicator_values
+
+        try:
+            with timed(timings, 'write'):
+                indicator_changes = write_batches(workflow_run, to_create, to_update, changes, metrics)
+            metrics['indicators_updated'] = len(indicator_changes)
+
+            with transaction.atomic():
+                with timed(timings, 'propagate'):
+                    metrics['custom_indicators_queued'] = queue_propagation(workflow_run, indicator_changes)
+                connector.finish()
+                metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                complete_run(workflow_run, workflow)
+        except Exception:
+            rollback_run(workflow_run)
+            raise
+
+    except SourceUnchanged:
+        print(f"{NO_UPSTREAM_CHANGE} for workflow: {workflow.name}")
+        connector.record_full_refresh()
+        metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        complete_run(workflow_run, workflow, NO_UPSTREAM_CHANGE)
+    except ConnectorError as e:
+        metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        fail_run(workflow_run, str(e))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        fail_run(workflow_run, f"An error occurred during {connector.name} request execution: {str(e)}")
+
+    print(f"Run metrics for {workflow.name}: {metrics}")
+    return metrics
+
+
+def replay_run(workflow_run_id):
+    """
+    Re-runs parse and diff of a run from its archived payload against the current database,
+    without network access and without writing anything.
+    Returns row counts and stage durations in the format of run_pipeline's metrics.
+    """
+    workflow_run = WorkflowRun.objects.select_related('workflow').get(id=workflow_run_id)
+    if not workflow_run.archive_path:
+        raise ConnectorError(f"Workflow run {workflow_run_id} has no archived payload")
+
+    workflow = workflow_run.workflow
+    connector_class = CONNECTORS.get(workflow.workflow_type)
+    if connector_class is None:
+        raise ConnectorError(f"Workflow type '{workflow.workflow_type}' has no connector")
+    source_request = connector_class.request_model.objects.select_related('workflow').get(workflow=workflow)
+    connector = connector_class(source_request, workflow_run)
+
+    metrics = {'run_id': workflow_run.id, 'rows': {}, 'stages_ms': {}}
+    timings = metrics['stages_ms']
+    started = time.perf_counter()
+
+    with timed(timings, 'load'):
+        connector.prepare()
+        payload = connector.load(archive.open_payload(workflow_run.archive_path))
+    with timed(timings, 'parse'):
+        indicator_values = connector.parse(payload)
+    del payload
+    with timed(timings, 'diff'):
+        to_create, to_update, _ = diff_indicator_values(indicator_values)
+
+    metrics['rows'] = row_metrics(connector, indicator_values, to_create, to_update)
+    metrics['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    print(f"Replay metrics for run {workflow_run.id} of {workflow.name}: {metrics}")
+    return metrics
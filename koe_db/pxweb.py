@@ -0,0 +1,132 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from koe_db import http_client
+from koe_db.periods_utils import parse_period
+
+# Codes of the PX-Web time variable in CyStat tables
+TIME_CODES = ("QUARTER", "MONTH", "YEAR")
+
+
+def time_variable(variables):
+    """
+    Returns (position, variable) of the time variable of a PX-Web structure, or (None, None).
+    """
+    for position, variable in enumerate(variables):
+        if variable.get("code") in TIME_CODES:
+            return position, variable
+    return None, None
+
+
+def has_time_selection(query):
+    """
+    True when a query body already selects periods itself; such queries are sent as configured.
+    """
+    return any(item.get("code") in TIME_CODES for item in query.get("query", []))
+
+
+def first_period_index(periods, start_period):
+    """
+    Index of the first normalised period that is not before start_period, or 0 if start_period
+    is empty or not a recognised period key.
+    """
+    parsed = parse_period(start_period) if start_period else None
+    if parsed is None:
+        return 0
+    start_date = parsed[0]
+    for index, period in enumerate(periods):
+        period_start = parse_period(period)
+        if period_start is not None and period_start[0] >= start_date:
+            return index
+    return len(periods)
+
+
+def _selected_count(variable, selection):
+    values = variable.get("values", [])
+    if selection is None:
+        # Variables left out of the query are eliminated when allowed, otherwise returned whole
+        return 1 if variable.get("elimination") else len(values)
+    if selection.get("filter") == "top":
+        return min(int(selection["values"][0]), len(values))
+    if selection.get("filter") == "all":
+        return len(values)
+    return len(selection.get("values", []))
+
+
+def estimate_cells(query, variables):
+    """
+    Estimates the cells a query returns: the product of the value counts selected per variable.
+    """
+    selections = {item.get("code"): item.get("selection") for item in query.get("query", [])}
+    cells = 1
+    for variable in variables:
+        cells *= _selected_count(variable, selections.get(variable.get("code")))
+    return cells
+
+
+def _with_time_selection(query, code, selection):
+    query = copy.deepcopy(query)
+    query.setdefault("query", []).append({"code": code, "selection": selection})
+    return query
+
+
+def plan_queries(query, variables, first_index=0, cell_limit=None):
+    """
+    Splits a query into the PX-Web queries needed to fetch periods from first_index onwards.
+
+    Returns the query unchanged when it covers every period within the cell limit. Otherwise the
+    periods are added as a time selection and split into chunks of at most cell_limit cells.
+    The newest chunk selects the 'top' periods, so periods published after the structure was
+    cached still come back and show the structure is stale.
+    """
+    if cell_limit is None:
+        cell_limit = settings.CYSTAT_CELL_LIMIT
+
+    position, variable = time_variable(variables)
+    if variable is None or has_time_selection(query):
+        return [query]
+    codes = [str(code) for code in variable.get("values", [])][first_index:]
+    if not codes:
+        return []
+
+    cells_per_period = estimate_cells(
+        _with_time_selection(query, variable["code"], {"filter": "item", "values": codes[:1]}), variables
+    )
+    if first_index == 0 and cells_per_period * len(codes) <= cell_limit:
+        return [query]
+
+    chunk_size = max(1, cell_limit // max(1, cells_per_period))
+    chunks = [codes[start:start + chunk_size] for start in range(0, len(codes), chunk_size)]
+    queries = [
+        _with_time_selection(query, variable["code"], {"filter": "item", "values": chunk})
+        for chunk in chunks[:-1]
+    ]
+    queries.append(_with_time_selection(query, variable["code"], {"filter": "top", "values": [str(len(chunks[-1]))]}))
+    return queries
+
+
+def post_queries(url, queries, headers=None):
+    """
+    POSTs the queries concurrently, at most CYSTAT_QUERY_CONCURRENCY at a time.
+    Returns the responses in query order.
+    """
+    if len(queries) == 1:
+        return [http_client.post(url, json=queries[0], headers=headers)]
+    workers = min(settings.CYSTAT_QUERY_CONCURRENCY, len(queries))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        post = http_client.bind_recorders(lambda query: http_client.post(url, json=query, headers=headers))
+        return list(executor.map(post, queries))
+
+
+def merge_responses(payloads):
+    """
+    Merges the JSON bodies of split queries into one response: the columns of the first and the
+    data rows of all of them.
+    """
+    if not payloads:
+        return {"columns": [], "data": []}
+    merged = dict(payloads[0])
+    merged["data"] = [row for payload in payloads for row in payload.get("data", [])]
+    return merged
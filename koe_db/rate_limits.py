@@ -0,0 +1,120 @@
+import random
+import uuid
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+# Takes one token from the host's bucket and one slot of its semaphore, or neither.
+# KEYS: bucket hash, slot sorted set. ARGV: rate, burst, concurrency, lease, slot id, busy wait.
+# Returns {1, 0} when granted, otherwise {0, seconds to wait} (as a string, Lua numbers are truncated).
+# The clock is the Redis server's, so workers with skewed clocks share one timeline (writes after
+# TIME need the script effects replication of Redis 5 and later).
+_ACQUIRE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local concurrency = tonumber(ARGV[3])
+local lease = tonumber(ARGV[4])
+
+if concurrency > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now - lease)
+    if redis.call('ZCARD', KEYS[2]) >= concurrency then
+        return {0, ARGV[6]}
+    end
+end
+
+if rate > 0 then
+    local tokens = burst
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    if state[1] then
+        tokens = math.min(burst, tonumber(state[1]) + (now - tonumber(state[2])) * rate)
+    end
+    if tokens < 1 then
+        return {0, tostring((1 - tokens) / rate)}
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+end
+
+if concurrency > 0 then
+    redis.call('ZADD', KEYS[2], now, ARGV[5])
+    redis.call('EXPIRE', KEYS[2], math.ceil(lease) + 1)
+end
+return {1, '0'}
+"""
+
+
+class Throttled(Exception):
+    """
+    Raised by acquire() when an upstream host has no free slot or token; wait is the suggested
+    countdown in seconds before trying again.
+    """
+
+    def __init__(self, host, wait):
+        super().__init__(f"Upstream host {host} is throttled, retry in {wait:.1f} s")
+        self.host = host
+        self.wait = wait
+
+
+def _redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        # Only the Redis cache is shared between workers; other backends run unthrottled
+        return None
+
+
+def _keys(host):
+    return f"upstream:bucket:{host}", f"upstream:slots:{host}"
+
+
+def acquire(url):
+    """
+    Takes a token and a fetch slot for the host of url, as configured in UPSTREAM_RATE_LIMITS,
+    shared by every worker through Redis. Raises Throttled instead of waiting.
+    Returns a lease for release(), or None when the host is not limited.
+    """
+    host = urlsplit(url or '').hostname
+    limits = settings.UPSTREAM_RATE_LIMITS.get(host)
+    if not limits:
+        return None
+    client = _redis()
+    if client is None:
+        return None
+
+    slot_id = uuid.uuid4().hex
+    try:
+        granted, wait = client.eval(
+            _ACQUIRE_SCRIPT, 2, *_keys(host),
+            limits.get('rate', 0),
+            limits.get('burst', 1),
+            limits.get('concurrency', 0),
+            settings.UPSTREAM_SLOT_LEASE,
+            slot_id,
+            settings.UPSTREAM_THROTTLE_RETRY_DELAY,
+        )
+    except Exception as e:
+        # An unreachable Redis must not stop ingestion
+        print(f"Rate limiter unavailable for {host}: {str(e)}")
+        return None
+
+    if not int(granted):
+        # Jitter keeps requeued tasks from coming back at the same moment
+        raise Throttled(host, float(wait) + random.uniform(0, 1))
+    return host, slot_id
+
+
+def release(lease):
+    """
+    Frees the fetch slot of a lease from acquire(); slots that are never released expire
+    after UPSTREAM_SLOT_LEASE seconds.
+    """
+    if lease is None:
+        return
+    host, slot_id = lease
+    try:
+        _redis().zrem(_keys(host)[1], slot_id)
+    except Exception as e:
+        print(f"Failed to release the rate limiter slot for {host}: {str(e)}")
@@ -0,0 +1,116 @@
+import ijson
+from django.conf import settings
+
+from koe_db.streaming import json_members
+
+
+def ecb_data_url(table, parameters):
+    """
+    URL of the SDMX-JSON data of an ECB dataflow and series key, e.g. ("EXR", "M.USD.EUR.SP00.A").
+    """
+    return f"{settings.ECB_API_URL}/{table}/{parameters}?format=jsondata"
+
+
+def ecb_time_periods(response_data):
+    """
+    Returns the list of TIME_PERIOD ids of an SDMX-JSON (ECB) response, in observation index order.
+    """
+    for dim in response_data.get('structure', {}).get('dimensions', {}).get('observation', []):
+        if dim.get('id') == 'TIME_PERIOD' and dim.get('values'):
+            return [period.get('id') for period in dim['values']]
+    return []
+
+
+def ecb_series_key(index_key, series_dimensions):
+    """
+    Converts a positional SDMX-JSON series key such as "0:2:0" into the dotted
+    ECB series key (e.g. "M.U2.EUR") using the series dimension values.
+    """
+    codes = []
+    for position, value_index in enumerate(index_key.split(':')):
+        try:
+            codes.append(series_dimensions[position]['values'][int(value_index)]['id'])
+        except (IndexError, KeyError, ValueError):
+            codes.append(value_index)
+    return '.'.join(codes)
+
+
+def _title_positions(series_attributes):
+    # Position of the title attributes, used to label the series
+    return [
+        position for position, attr in enumerate(series_attributes)
+        if attr.get('id') in ('TITLE', 'TITLE_COMPL')
+    ]
+
+
+def _decode_series(series, periods, series_attributes, title_positions):
+    values = {}
+    for obs_key, obs_data in (series.get('observations') or {}).items():
+        period_idx = int(obs_key)
+        if period_idx < len(periods):
+            values[periods[period_idx]] = obs_data[0] if obs_data else None
+
+    title = ''
+    attribute_indices = series.get('attributes') or []
+    for position in title_positions:
+        if position < len(attribute_indices) and attribute_indices[position] is not None:
+            try:
+                title = series_attributes[position]['values'][attribute_indices[position]].get('name', '')
+            except (IndexError, KeyError, TypeError):
+                continue
+            if title:
+                break
+
+    return {'title': title, 'values': values}
+
+
+def ecb_series(response_data):
+    """
+    Decodes every series of an SDMX-JSON (ECB) response in one pass.
+
+    Returns {series_key: {'title': str, 'values': {period: value}}} where series_key is the
+    dotted ECB series key without the dataflow id.
+    """
+    periods = ecb_time_periods(response_data)
+    structure = response_data.get('structure', {})
+    series_dimensions = structure.get('dimensions', {}).get('series', [])
+    series_attributes = structure.get('attributes', {}).get('series', [])
+    title_positions = _title_positions(series_attributes)
+
+    decoded = {}
+    data_sets = response_data.get('dataSets') or [{}]
+    for index_key, series in (data_sets[0].get('series') or {}).items():
+        decoded[ecb_series_key(index_key, series_dimensions)] = _decode_series(
+            series, periods, series_attributes, title_positions
+        )
+
+    return decoded
+
+
+def stream_ecb_series(body, series_keys=None):
+    """
+    Streaming counterpart of ecb_series for an SDMX-JSON file.
+
+    Series are read one at a time and only those in series_keys are decoded; with
+    series_keys=None only the first series is kept (single-indicator requests).
+    Returns (time periods, {series_key: {'title', 'values'}}).
+    """
+    structure = json_members(body, ('structure',)).get('structure', {})
+    periods = ecb_time_periods({'structure': structure})
+    series_dimensions = structure.get('dimensions', {}).get('series', [])
+    series_attributes = structure.get('attributes', {}).get('series', [])
+    title_positions = _title_positions(series_attributes)
+    wanted = set(series_keys) if series_keys is not None else None
+
+    decoded = {}
+    body.seek(0)
+    for index_key, series in ijson.kvitems(body, 'dataSets.item.series', use_float=True):
+        series_key = ecb_series_key(index_key, series_dimensions)
+        if wanted is not None and series_key not in wanted:
+            continue
+        decoded[series_key] = _decode_series(series, periods, series_attributes, title_positions)
+        if wanted is None or len(decoded) == len(wanted):
+            break
+    body.seek(0)
+
+    return periods, decoded
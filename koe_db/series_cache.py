@@ -0,0 +1,202 @@
+import struct
+import uuid
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from koe_db.models import Data
+from koe_db.periods_utils import PERIOD_ORDERING
+
+# Periods never contain the ASCII unit separator, so it joins them in the packed form
+_PERIOD_SEPARATOR = '\x1f'
+_HEADER = struct.Struct('<II')  # number of points, length of the encoded periods
+_DECIMAL_PLACES = Data._meta.get_field('value').decimal_places
+
+
+def format_values(values):
+    """
+    Formats a float64 array the way the API returned the Decimal field, e.g. "1.50000", with None for NaN.
+    """
+    return [None if value != value else f"{value:.{_DECIMAL_PLACES}f}" for value in values.tolist()]
+
+
+class Series:
+    """
+    The points of one indicator in period order, as parallel arrays: period keys, period starts
+    (NaT when the period is not recognised), Data ids, float64 values (NaN for missing values)
+    and estimate flags.
+    """
+
+    __slots__ = ('periods', 'starts', 'ids', 'values', 'estimates')
+
+    def __init__(self, periods, starts, ids, values, estimates):
+        self.periods = periods
+        self.starts = starts
+        self.ids = ids
+        self.values = values
+        self.estimates = estimates
+
+    def __len__(self):
+        return len(self.periods)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a series from (id, period, period_start, value, isEstimate) tuples in period order.
+        """
+        ids, periods, starts, values, estimates = zip(*rows) if rows else ((), (), (), (), ())
+        return cls(
+            list(periods),
+            np.array(starts, dtype='datetime64[D]'),
+            np.array(ids, dtype=np.int64),
+            np.array([np.nan if value is None else value for value in values], dtype=np.float64),
+            np.array(estimates, dtype=bool),
+        )
+
+    def pack(self):
+        periods = _PERIOD_SEPARATOR.join(self.periods).encode()
+        return zlib.compress(
+            _HEADER.pack(len(self.periods), len(periods))
+            + periods
+            + self.starts.tobytes()
+            + self.ids.tobytes()
+            + self.values.tobytes()
+            + np.packbits(self.estimates).tobytes()
+        )
+
+    @classmethod
+    def unpack(cls, blob):
+        data = zlib.decompress(blob)
+        count, periods_length = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        periods = data[offset:offset + periods_length].decode().split(_PERIOD_SEPARATOR) if count else []
+        offset += periods_length
+        starts = np.frombuffer(data, dtype='datetime64[D]', count=count, offset=offset)
+        offset += starts.nbytes
+        ids = np.frombuffer(data, dtype=np.int64, count=count, offset=offset)
+        offset += ids.nbytes
+        values = np.frombuffer(data, dtype=np.float64, count=count, offset=offset)
+        offset += values.nbytes
+        estimates = np.unpackbits(np.frombuffer(data, dtype=np.uint8, offset=offset), count=count).astype(bool)
+        return cls(periods, starts, ids, values, estimates)
+
+    def formatted_values(self):
+        return format_values(self.values)
+
+    def points(self):
+        """
+        Yields {'period', 'value', 'id', 'isEstimate'} per point, in period order.
+        """
+        for period, data_id, value, is_estimate in zip(
+            self.periods, self.ids.tolist(), self.formatted_values(), self.estimates.tolist()
+        ):
+            yield {'period': period, 'value': value, 'id': data_id, 'isEstimate': is_estimate}
+
+
+def ordered_periods(series):
+    """
+    Returns the periods of several series merged in period order, each period once; periods
+    that are not recognised come last, by name, as with PERIOD_ORDERING.
+    """
+    starts = {}
+    for one in series:
+        for period, start in zip(one.periods, one.starts.tolist()):
+            starts.setdefault(period, start)
+    return sorted(starts, key=lambda period: (starts[period] is None, starts[period] or 0, period))
+
+
+def _version_key(indicator_id):
+    return f"series:version:{indicator_id}"
+
+
+def _series_key(indicator_id, version):
+    return f"series:{indicator_id}:{version}"
+
+
+def _load(indicator_ids):
+    rows_by_indicator = {indicator_id: [] for indicator_id in indicator_ids}
+    rows = (
+        Data.objects.filter(indicator_id__in=indicator_ids)
+        .order_by(*PERIOD_ORDERING)
+        .values_list('indicator_id', 'id', 'period', 'period_start', 'value', 'isEstimate')
+    )
+    for indicator_id, *row in rows:
+        rows_by_indicator[indicator_id].append(row)
+    return {indicator_id: Series.from_rows(rows) for indicator_id, rows in rows_by_indicator.items()}
+
+
+def versions(indicator_ids):
+    """
+    Returns {indicator_id: version} of the cached series, starting a version for indicators
+    that have none. A version changes whenever the indicator's Data does.
+    """
+    keys = {_version_key(indicator_id): indicator_id for indicator_id in indicator_ids}
+    found = cache.get_many(list(keys))
+    for key in keys.keys() - found.keys():
+        version = uuid.uuid4().hex
+        # Another reader may be adding a version at the same time; whichever lands first is used
+        if cache.add(key, version, timeout=settings.SERIES_CACHE_TTL):
+            found[key] = version
+        else:
+            found[key] = cache.get(key, version)
+    return {indicator_id: found[key] for key, indicator_id in keys.items()}
+
+
+def get_many(indicator_ids):
+    """
+    Returns {indicator_id: Series} for the given indicators, served from the cache when possible.
+
+    Series are cached packed and compressed under a version that invalidate() replaces, so a
+    rebuild that races with a write stores its stale copy under a version nobody reads any more.
+    All missing series are rebuilt with one query, without instantiating Data models.
+    """
+    indicator_ids = list(dict.fromkeys(indicator_ids))
+    if not indicator_ids:
+        return {}
+
+    keys = {
+        indicator_id: _series_key(indicator_id, version)
+        for indicator_id, version in versions(indicator_ids).items()
+    }
+    cached = cache.get_many(list(keys.values()))
+    series = {
+        indicator_id: Series.unpack(cached[key]) for indicator_id, key in keys.items() if key in cached
+    }
+
+    missing = [indicator_id for indicator_id in indicator_ids if indicator_id not in series]
+    if missing:
+        loaded = _load(missing)
+        cache.set_many(
+            {keys[indicator_id]: loaded[indicator_id].pack() for indicator_id in missing},
+            timeout=settings.SERIES_CACHE_TTL
+        )
+        series.update(loaded)
+    return series
+
+
+def get_series(indicator_id):
+    """
+    Returns the Series of one indicator, see get_many.
+    """
+    return get_many([indicator_id])[indicator_id]
+
+
+def invalidate(indicator_ids):
+    """
+    Drops the cached series of the given indicators once the current transaction commits;
+    they are rebuilt on their next read. Call it wherever Data of an indicator is written.
+    """
+    indicator_ids = set(indicator_ids)
+    if not indicator_ids:
+        return
+
+    def new_versions():
+        cache.set_many(
+            {_version_key(indicator_id): uuid.uuid4().hex for indicator_id in indicator_ids},
+            timeout=settings.SERIES_CACHE_TTL
+        )
+
+    transaction.on_commit(new_versions, robust=True)
@@ -0,0 +1,79 @@
+import json
+
+import ijson
+from django.conf import settings
+
+
+def is_large(body):
+    """
+    True when a spooled response body is big enough to be parsed incrementally
+    instead of being loaded with json.load.
+    """
+    body.seek(0, 2)
+    size = body.tell()
+    body.seek(0)
+    return size > settings.STREAMING_PARSE_THRESHOLD
+
+
+def load_json(body):
+    body.seek(0)
+    return json.load(body)
+
+
+def json_members(body, keys):
+    """
+    Returns {key: value} for the requested top-level members of a JSON object stored in a file.
+
+    The members are built during a single ijson pass that stops once all of them are found, so
+    the other members (typically the observation values) are tokenized but never materialized
+    as Python objects.
+    """
+    wanted = set(keys)
+    members = {}
+    builder = current = None
+    body.seek(0)
+    for prefix, event, value in ijson.parse(body, use_float=True):
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == current and event in ('end_map', 'end_array'):
+                members[current] = builder.value
+                builder = None
+        elif prefix in wanted and event != 'map_key':
+            if event in ('start_map', 'start_array'):
+                current = prefix
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            else:
+                members[prefix] = value
+        if builder is None and len(members) == len(wanted):
+            break
+    body.seek(0)
+    return members
+
+
+def json_map_chunks(body, prefix, chunk_size):
+    """
+    Yields the entries of the JSON object (or array) at prefix as dicts of at most chunk_size items.
+    Arrays are yielded as {position: item}.
+    """
+    body.seek(0)
+    chunk = {}
+    found = False
+    for key, value in ijson.kvitems(body, prefix, use_float=True):
+        found = True
+        chunk[key] = value
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = {}
+
+    if not found:
+        body.seek(0)
+        for position, value in enumerate(ijson.items(body, f"{prefix}.item", use_float=True)):
+            chunk[position] = value
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = {}
+
+    if chunk:
+        yield chunk
+    body.seek(0)
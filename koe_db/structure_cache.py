@@ -0,0 +1,89 @@
+import hashlib
+import json
+import time
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from koe_db import http_client
+from koe_db.jsonstat import jsonstat_metadata
+
+# How long a concurrent caller waits for another process to finish the same fetch
+LOCK_TIMEOUT = 60
+_POLL_INTERVAL = 0.1
+
+
+def _cache_key(url, extract=None):
+    key = f"structure:{hashlib.sha256(url.encode()).hexdigest()}"
+    if extract is not None:
+        key = f"{key}:{extract.__name__}"
+    return key
+
+
+def _fetch(url, key, extract):
+    if extract is None:
+        response = http_client.get(url)
+        response.raise_for_status()
+        json_data = response.json()
+        content = response.content
+    else:
+        # Stream the body to a file and keep only what the extractor reads from it
+        response, body, _ = http_client.download(url)
+        response.raise_for_status()
+        json_data = extract(body)
+        content = json.dumps(json_data).encode()
+
+    # Store the body compressed, it is several times smaller than the pickled objects
+    cache.set(key, zlib.compress(content), timeout=settings.STRUCTURE_CACHE_TTL)
+    return json_data
+
+
+def get_structure(url, refresh=False, extract=None):
+    """
+    Returns the JSON document at url, served from the Redis cache when possible.
+
+    Values expire after STRUCTURE_CACHE_TTL seconds. On a miss only one caller downloads the
+    document; concurrent callers wait for it to land in the cache instead of fetching it again.
+    refresh=True skips the cached copy and replaces it with a fresh download.
+
+    extract, if given, is called with the streamed body file and its result is cached instead
+    of the whole document (e.g. jsonstat_metadata for large Eurostat datasets).
+    """
+    key = _cache_key(url, extract)
+
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return json.loads(zlib.decompress(cached))
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        try:
+            return _fetch(url, key, extract)
+        finally:
+            cache.delete(lock_key)
+
+    # Another caller is fetching the same document; wait for its result
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(_POLL_INTERVAL)
+        if cache.get(lock_key) is None:
+            cached = cache.get(key)
+            if cached is not None:
+                return json.loads(zlib.decompress(cached))
+            break
+
+    return _fetch(url, key, extract)
+
+
+def invalidate(*urls):
+    """
+    Drops the cached structure of the given URLs, e.g. when a workflow is reconfigured.
+    """
+    keys = []
+    for url in urls:
+        if url:
+            keys.extend(_cache_key(url, extract) for extract in (None, jsonstat_metadata))
+    if keys:
+        cache.delete_many(keys)
@@ -0,0 +1,103 @@
+import hashlib
+import struct
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from koe_db import series_cache
+
+_PERIOD_SEPARATOR = '\x1f'
+_HEADER = struct.Struct('<III')  # number of periods, number of indicators, length of the encoded periods
+
+
+class TableMatrix:
+    """
+    The data of a CustomTable pivoted to periods (rows, in period order) by indicator ids
+    (columns, ascending), with NaN where an indicator has no value for a period.
+    """
+
+    __slots__ = ('periods', 'indicator_ids', 'values')
+
+    def __init__(self, periods, indicator_ids, values):
+        self.periods = periods
+        self.indicator_ids = indicator_ids
+        self.values = values
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        Builds the matrix from {indicator_id: Series} of the member indicators.
+        """
+        indicator_ids = sorted(series)
+        periods = series_cache.ordered_periods(series[indicator_id] for indicator_id in indicator_ids)
+        row_of = {period: row for row, period in enumerate(periods)}
+        values = np.full((len(periods), len(indicator_ids)), np.nan)
+        for column, indicator_id in enumerate(indicator_ids):
+            one = series[indicator_id]
+            values[[row_of[period] for period in one.periods], column] = one.values
+        return cls(periods, indicator_ids, values)
+
+    def pack(self):
+        periods = _PERIOD_SEPARATOR.join(self.periods).encode()
+        return zlib.compress(
+            _HEADER.pack(len(self.periods), len(self.indicator_ids), len(periods))
+            + periods
+            + np.array(self.indicator_ids, dtype=np.int64).tobytes()
+            + self.values.tobytes()
+        )
+
+    @classmethod
+    def unpack(cls, blob):
+        data = zlib.decompress(blob)
+        rows, columns, periods_length = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        periods = data[offset:offset + periods_length].decode().split(_PERIOD_SEPARATOR) if rows else []
+        offset += periods_length
+        indicator_ids = np.frombuffer(data, dtype=np.int64, count=columns, offset=offset).tolist()
+        offset += columns * 8
+        values = np.frombuffer(data, dtype=np.float64, count=rows * columns, offset=offset).reshape(rows, columns)
+        return cls(periods, indicator_ids, values)
+
+    def rows(self):
+        """
+        Yields {'period', '<indicator id>': value, ...} per period, values formatted as by the API.
+        """
+        columns = [str(indicator_id) for indicator_id in self.indicator_ids]
+        for period, values in zip(self.periods, self.values):
+            row = {'period': period}
+            row.update(zip(columns, series_cache.format_values(values)))
+            yield row
+
+
+def _matrix_key(table_id, indicator_ids):
+    # The key covers the membership and the version of every member series, so it changes
+    # when indicators are added or removed and when any member indicator's Data changes
+    versions = series_cache.versions(indicator_ids)
+    members = ','.join(f"{indicator_id}:{versions[indicator_id]}" for indicator_id in sorted(versions))
+    return f"table:{table_id}:{hashlib.sha256(members.encode()).hexdigest()}"
+
+
+def get_matrix(table_id, indicator_ids):
+    """
+    Returns the TableMatrix of a CustomTable with the given member indicators.
+
+    A read is one fetch of the prebuilt matrix. When a member's Data changed, only that
+    member's series is reloaded from the database; the other columns come from their cached
+    series and the matrix is rebuilt and stored for the next readers.
+    """
+    key = _matrix_key(table_id, indicator_ids)
+    cached = cache.get(key)
+    if cached is not None:
+        return TableMatrix.unpack(cached)
+    matrix = TableMatrix.from_series(series_cache.get_many(indicator_ids))
+    cache.set(key, matrix.pack(), timeout=settings.SERIES_CACHE_TTL)
+    return matrix
+
+
+def rebuild(table):
+    """
+    Prebuilds the matrix of a table after its membership changed, so the next read is served from the cache.
+    """
+    get_matrix(table.id, list(table.indicators.values_list('id', flat=True)))
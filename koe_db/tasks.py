@@ -1,801 +1,172 @@
-import decimal
-import requests
 from celery import shared_task
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
-import json
-from koe_db.models import EuroStatRequest, Workflow, CyStatRequest, CyStatIndicatorMapping, Data, Indicator, ActionLog, WorkflowRun, ECBRequest, EuroStatIndicatorMapping
+from celery.exceptions import MaxRetriesExceededError
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
 from django.utils import timezone
-from django.db import transaction
-from decimal import Decimal
-from koe_db.api_views import update_dependent_custom_indicators
+from koe_db import workflow_leases
+from koe_db.connectors import CyStatConnector, ECBConnector, EurostatConnector
+from koe_db.models import Workflow
+from koe_db.pipeline import (
+    CONNECTORS, fail_throttled_run, recompute_dependents, recover_stale_runs, replay_run, run_pipeline
+)
+from koe_db.rate_limits import Throttled
 
-@shared_task
-def execute_cystat_request(cystat_request_id):
+
+def run_throttled(task, connector_class, source_request_id):
     """
-    Executes a CyStat request and prints the period, indicator, and value.
+    Runs a source task's pipeline. While the upstream host is throttled the task is requeued
+    with a countdown, so its worker slot is free for other work instead of waiting. After
+    UPSTREAM_THROTTLE_MAX_RETRIES requeues the run is recorded as failed.
     """
-    workflow_run = None
     try:
-        cystat_request = CyStatRequest.objects.get(id=cystat_request_id)
-        workflow = cystat_request.workflow
-        # Create a WorkflowRun
-        workflow_run = WorkflowRun.objects.create(
-            workflow=workflow,
-            start_time=timezone.now(),
-            status="RUNNING",
-            success=False
-        )
-
-        print(f"Executing CyStat request for workflow: {cystat_request.workflow.name}")
-
-        # Fetch the request body and URL
-        url = cystat_request.url
-        request_body = cystat_request.request_body
-
-        # Perform a GET request to extract variables and periods
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            json_data = response.json()
-        except Exception as e:
-            print(f"Failed to fetch structure from {url}: {e}")
-            workflow_run.status = "FAILED"
-            workflow_run.error_message=f"Failed to fetch structure from {url}: {e}"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
-            return
-
-        # Extract variables and periods
-        variables = json_data.get("variables", [])
-        title = json_data.get("title", "")
-        period_index = None
-        periods_array = []
-
-        for index, variable in enumerate(variables):
-            if variable.get("code") in ["QUARTER", "MONTH", "YEAR"]:
-                period_index = index
-                raw_periods = variable.get("valueTexts", [])
-                if variable["code"] == "QUARTER":
-                    periods_array = [period[:4] + "-" + period[4:] for period in raw_periods]
-                elif variable["code"] == "MONTH":
-                    periods_array = [period[:4] + "-" + period[5:].zfill(2) for period in raw_periods]
-                elif variable["code"] == "YEAR":
-                    periods_array = raw_periods
-                break
-
-        if period_index is None:
-            print(f"No time-based variable (QUARTER, MONTH, or YEAR) found for {cystat_request.workflow.name}")
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message=f"No time-based variable (QUARTER, MONTH, or YEAR) found for {cystat_request.workflow.name}"
-            workflow_run.save()
-            return
-
-        # Post the request body to the CyStat API
+        run_pipeline(connector_class, source_request_id)
+    except Throttled as e:
+        print(f"{e}; requeueing {task.name}({source_request_id})")
         try:
-            response = requests.post(url, json=request_body)
-            response.raise_for_status()
-            response_data = response.json()
-        except Exception as e:
-            print(f"Failed to execute query for {cystat_request.workflow.name}: {e}")
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message=f"Failed to execute query for {cystat_request.workflow.name}: {e}"
-            workflow_run.save()
-            return
-
-        # Parse the response data
-        data = response_data.get("data", [])
-        columns = response_data.get("columns", [])
-        print(f"Processing data for workflow: {cystat_request.workflow.name}...")
-
-        # Create mapping from column codes to their positions in the key array
-        column_codes = []
-        content_variables = {}  # Maps content variable codes to their value index
-        content_variable_order = []  # Ordered list of content variable codes
+            raise task.retry(countdown=e.wait)
+        except MaxRetriesExceededError:
+            fail_throttled_run(
+                connector_class, source_request_id,
+                f"Upstream host {e.host} stayed throttled, gave up after {task.max_retries} retries"
+            )
 
-        for i, col in enumerate(columns):
-            if col.get("type") == "c":  # Content variable
-                content_variable_order.append(col["code"])
-                content_variables[col["code"]] = len(content_variable_order) - 1  # Index in values array
-            elif col.get("type") in ["t", "d"]:  # Time or dimension variable
-                column_codes.append(col["code"])
 
-        print(f"Column codes in key array: {column_codes}")
-        print(f"Content variables: {content_variables}")
-        print(f"Content variable order: {content_variable_order}")
-
-        # Find the content variable in the structure data (from GET request)
-        # Content variables are those that appear in the GET response but not as dimension/time columns in POST response
-        content_variable_mapping = {}  # Maps content variable code to its meaning/text
-        content_variable_name = None
-
-        # Get all variable codes from GET response
-        get_variable_codes = [var.get("code") for var in variables]
-
-        # Find variables that are in GET response but not in POST column_codes (and not time variables)
-        for variable in variables:
-            var_code = variable.get("code")
-            if (var_code not in column_codes and
-                var_code not in ["QUARTER", "MONTH", "YEAR"] and
-                var_code is not None):
-                content_variable_name = var_code
-                # Map each value index to its corresponding text
-                for idx, value_text in enumerate(variable.get("valueTexts", [])):
-                    content_variable_mapping[str(idx)] = value_text
-                print(f"Found content variable mapping: {content_variable_name} -> {content_variable_mapping}")
-                break
-
-        # Match the data to indicators using the mappings
-        with transaction.atomic():
-            # Create a dictionary to collect changes by indicator
-            indicator_changes = {}  # { indicator_id: [change1, change2, ...] }
-
-            mappings = CyStatIndicatorMapping.objects.filter(cystat_request=cystat_request)
-            for entry in data:
-                # Extract the period using the period index
-                period_index_value = int(entry["key"][period_index])
-                period = periods_array[period_index_value]
-
-                # Match the entry to an indicator
-                for mapping in mappings:
-                    indicator = mapping.indicator
-                    keys = mapping.key_indices  # Example: {"MEASURE": "1", "TYPE OF DATA": "1", "NA AGGREGATE": "9"}
-
-                    # Determine the correct value index for this indicator based on content variable mapping
-                    value_index = 0  # Default to first value
-
-                    # Look for the content variable in the mapping keys
-                    # The content variable name should match what we found in the structure
-                    if content_variable_name and content_variable_name in keys:
-                        # Get the value for the content variable from the mapping
-                        content_var_value = keys[content_variable_name]
-
-                        # This value should correspond to an index in the content variable order
-                        # Find which content variable code this maps to
-                        try:
-                            # The content_var_value should be an index that maps to a content variable
-                            content_var_index = int(content_var_value)
-
-                            # Check if this index exists in our content variable mapping
-                            if str(content_var_index) in content_variable_mapping:
-                                # Find the position of this content variable in the response
-                                content_var_code_in_response = str(content_var_index)
-                                if content_var_code_in_response in content_variables:
-                                    value_index = content_variables[content_var_code_in_response]
-                                    print(f"Mapping indicator {indicator.name} to content variable index {value_index} (code: {content_var_code_in_response}, meaning: {content_variable_mapping.get(content_var_code_in_response, 'Unknown')})")
-                                else:
-                                    # If not found in response, use the index directly if it's valid
-                                    if 0 <= content_var_index < len(content_variable_order):
-                                        value_index = content_var_index
-                                        print(f"Using direct index {value_index} for indicator {indicator.name}")
-                        except (ValueError, TypeError):
-                            print(f"Warning: Could not parse content variable value '{content_var_value}' for indicator {indicator.name}")
-                            value_index = 0
-                    else:
-                        # Fallback: try to find content variable mapping in other ways
-                        for var_code, var_value in keys.items():
-                            if var_code not in column_codes and var_code not in ["QUARTER", "MONTH", "YEAR"]:
-                                try:
-                                    expected_index = int(var_value)
-                                    if 0 <= expected_index < len(content_variable_order):
-                                        value_index = expected_index
-                                        print(f"Fallback: Using content variable index {value_index} for indicator {indicator.name}")
-                                        break
-                                except (ValueError, TypeError):
-                                    continue
+@shared_task(bind=True, max_retries=settings.UPSTREAM_THROTTLE_MAX_RETRIES)
+def execute_cystat_request(self, cystat_request_id):
+    """
+    Executes a CyStat request and updates the mapped indicators with data.
+    """
+    run_throttled(self, CyStatConnector, cystat_request_id)
 
-                    # Construct the expected key array based on column order (excluding content variables)
-                    expected_keys = []
-                    key_index = 0
 
-                    for variable in variables:
-                        variable_code = variable["code"]
-                        if variable_code in ["QUARTER", "MONTH", "YEAR"]:
-                            expected_keys.append("*")  # Wildcard for the period variable
-                        elif variable_code in column_codes:
-                            # This variable is indexed in the key array
-                            expected_keys.append(keys.get(variable_code, None))
-                            if expected_keys[-1] is None:
-                                workflow_run.status = "FAILED"
-                                workflow_run.success = False
-                                workflow_run.end_time = timezone.now()
-                                workflow_run.error_message = f"Variable code '{variable_code}' is no longer compatible. Please update workflow"
-                                workflow_run.save()
-                                return
-                        # Content variables are not added to expected_keys as they're not in the key array
+@shared_task(bind=True, max_retries=settings.UPSTREAM_THROTTLE_MAX_RETRIES)
+def execute_ecb_request(self, ecb_request_id):
+    """
+    Executes an ECB request and updates the mapped indicators with data.
+    A multi-series request feeds every ECBIndicatorMapping from a single SDMX call.
+    """
+    run_throttled(self, ECBConnector, ecb_request_id)
 
-                    # Check if the entry matches the indicator's keys
-                    match = True
-                    for i, key in enumerate(expected_keys):
-                        if key == "*":  # Skip wildcard keys
-                            continue
-                        if i >= len(entry["key"]) or entry["key"][i] != key:
-                            match = False
-                            break
 
-                    if match:
-                        # value_index was already determined above in the content variable logic
+@shared_task(bind=True, max_retries=settings.UPSTREAM_THROTTLE_MAX_RETRIES)
+def execute_eurostat_request(self, eurostat_request_id):
+    """
+    Executes a Eurostat request and processes data for mapped indicators.
+    """
+    run_throttled(self, EurostatConnector, eurostat_request_id)
 
-                        # Convert value to Decimal
-                        try:
-                            if value_index < len(entry["values"]):
-                                value_to_convert = entry["values"][value_index]
-                                print(f"Attempting to convert value: {value_to_convert} (index {value_index}) for period {period} and key {entry['key']}")
-                                dec_value = Decimal(str(value_to_convert))
-                            else:
-                                continue
-                        except (ValueError, KeyError, IndexError, TypeError, decimal.ConversionSyntax, decimal.InvalidOperation):
-                            continue
 
-                        # Find or create Data
-                        existing_data = Data.objects.filter(
-                            indicator=mapping.indicator,
-                            period=period
-                        ).first()
+# Celery task running each workflow type
+SOURCE_TASKS = {
+    'CYSTAT': execute_cystat_request,
+    'ECB': execute_ecb_request,
+    'EUROSTAT': execute_eurostat_request,
+}
 
-                        if existing_data:
-                            old_val = existing_data.value
-                            if old_val != dec_value:
-                                existing_data.value = dec_value
-                                existing_data.save()
 
-                                # Add to our collection of changes for this indicator
-                                change = {
-                                    'period': period,
-                                    'data_id': existing_data.id,
-                                    'old_value': str(old_val),
-                                    'new_value': str(dec_value)
-                                }
-                                indicator_changes.setdefault(mapping.indicator.id, []).append(change)
-                        else:
-                            new_data = Data.objects.create(
-                                indicator=mapping.indicator,
-                                period=period,
-                                value=dec_value
-                            )
+@shared_task
+def recompute_custom_indicators(workflow_run_id, dependents):
+    """
+    Recomputes the custom indicators queued by an ingestion run, once each.
+    dependents maps custom indicator ids to the changed periods of their base indicators.
+    """
+    return recompute_dependents(workflow_run_id, dependents)
 
-                            # Add to our collection of changes for this indicator
-                            change = {
-                                'period': period,
-                                'data_id': new_data.id,
-                                'old_value': 'None',
-                                'new_value': str(dec_value)
-                            }
-                            indicator_changes.setdefault(mapping.indicator.id, []).append(change)
 
-            # Now create one ActionLog per indicator with all its changes
-            for indicator_id, changes in indicator_changes.items():
-                indicator = Indicator.objects.get(id=indicator_id)
+@shared_task
+def replay_workflow_run(workflow_run_id):
+    """
+    Re-parses and diffs the archived payload of a workflow run without network access or writes.
+    """
+    return replay_run(workflow_run_id)
 
-                ActionLog.objects.create(
-                    user=None,
-                    indicator_id=indicator_id,
-                    run=workflow_run,
-                    action_type='DATA_UPDATE',
-                    details=changes  # This must be a list of change objects for indicator_history
-                )
-                # Update dependent custom indicators
-                if changes:  # Only update if there were actual changes
-                    update_dependent_custom_indicators(indicator, None)
 
+def claim_due_workflows(now):
+    """
+    Selects the active workflows whose next_run has passed and moves their next_run to the
+    following cron tick, so later dispatcher ticks do not start them again.
 
-            # Mark workflow as completed
-            workflow_run.status = "COMPLETED"
-            workflow_run.success = True
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+    Workflows still running from an earlier trigger keep their next_run, so their scheduled
+    run starts on the first dispatcher tick after the running one finishes.
+    """
+    from koe_db.workflow_views import calculate_next_run
 
-            # Update last run time and calculate next run
-            workflow.last_run = timezone.now()
-            workflow.last_run_success = True
+    with transaction.atomic():
+        due = list(
+            Workflow.objects.select_for_update(skip_locked=True)
+            .filter(is_active=True, next_run__lte=now)
+            .order_by('next_run')
+        )
+        running = workflow_leases.current_many([workflow.id for workflow in due])
+        due = [workflow for workflow in due if workflow.id not in running]
+        for workflow in due:
             try:
-                from koe_db.workflow_views import calculate_next_run
                 workflow.next_run = calculate_next_run(workflow.schedule_cron)
             except Exception as e:
-                print(f"Error calculating next run: {str(e)}")
-            workflow.save()
-
-    except CyStatRequest.DoesNotExist:
-        print(f"CyStatRequest with ID {cystat_request_id} does not exist.")
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message=f"CyStatRequest with ID {cystat_request_id} does not exist."
-            workflow_run.save()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.error_message = str(e)
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+                print(f"Error calculating next run for workflow {workflow.name}: {str(e)}")
+                workflow.next_run = None
+        Workflow.objects.bulk_update(due, ['next_run'])
+    return due
 
 
-@shared_task
-def execute_ecb_request(ecb_request_id):
+def run_workflow(workflow):
     """
-    Executes an ECB request and updates the corresponding indicator with data.
+    Runs the task of a workflow in the calling thread, with the same WorkflowRun bookkeeping
+    as a scheduled or manual run.
     """
-    workflow_run = None
     try:
-        ecb_request = ECBRequest.objects.get(id=ecb_request_id)
-        workflow = ecb_request.workflow
-
-        # Create a WorkflowRun
-        workflow_run = WorkflowRun.objects.create(
-            workflow=workflow,
-            start_time=timezone.now(),
-            status="RUNNING",
-            success=False
-        )
-
-        print(f"Executing ECB request for workflow: {ecb_request.workflow.name}")
-
-        # Fetch the indicator for this ECB request
-        try:
-            indicator = Indicator.objects.get(id=ecb_request.indicator_id)
-        except Indicator.DoesNotExist:
-            error_msg = f"Indicator with ID {ecb_request.indicator_id} not found for ECB request {ecb_request_id}"
-            print(error_msg)
-            workflow_run.status = "FAILED"
-            workflow_run.error_message = error_msg
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+        connector_class = CONNECTORS.get(workflow.workflow_type)
+        if connector_class is None:
+            print(f"Workflow type '{workflow.workflow_type}' cannot be dispatched")
             return
-
-        # Construct the URL
-        url = f"https://data-api.ecb.europa.eu/service/data/{ecb_request.table}/{ecb_request.parameters}?format=jsondata"
-
-        # Fetch data from ECB API
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            response_data = response.json()
-        except Exception as e:
-            error_msg = f"Failed to fetch data from ECB API: {str(e)}"
-            print(error_msg)
-            workflow_run.status = "FAILED"
-            workflow_run.error_message = error_msg
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+        source_request_id = connector_class.request_model.objects.filter(workflow=workflow).values_list('id', flat=True).first()
+        if source_request_id is None:
+            print(f"No {workflow.workflow_type} request found for workflow: {workflow.name}")
             return
-
-
-        # Extract time periods
-        periods = []
-        for dim in response_data.get('structure', {}).get('dimensions', {}).get('observation', []):
-            if dim.get('id') == 'TIME_PERIOD' and dim.get('values'):
-                periods = [period.get('id') for period in dim['values']]
-                break
-
-        if not periods:
-            error_msg = "No time periods found in ECB response"
-            print(error_msg)
-            workflow_run.status = "FAILED"
-            workflow_run.error_message = error_msg
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+        try:
+            metrics = run_pipeline(connector_class, source_request_id)
+        except Throttled as e:
+            # Hand the run to a worker later rather than holding a dispatcher thread
+            print(f"{e}; requeueing workflow: {workflow.name}")
+            SOURCE_TASKS[workflow.workflow_type].apply_async((source_request_id,), countdown=e.wait)
             return
-
-        print(f"Found {len(periods)} time periods in ECB data")
-
-        # Get values from the first series in the dataset
-        values = {}
-
-        if response_data.get('dataSets') and response_data['dataSets'][0].get('series'):
-            # Get the first series
-            first_series = next(iter(response_data['dataSets'][0]['series'].values()))
-
-            if first_series.get('observations'):
-                for obs_key, obs_data in first_series['observations'].items():
-                    period_idx = int(obs_key)
-                    if period_idx < len(periods):
-                        period = periods[period_idx]
-                        value = obs_data[0] if obs_data else None
-                        values[period] = value
-
-        if not values:
-            error_msg = "No data values found in ECB response"
-            print(error_msg)
-            workflow_run.status = "FAILED"
-            workflow_run.error_message = error_msg
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+        except Exception as e:
+            # The claim already moved next_run on; one failing workflow must not stop the others
+            print(f"Error running workflow {workflow.name}: {str(e)}")
             return
-
-        print(f"Found {len(values)} data points in ECB response")
-
-        # Dict to store changes for action log
-        indicator_changes = []
-
-        # Update indicator data
-        with transaction.atomic():
-            for period, value in values.items():
-                if value is None:
-                    continue
-
-                try:
-                    decimal_value = Decimal(str(value))
-                except (decimal.InvalidOperation, TypeError):
-                    print(f"Could not convert value {value} to Decimal for period {period}")
-                    continue
-
-                # Find or create Data
-                existing_data = Data.objects.filter(
-                    indicator=indicator,
-                    period=period
-                ).first()
-
-                if existing_data:
-                    old_val = existing_data.value
-                    if old_val != decimal_value:
-                        existing_data.value = decimal_value
-                        existing_data.save()
-
-                        # Add change to our collection
-                        indicator_changes.append({
-                            'period': period,
-                            'data_id': existing_data.id,
-                            'old_value': str(old_val),
-                            'new_value': str(decimal_value)
-                        })
-                else:
-                    new_data = Data.objects.create(
-                        indicator=indicator,
-                        period=period,
-                        value=decimal_value
-                    )
-
-                    # Add change to our collection
-                    indicator_changes.append({
-                        'period': period,
-                        'data_id': new_data.id,
-                        'old_value': 'None',
-                        'new_value': str(decimal_value)
-                    })
-
-            # Create an ActionLog if there are changes
-            if indicator_changes:
-                ActionLog.objects.create(
-                    user=None,
-                    indicator_id=indicator.id,
-                    run=workflow_run,
-                    action_type='DATA_UPDATE',
-                    details=indicator_changes
-                )
-                print(f"Created action log with {len(indicator_changes)} changes for indicator {indicator.name}")
-
-                # Update dependent custom indicators
-                update_dependent_custom_indicators(indicator, None)
-
-            # Mark workflow as completed
-            workflow_run.status = "COMPLETED"
-            workflow_run.success = True
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
-
-            # Update last run time and calculate next run
-            workflow.last_run = timezone.now()
-            workflow.last_run_success = True
-            try:
-                from koe_db.workflow_views import calculate_next_run
-                workflow.next_run = calculate_next_run(workflow.schedule_cron)
-            except Exception as e:
-                print(f"Error calculating next run: {str(e)}")
-            workflow.save()
-
-    except ECBRequest.DoesNotExist:
-        error_msg = f"ECBRequest with ID {ecb_request_id} does not exist."
-        print(error_msg)
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message = error_msg
-            workflow_run.save()
-    except Exception as e:
-        error_msg = f"An error occurred during ECB request execution: {str(e)}"
-        print(error_msg)
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.error_message = error_msg
-            workflow_run.end_time = timezone.now()
-            workflow_run.save()
+        if 'running_run_id' in metrics:
+            # Another trigger started the workflow after it was claimed; keep the scheduled run
+            # due so a later dispatcher tick starts it once that run finishes
+            print(f"Workflow {workflow.name} was already running, its scheduled run stays due")
+            Workflow.objects.filter(pk=workflow.pk).update(next_run=timezone.now())
+    finally:
+        # Worker threads open their own database connections
+        connections.close_all()
 
 
 @shared_task
-def execute_eurostat_request(eurostat_request_id):
+def dispatch_due_workflows():
     """
-    Executes a Eurostat request and processes data for mapped indicators.
+    Runs every workflow that is due in this worker instead of one Celery task per workflow.
+
+    Up to WORKFLOW_DISPATCH_WORKERS workflows run at the same time, so their upstream fetches
+    overlap (at most HTTP_HOST_CONCURRENCY per host) while each source task still parses and
+    writes its own data. Runs left RUNNING by a worker that died are rolled back first.
+    Returns the number of workflows started.
     """
-    workflow_run = None
     try:
-        # Get the Eurostat request and associated workflow
-        eurostat_request = EuroStatRequest.objects.get(id=eurostat_request_id)
-        workflow = eurostat_request.workflow
-
-        # Create a WorkflowRun
-        workflow_run = WorkflowRun.objects.create(
-            workflow=workflow,
-            start_time=timezone.now(),
-            status="RUNNING",
-            success=False
-        )
-
-        print(f"Executing Eurostat request for workflow: {eurostat_request.workflow.name}")
-
-        # Fetch data from Eurostat API
-        try:
-            response = requests.get(eurostat_request.url)
-            response.raise_for_status()
-            json_data = response.json()
-        except Exception as e:
-            error_msg = f"Failed to fetch data from Eurostat API: {str(e)}"
-            print(error_msg)
-            if workflow_run:
-                workflow_run.status = "FAILED"
-                workflow_run.error_message = error_msg
-                workflow_run.success = False
-                workflow_run.end_time = timezone.now()
-                workflow_run.save()
-            return
-
-        # Get indicator mappings for this request
-        indicator_mappings = EuroStatIndicatorMapping.objects.filter(eurostat_request=eurostat_request)
-        if not indicator_mappings:
-            error_msg = f"No indicator mappings found for Eurostat request {eurostat_request_id}"
-            print(error_msg)
-            if workflow_run:
-                workflow_run.status = "FAILED"
-                workflow_run.error_message = error_msg
-                workflow_run.success = False
-                workflow_run.end_time = timezone.now()
-                workflow_run.save()
-            return
-
-        # Extract dimensions information from response
-        dimensions = []
-        dimension_sizes = {}
-        dimension_indices = {}
-
-        if 'dimension' in json_data:
-            for dim_key, dim_data in json_data['dimension'].items():
-                categories = []
-
-                if 'category' in dim_data and 'index' in dim_data['category']:
-                    # Get indices for this dimension
-                    categories = list(dim_data['category']['index'].keys())
-                    dimension_size = len(categories)
-                    dimension_sizes[dim_key] = dimension_size
-
-                    # Store category indices for each dimension
-                    dimension_indices[dim_key] = {}
-                    for cat_key, cat_index in dim_data['category']['index'].items():
-                        dimension_indices[dim_key][cat_key] = cat_index
-
-                dimensions.append({
-                    'id': dim_key,
-                    'size': dimension_sizes.get(dim_key, 0),
-                    'is_time': dim_key == 'time'
-                })
-
-        # Calculate size products for all dimensions
-        dimension_keys = [d['id'] for d in dimensions]
-        size_products = {}
-        running_product = 1
-
-        # Calculate products (last dimension changes fastest)
-        for dim_key in reversed(dimension_keys):
-            size_products[dim_key] = running_product
-            running_product *= dimension_sizes.get(dim_key, 1)
-
-        print(f"Dimension sizes: {dimension_sizes}")
-        print(f"Size products: {size_products}")
-
-        # Get time periods
-        periods = {}
-        if 'time' in dimension_indices:
-            for period_key, period_index in dimension_indices['time'].items():
-                periods[period_index] = period_key
-
-        # Process data for each indicator mapping
-        indicator_data = {}
-
-        for mapping in indicator_mappings:
-            try:
-                indicator = Indicator.objects.get(id=mapping.indicator_id)
-                print(f"Processing data for indicator: {indicator.name} ({indicator.id})")
-
-                # Get dimension values for this indicator mapping
-                dimension_values = mapping.dimension_values or {}
-
-                # Calculate the array indices for this mapping
-                matching_indices = []
-
-                # Start with all indices if we have value data
-                if 'value' in json_data:
-                    all_indices = list(map(int, json_data['value'].keys()))
-
-                    # Filter indices that match our dimension values
-                    for index in all_indices:
-                        matches_all_dimensions = True
-                        remaining_index = index
-
-                        # Check each non-time dimension
-                        for dim_key in dimension_keys:
-                            if dim_key == 'time':
-                                continue  # Skip time dimension
-
-                            if dim_key in dimension_values:
-                                # Get expected category key for this dimension
-                                expected_cat_key = dimension_values[dim_key]
-
-                                # Calculate which category this index points to
-                                product = size_products.get(dim_key, 1)
-                                dim_size = dimension_sizes.get(dim_key, 1)
-
-                                if dim_size > 0:
-                                    dim_index = (remaining_index // product) % dim_size
-
-                                    # Get the category key for this index
-                                    actual_cat_key = None
-                                    for cat_key, cat_index in dimension_indices[dim_key].items():
-                                        if cat_index == dim_index:
-                                            actual_cat_key = cat_key
-                                            break
-
-                                    if actual_cat_key != expected_cat_key:
-                                        matches_all_dimensions = False
-                                        break
-
-                                # Subtract the processed portion from remaining index
-                                remaining_index -= ((remaining_index // product) % dim_size) * product
-
-                        if matches_all_dimensions:
-                            matching_indices.append(index)
-
-                    # Process matching indices to get period/value pairs
-                    with transaction.atomic():
-                        indicator_values = []
-                        indicator_changes = {}
-
-
-                        for index in matching_indices:
-                            value = json_data['value'].get(str(index))
-                            if value is None:
-                                continue
-
-                            # Calculate time period for this index
-                            remaining_index = index
-                            time_product = size_products.get('time', 1)
-                            time_size = dimension_sizes.get('time', 1)
-
-                            if time_size > 0 and time_product > 0:
-                                time_index = (remaining_index // time_product) % time_size
-                                period = periods.get(time_index)
-
-                                if period:
-                                    indicator_values.append((period, value))
-
-                        # Store values for this indicator
-                        indicator_data[indicator.id] = {
-                            'name': indicator.name,
-                            'code': indicator.code,
-                            'values': indicator_values
-                        }
-
-
-
-
-
-
-                        # Create or update Data objects for this indicator
-                        for period, value in indicator_values:
-                            try:
-                                decimal_value = Decimal(str(value))
-                            except (decimal.InvalidOperation, TypeError):
-                                print(f"Invalid value {value} for period {period} in indicator {indicator.name}")
-                                continue
-
-                            # Find or create Data
-                            existing_data = Data.objects.filter(
-                                indicator=indicator,
-                                period=period
-                            ).first()
-
-                            if existing_data:
-                                old_val = existing_data.value
-                                if old_val != decimal_value:
-                                    existing_data.value = decimal_value
-                                    existing_data.save()
-                                    # Log the change
-                                    # Add to our collection of changes for this indicator
-                                    change = {
-                                        'period': period,
-                                        'data_id': existing_data.id,
-                                        'old_value': str(old_val),
-                                        'new_value': str(decimal_value)
-                                    }
-                                    indicator_changes.setdefault(indicator.id, []).append(change)
-                            else:
-                                new_data = Data.objects.create(
-                                    indicator=indicator,
-                                    period=period,
-                                    value=decimal_value
-                                )
-                                change = {
-                                    'period': period,
-                                    'data_id': new_data.id,
-                                    'old_value': 'None',
-                                    'new_value': str(decimal_value)
-                                }
-                                indicator_changes.setdefault(indicator.id, []).append(change)
-
-                        # Create an ActionLog for this indicator
-
-                        if indicator_changes:
-                            ActionLog.objects.create(
-                                user=None,
-                                indicator_id=indicator.id,
-                                run=workflow_run,
-                                action_type='DATA_UPDATE',
-                                details=indicator_changes[indicator.id]  # This must be a list of change objects for indicator_history
-                            )
-                            # Update dependent custom indicators
-                            update_dependent_custom_indicators(indicator, None)
-                        # Mark workflow as completed
-                        if workflow_run:
-                            workflow_run.status = "COMPLETED"
-                            workflow_run.success = True
-                            workflow_run.end_time = timezone.now()
-                            workflow_run.save()
-
-                        # Update workflow last run time
-                        workflow.last_run = timezone.now()
-                        workflow.last_run_success = True
-                        try:
-                            from koe_db.workflow_views import calculate_next_run
-                            workflow.next_run = calculate_next_run(workflow.schedule_cron)
-                        except Exception as e:
-                            print(f"Error calculating next run: {str(e)}")
-                        workflow.save()
-
-            except Indicator.DoesNotExist:
-                print(f"Warning: Indicator with ID {mapping.indicator_id} not found")
-            except Exception as e:
-                print(f"Error processing mapping for indicator {mapping.indicator_id}: {str(e)}")
-
-
+        recovered = recover_stale_runs()
+        if recovered:
+            print(f"Rolled back {recovered} runs left by stopped workers")
+    except Exception as e:
+        print(f"Failed to recover stale workflow runs: {str(e)}")
 
+    due = claim_due_workflows(timezone.now())
+    if not due:
+        return 0
 
-    except EuroStatRequest.DoesNotExist:
-        error_msg = f"EuroStatRequest with ID {eurostat_request_id} does not exist."
-        print(error_msg)
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message = error_msg
-            workflow_run.save()
-    except Exception as e:
-        error_msg = f"An error occurred during Eurostat request execution: {str(e)}"
-        print(error_msg)
-        import traceback
-        traceback.print_exc()
-        if workflow_run:
-            workflow_run.status = "FAILED"
-            workflow_run.success = False
-            workflow_run.end_time = timezone.now()
-            workflow_run.error_message = error_msg
-            workflow_run.save()
+    print(f"Dispatching {len(due)} due workflows")
+    with ThreadPoolExecutor(max_workers=min(settings.WORKFLOW_DISPATCH_WORKERS, len(due))) as executor:
+        list(executor.map(run_workflow, due))
+    return len(due)
@@ -1,3 +1,1301 @@
-from django.test import TestCase
+import hashlib
+import importlib
+import io
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from django.apps import apps
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+from koe_db import (
+    api_views, http_client, pipeline, rate_limits, series_cache, streaming, structure_cache, table_cache,
+    tasks, workflow_leases, workflow_views
+)
+from koe_db.connectors import CyStatConnector, ECBConnector, EurostatConnector, compile_cystat_mappings
+from koe_db.data_changes import details_by_log, log_data_updates
+from koe_db.ingestion import (
+    apply_indicator_diff, batch_indicator_diff, diff_indicator_values, revert_indicator_changes, upsert_data
+)
+from koe_db.jsonstat import JsonStatCube, stream_select
+from koe_db.models import (
+    ActionLog, CustomIndicator, CustomTable, CyStatIndicatorMapping, CyStatRequest, Data, DataChange, ECBRequest,
+    EuroStatIndicatorMapping, EuroStatRequest, Frequency, Indicator, UserAccount, Workflow, WorkflowRun
+)
+from koe_db.periods_utils import format_label, parse_period, period_fields, shift_period
+from koe_db.pipeline import Connector, ConnectorError, SourceUnchanged
+from koe_db.pxweb import plan_queries
+from koe_db.sdmx import ecb_series, ecb_time_periods, stream_ecb_series
+
+try:
+    import fakeredis
+except ImportError:
+    # The Redis script tests run against fakeredis[lua] when it is installed
+    fakeredis = None
+
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class UpsertDataTests(TestCase):
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='Upsert')
+
+    def values(self):
+        return dict(Data.objects.filter(indicator=self.indicator).values_list('period', 'value'))
+
+    def test_inserts_new_rows(self):
+        written = upsert_data([
+            Data(indicator=self.indicator, period='2020', value=1),
+            Data(indicator=self.indicator, period='2021', value=2),
+        ])
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+        self.assertEqual(set(written), {(self.indicator.id, '2020'), (self.indicator.id, '2021')})
+
+    def test_updates_existing_row_in_place(self):
+        written = upsert_data([Data(indicator=self.indicator, period='2020', value=1)])
+        data_id = written[(self.indicator.id, '2020')]
+        written = upsert_data([Data(indicator=self.indicator, period='2020', value=5)])
+        self.assertEqual(written, {(self.indicator.id, '2020'): data_id})
+        self.assertEqual(self.values(), {'2020': Decimal('5')})
+
+    def test_unchanged_rows_are_not_written(self):
+        upsert_data([Data(indicator=self.indicator, period='2020', value=1)])
+        written = upsert_data([
+            Data(indicator=self.indicator, period='2020', value=Decimal('1.00000')),
+            Data(indicator=self.indicator, period='2021', value=None),
+        ])
+        self.assertEqual(set(written), {(self.indicator.id, '2021')})
+        # NULL against NULL is also unchanged
+        self.assertEqual(upsert_data([Data(indicator=self.indicator, period='2021', value=None)]), {})
+
+    def test_only_update_fields_are_updated(self):
+        upsert_data([Data(indicator=self.indicator, period='2020', value=1, isEstimate=True)])
+        upsert_data([Data(indicator=self.indicator, period='2020', value=2, isEstimate=False)])
+        self.assertTrue(Data.objects.get(indicator=self.indicator, period='2020').isEstimate)
+        upsert_data([Data(indicator=self.indicator, period='2020', value=2, isEstimate=False)], update_fields=('value', 'isEstimate'))
+        self.assertFalse(Data.objects.get(indicator=self.indicator, period='2020').isEstimate)
+
+    def test_last_row_wins_on_repeated_key(self):
+        upsert_data([
+            Data(indicator=self.indicator, period='2020', value=1),
+            Data(indicator=self.indicator, period='2020', value=3),
+        ])
+        self.assertEqual(self.values(), {'2020': Decimal('3')})
+
+    def test_fills_period_start(self):
+        upsert_data([Data(indicator=self.indicator, period='2020-Q2', value=1)])
+        row = Data.objects.get(indicator=self.indicator)
+        self.assertEqual(str(row.period_start), '2020-04-01')
+        self.assertEqual(row.period_frequency, 'QUARTERLY')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class IndicatorDiffTests(TestCase):
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='Diff')
+        upsert_data([
+            Data(indicator=self.indicator, period='2020', value=1),
+            Data(indicator=self.indicator, period='2021', value=2),
+        ])
+
+    def values(self):
+        return dict(Data.objects.filter(indicator=self.indicator).values_list('period', 'value'))
+
+    def test_diff_skips_unchanged_values(self):
+        to_create, to_update, changes = diff_indicator_values({
+            self.indicator.id: {'2020': Decimal('1.000001'), '2021': Decimal('4'), '2022': Decimal('5')}
+        })
+        self.assertEqual([row.period for row in to_create], ['2022'])
+        self.assertEqual([row.period for row in to_update], ['2021'])
+        self.assertEqual([change['period'] for _, change, _ in changes], ['2021', '2022'])
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+
+    def test_apply_fills_created_ids(self):
+        changes = apply_indicator_diff(*diff_indicator_values({self.indicator.id: {'2022': Decimal('5')}}))
+        created = Data.objects.get(indicator=self.indicator, period='2022')
+        self.assertEqual(changes, {self.indicator.id: [
+            {'period': '2022', 'data_id': created.id, 'old_value': 'None', 'new_value': '5'}
+        ]})
+
+    def test_revert_restores_updates_and_deletes_creates(self):
+        diff = diff_indicator_values({self.indicator.id: {'2021': Decimal('4'), '2022': Decimal('5')}})
+        apply_indicator_diff(*diff)
+        self.assertEqual(revert_indicator_changes(diff[2]), 2)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+
+    def test_batches_split_one_indicator(self):
+        diff = diff_indicator_values({self.indicator.id: {'2021': Decimal('4'), '2022': Decimal('5'), '2023': Decimal('6')}})
+        batches = list(batch_indicator_diff(*diff, 2))
+        self.assertEqual(
+            [[change['period'] for _, change, _ in batch[2]] for batch in batches],
+            [['2021', '2022'], ['2023']]
+        )
+        self.assertEqual([len(batch[0]) + len(batch[1]) for batch in batches], [2, 1])
+
+    def test_revert_leaves_rows_edited_since_alone(self):
+        diff = diff_indicator_values({self.indicator.id: {'2021': Decimal('4'), '2022': Decimal('5')}})
+        apply_indicator_diff(*diff)
+        Data.objects.filter(indicator=self.indicator, period='2021').update(value=7)
+        self.assertEqual(revert_indicator_changes(diff[2]), 1)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('7')})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class DataViewTests(TestCase):
+    def setUp(self):
+        self.user = UserAccount.objects.create(email='editor@example.com', is_superuser=True, is_staff=True)
+        self.indicator = Indicator.objects.create(name='Edited')
+        upsert_data([
+            Data(indicator=self.indicator, period='2020', value=1),
+            Data(indicator=self.indicator, period='2021', value=2),
+        ])
+        patcher = mock.patch.object(api_views, 'get_user', return_value=self.user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, entries):
+        request = RequestFactory().post('/', data=json.dumps(entries), content_type='application/json')
+        return api_views.data(request, self.indicator.id)
+
+    def values(self):
+        return dict(Data.objects.filter(indicator=self.indicator).values_list('period', 'value'))
+
+    def test_failed_request_writes_nothing(self):
+        point = Data.objects.get(indicator=self.indicator, period='2020')
+        with mock.patch.object(api_views, 'log_data_update', side_effect=RuntimeError("log failed")):
+            response = self.post([
+                {'id': point.id, 'period': '2019', 'value': 1},
+                {'period': '2022', 'value': 3},
+            ])
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+        self.assertFalse(ActionLog.objects.exists())
+
+    def test_unknown_id_is_not_found(self):
+        response = self.post([{'id': 999999, 'period': '2022', 'value': 3}])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+
+    def test_id_of_another_indicator_is_not_found(self):
+        other = Indicator.objects.create(name='Other')
+        upsert_data([Data(indicator=other, period='2020', value=9)])
+        foreign = Data.objects.get(indicator=other)
+        for period in ('2019', '2020'):
+            response = self.post([{'id': foreign.id, 'period': period, 'value': 3}])
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            list(Data.objects.filter(indicator=other).values_list('period', 'value')), [('2020', Decimal('9'))]
+        )
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+        self.assertFalse(ActionLog.objects.exists())
+
+    def test_moving_onto_an_existing_period_is_rejected(self):
+        point = Data.objects.get(indicator=self.indicator, period='2020')
+        response = self.post([{'id': point.id, 'period': '2021', 'value': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('2021', json.loads(response.content)['error'])
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+
+    def test_swapping_two_periods_is_allowed(self):
+        first = Data.objects.get(indicator=self.indicator, period='2020')
+        second = Data.objects.get(indicator=self.indicator, period='2021')
+        response = self.post([
+            {'id': second.id, 'period': '2022', 'value': 2},
+            {'id': first.id, 'period': '2021', 'value': 1},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.values(), {'2021': Decimal('1'), '2022': Decimal('2')})
+
+    def test_point_without_id_logs_the_stored_value(self):
+        existing = Data.objects.get(indicator=self.indicator, period='2021')
+        response = self.post([
+            {'period': '2021', 'value': 5},
+            {'period': '2020', 'value': 1},
+            {'period': '2022', 'value': 6},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('5'), '2022': Decimal('6')})
+        changes = DataChange.objects.order_by('period').values_list('period', 'data_id', 'old_value', 'new_value')
+        self.assertEqual(list(changes), [
+            ('2021', existing.id, '2.00000', '5'),
+            ('2022', None, 'None', '6'),
+        ])
+
+
+@override_settings(STREAMING_PARSE_THRESHOLD=0)
+class StreamingParseTests(TestCase):
+    # 'value' comes first so the metadata pass has to skip over the observations
+    jsonstat = {
+        'value': {'0': 1.5, '1': None, '3': 4.0, '4': 5.0, '7': 8.0},
+        'id': ['geo', 'time'],
+        'size': [2, 4],
+        'dimension': {
+            'geo': {'category': {'index': ['CY', 'EL']}},
+            'time': {'category': {'index': {'2020': 0, '2021': 1, '2022': 2, '2023': 3}}},
+        },
+        'label': 'GDP',
+    }
+    sdmx = {
+        'dataSets': [{'series': {
+            '0:0': {'attributes': [0], 'observations': {'0': [1.1], '2': [1.3]}},
+            '0:1': {'attributes': [1], 'observations': {'1': [2.2], '2': [None]}},
+        }}],
+        'structure': {
+            'dimensions': {
+                'series': [
+                    {'id': 'FREQ', 'values': [{'id': 'M'}]},
+                    {'id': 'CURRENCY', 'values': [{'id': 'USD'}, {'id': 'GBP'}]},
+                ],
+                'observation': [{'id': 'TIME_PERIOD', 'values': [{'id': '2024-01'}, {'id': '2024-02'}, {'id': '2024-03'}]}],
+            },
+            'attributes': {'series': [{'id': 'TITLE', 'values': [{'name': 'US dollar'}, {'name': 'UK pound'}]}]},
+        },
+    }
+
+    def body(self, payload):
+        body = io.BytesIO(json.dumps(payload).encode())
+        self.assertTrue(streaming.is_large(body))
+        return body
+
+    def test_json_members_reads_every_member_in_one_pass(self):
+        with mock.patch.object(streaming.ijson, 'parse', wraps=streaming.ijson.parse) as parse:
+            members = streaming.json_members(self.body(self.jsonstat), ('id', 'dimension', 'label', 'missing'))
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(members, {key: self.jsonstat[key] for key in ('id', 'dimension', 'label')})
+
+    def test_stream_select_matches_in_memory_select(self):
+        selections = {'cy': {'geo': 'CY'}, 'el': {'geo': 'EL'}, 'all': {}, 'unknown': {'geo': 'MT'}}
+        self.assertEqual(
+            stream_select(self.body(self.jsonstat), selections, chunk_size=2),
+            JsonStatCube(self.jsonstat).select_many(selections)
+        )
+
+    def test_stream_ecb_series_matches_in_memory_series(self):
+        series = ecb_series(self.sdmx)
+        periods = ecb_time_periods(self.sdmx)
+        self.assertEqual(stream_ecb_series(self.body(self.sdmx), ['M.USD', 'M.GBP']), (periods, series))
+        self.assertEqual(stream_ecb_series(self.body(self.sdmx), ['M.GBP']), (periods, {'M.GBP': series['M.GBP']}))
+        self.assertEqual(stream_ecb_series(self.body(self.sdmx)), (periods, {'M.USD': series['M.USD']}))
+
+
+class PeriodParsingTests(TestCase):
+    def test_parses_every_source_format(self):
+        cases = {
+            '2020': (datetime(2020, 1, 1), Frequency.ANNUAL),
+            '2020-S2': (datetime(2020, 7, 1), Frequency.SEMIANNUAL),
+            '2020T3': (datetime(2020, 9, 1), Frequency.TRIANNUAL),
+            '2020Q1': (datetime(2020, 1, 1), Frequency.QUARTERLY),
+            '2020-Q4': (datetime(2020, 10, 1), Frequency.QUARTERLY),
+            '2020-01': (datetime(2020, 1, 1), Frequency.MONTHLY),
+            '2020M03': (datetime(2020, 3, 1), Frequency.MONTHLY),
+            '2020-M11': (datetime(2020, 11, 1), Frequency.MONTHLY),
+            '01-2020': (datetime(2020, 1, 1), Frequency.MONTHLY),
+            '2020-W05': (datetime(2020, 1, 27), Frequency.WEEKLY),
+            '2020-03-15': (datetime(2020, 3, 15), Frequency.DAILY),
+            '15-03-2020': (datetime(2020, 3, 15), Frequency.DAILY),
+            '2020-03-15T10:00:00': (datetime(2020, 3, 15, 10), None),
+        }
+        for period, expected in cases.items():
+            with self.subTest(period=period):
+                self.assertEqual(parse_period(period), expected)
+
+    def test_rejects_unknown_and_invalid_periods(self):
+        for period in (None, '', 'bogus', '2020-13', '2020-Q5', '31-02-2020'):
+            with self.subTest(period=period):
+                self.assertIsNone(parse_period(period))
+        self.assertEqual(period_fields('bogus'), {'period_start': None, 'period_frequency': None})
+
+    def test_reads_back_format_label(self):
+        date = datetime(2020, 2, 9)
+        for frequency in (Frequency.WEEKLY, Frequency.MONTHLY, Frequency.DAILY, Frequency.ANNUAL):
+            with self.subTest(frequency=frequency):
+                parsed_date, parsed_frequency = parse_period(format_label(date, frequency))
+                self.assertEqual(parsed_frequency, frequency)
+                self.assertEqual(format_label(parsed_date, frequency), format_label(date, frequency))
+
+    def test_shift_period(self):
+        self.assertEqual(shift_period('2020-Q1', -1), '2019-Q4')
+        self.assertEqual(shift_period('2020-M11', 3), '2021-02')
+        self.assertEqual(shift_period('2020', -2), '2018')
+        self.assertEqual(shift_period('2020-W01', -1), '2019-W52')
+        self.assertIsNone(shift_period('bogus', 1))
+        # isoformat periods have no frequency to step by
+        self.assertIsNone(shift_period('2020-03-15T10:00:00', 1))
+
+
+class JsonStatSelectManyTests(TestCase):
+    def setUp(self):
+        # geo (3) x unit (2) x time (4), one null and two missing observations
+        values = {str(position): float(position) for position in range(24)}
+        values['5'] = None
+        del values['6']
+        del values['17']
+        self.cube = JsonStatCube({
+            'id': ['geo', 'unit', 'time'],
+            'size': [3, 2, 4],
+            'dimension': {
+                'geo': {'category': {'index': {'CY': 0, 'EL': 1, 'MT': 2}}},
+                'unit': {'category': {'index': ['EUR', 'PC']}},
+                'time': {'category': {'index': {'2020': 0, '2021': 1, '2022': 2, '2023': 3}}},
+            },
+            'value': values,
+        })
+
+    def test_matches_select(self):
+        selections = {
+            'cy-eur': {'geo': 'CY', 'unit': 'EUR'},
+            'cy-pc': {'geo': 'CY', 'unit': 'PC'},
+            'mt-pc': {'geo': 'MT', 'unit': 'PC'},
+            'el': {'geo': 'EL'},
+            'pc': {'unit': 'PC'},
+            'all': {},
+            'unknown-category': {'geo': 'DE', 'unit': 'EUR'},
+            'unknown-dimension': {'geo': 'EL', 'sex': 'F'},
+        }
+        selected = self.cube.select_many(selections)
+        for key, dimension_values in selections.items():
+            with self.subTest(selection=key):
+                self.assertEqual(selected[key], self.cube.select(dimension_values))
+
+    def test_skips_missing_and_null_observations(self):
+        self.assertEqual(
+            self.cube.select_many({'cy-pc': {'geo': 'CY', 'unit': 'PC'}})['cy-pc'],
+            [('2020', 4.0), ('2023', 7.0)]
+        )
+        self.assertEqual(self.cube.select_many({'unknown': {'geo': 'DE'}}), {'unknown': []})
+
+
+class PlanQueriesTests(TestCase):
+    variables = [
+        {'code': 'MEASURE', 'values': ['1', '2', '3']},
+        {'code': 'YEAR', 'values': [str(year) for year in range(2010, 2020)]},
+        {'code': 'SEX', 'values': ['0', '1'], 'elimination': True},
+    ]
+    # Two measures per period: 20 cells for the whole table
+    query = {'query': [{'code': 'MEASURE', 'selection': {'filter': 'item', 'values': ['1', '2']}}]}
+
+    def time_selections(self, queries):
+        return [query['query'][-1]['selection'] for query in queries]
+
+    def test_query_within_limit_is_sent_unchanged(self):
+        self.assertEqual(plan_queries(self.query, self.variables, cell_limit=20), [self.query])
+
+    def test_splits_one_cell_over_the_limit(self):
+        queries = plan_queries(self.query, self.variables, cell_limit=19)
+        self.assertEqual(self.time_selections(queries), [
+            {'filter': 'item', 'values': [str(year) for year in range(2010, 2019)]},
+            {'filter': 'top', 'values': ['1']},
+        ])
+        self.assertEqual(queries[0]['query'][0], self.query['query'][0])
+        # The configured query is not modified
+        self.assertEqual(len(self.query['query']), 1)
+
+    def test_chunks_respect_the_limit(self):
+        queries = plan_queries(self.query, self.variables, cell_limit=6)
+        self.assertEqual(self.time_selections(queries), [
+            {'filter': 'item', 'values': ['2010', '2011', '2012']},
+            {'filter': 'item', 'values': ['2013', '2014', '2015']},
+            {'filter': 'item', 'values': ['2016', '2017', '2018']},
+            {'filter': 'top', 'values': ['1']},
+        ])
+
+    def test_start_period_selects_the_newest_periods(self):
+        queries = plan_queries(self.query, self.variables, first_index=7, cell_limit=20)
+        self.assertEqual(self.time_selections(queries), [{'filter': 'top', 'values': ['3']}])
+        queries = plan_queries(self.query, self.variables, first_index=4, cell_limit=6)
+        self.assertEqual(self.time_selections(queries), [
+            {'filter': 'item', 'values': ['2014', '2015', '2016']},
+            {'filter': 'top', 'values': ['3']},
+        ])
+
+    def test_empty_plan_when_no_period_is_left(self):
+        self.assertEqual(plan_queries(self.query, self.variables, first_index=10, cell_limit=20), [])
+
+    def test_queries_selecting_time_are_sent_as_configured(self):
+        query = {'query': [{'code': 'YEAR', 'selection': {'filter': 'top', 'values': ['2']}}]}
+        self.assertEqual(plan_queries(query, self.variables, first_index=5, cell_limit=1), [query])
+        variables = [variable for variable in self.variables if variable['code'] != 'YEAR']
+        self.assertEqual(plan_queries(self.query, variables, first_index=5, cell_limit=1), [self.query])
+
+
+class CompileCyStatMappingsTests(TestCase):
+    # MEASURE and QUARTER are key columns, CONTENTS picks the position in the values array
+    variables = [
+        {'code': 'MEASURE', 'values': ['1', '2']},
+        {'code': 'QUARTER', 'values': ['0', '1']},
+        {'code': 'CONTENTS', 'values': ['0', '1'], 'valueTexts': ['Value', 'Change']},
+    ]
+    column_codes = ['MEASURE', 'QUARTER']
+    content_variables = {'0': 0, '1': 1}
+    content_variable_order = ['0', '1']
+    content_variable_mapping = {'0': 'Value', '1': 'Change'}
+
+    def mapping(self, indicator_id, key_indices):
+        return CyStatIndicatorMapping(indicator=Indicator(id=indicator_id, name=f'Indicator {indicator_id}'), key_indices=key_indices)
+
+    def compile(self, mappings):
+        return compile_cystat_mappings(
+            mappings, self.variables, self.column_codes, self.content_variables,
+            self.content_variable_order, 'CONTENTS', self.content_variable_mapping
+        )
+
+    def test_index_by_key_without_period(self):
+        index, fixed_positions, incompatible_code = self.compile([
+            self.mapping(1, {'MEASURE': '1', 'CONTENTS': '1'}),
+            self.mapping(2, {'MEASURE': '1', 'CONTENTS': '0'}),
+            self.mapping(3, {'MEASURE': '2'}),
+        ])
+        self.assertIsNone(incompatible_code)
+        self.assertEqual(fixed_positions, [0])
+        self.assertEqual(index, {('1',): [(1, 1), (2, 0)], ('2',): [(3, 0)]})
+
+    def test_mapping_missing_a_key_column_is_incompatible(self):
+        self.assertEqual(
+            self.compile([self.mapping(1, {'MEASURE': '1'}), self.mapping(2, {'CONTENTS': '0'})]),
+            ({}, [], 'MEASURE')
+        )
+
+
+class LeaseTestsMixin:
+    """
+    Lease semantics shared by the cache and the Redis implementations.
+    """
+
+    def test_second_acquire_reports_the_running_run(self):
+        lease = workflow_leases.acquire(1)
+        lease.attach(42)
+        with self.assertRaises(workflow_leases.WorkflowRunning) as raised:
+            workflow_leases.acquire(1)
+        self.assertEqual(raised.exception.run_id, 42)
+        self.assertEqual(workflow_leases.current_many([1, 2]), {1: {'token': lease.token, 'run_id': 42}})
+        lease.release()
+        self.assertIsNone(workflow_leases.current(1))
+        workflow_leases.acquire(1).release()
+
+    def test_renew_does_not_overwrite_a_lease_taken_by_another_worker(self):
+        lease = workflow_leases.acquire(1)
+        lease._stopped.set()
+        # The lease expired while this worker stalled and another worker took it
+        self.expire(lease.key)
+        other = workflow_leases.acquire(1)
+        self.assertFalse(lease._renew())
+        self.assertEqual(workflow_leases.current(1)['token'], other.token)
+        lease.release()
+        self.assertEqual(workflow_leases.current(1)['token'], other.token)
+        other.release()
+
+    def test_renew_takes_back_an_expired_lease(self):
+        lease = workflow_leases.acquire(1)
+        self.expire(lease.key)
+        self.assertTrue(lease._renew())
+        self.assertEqual(workflow_leases.current(1)['token'], lease.token)
+        lease.release()
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CacheLeaseTests(LeaseTestsMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def expire(self, key):
+        cache.delete(key)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RedisLeaseTests(LeaseTestsMixin, TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(workflow_leases, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expire(self, key):
+        self.redis.delete(key)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ClaimDueWorkflowsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.due = timezone.now() - timedelta(minutes=5)
+        self.idle = Workflow.objects.create(name='Idle', workflow_type='ECB', next_run=self.due)
+        self.running = Workflow.objects.create(name='Running', workflow_type='ECB', next_run=self.due)
+
+    def test_running_workflow_keeps_its_next_run(self):
+        lease = workflow_leases.acquire(self.running.id)
+        try:
+            claimed = tasks.claim_due_workflows(timezone.now())
+        finally:
+            lease.release()
+        self.assertEqual([workflow.id for workflow in claimed], [self.idle.id])
+        self.assertGreater(Workflow.objects.get(id=self.idle.id).next_run, timezone.now())
+        self.assertEqual(Workflow.objects.get(id=self.running.id).next_run, self.due)
+
+    def test_run_started_by_another_trigger_stays_due(self):
+        ECBRequest.objects.create(workflow=self.running, table='EXR', parameters='D.USD.EUR.SP00.A', frequency='D')
+        (claimed,) = tasks.claim_due_workflows(timezone.now())[1:]
+        with mock.patch.object(tasks, 'run_pipeline', return_value={'running_run_id': 7}), \
+                mock.patch.object(tasks, 'connections'):
+            tasks.run_workflow(claimed)
+        self.assertLessEqual(Workflow.objects.get(id=self.running.id).next_run, timezone.now())
+
+
+class InlineExecutor:
+    """
+    Runs the dispatched workflows in the test thread, which sees the test transaction.
+    """
+    def __init__(self, max_workers):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, function, items):
+        return map(function, items)
+
+
+dispatcher_migration = importlib.import_module('koe_db.migrations.0006_workflow_dispatcher')
+
+
+@override_settings(CACHES=LOCAL_CACHES, TIME_ZONE='Europe/Nicosia')
+class WorkflowSchedulingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.workflow = Workflow.objects.create(name='Rates', workflow_type='ECB', schedule_cron='30 6 * * *')
+        ECBRequest.objects.create(workflow=self.workflow, table='EXR', parameters='D.USD.EUR.SP00.A', frequency='D')
+        self.every_day = IntervalSchedule.objects.create(every=1, period=IntervalSchedule.DAYS)
+
+    def assert_next_local_tick(self, next_run):
+        local = timezone.localtime(next_run)
+        self.assertEqual((local.hour, local.minute), (6, 30))
+        self.assertGreater(next_run, timezone.now())
+        self.assertLessEqual(next_run - timezone.now(), timedelta(days=1))
+
+    def test_schedule_sets_next_run_in_local_time_and_drops_the_beat_entry(self):
+        PeriodicTask.objects.create(
+            name=f"execute_ecb_request_{self.workflow.id}", task='koe_db.tasks.execute_ecb_request', interval=self.every_day
+        )
+        workflow_views.schedule_workflow(self.workflow)
+        self.assert_next_local_tick(Workflow.objects.get(id=self.workflow.id).next_run)
+        self.assertFalse(PeriodicTask.objects.exists())
+
+    def test_migration_backfills_next_run_and_drops_legacy_tasks(self):
+        inactive = Workflow.objects.create(name='Paused', workflow_type='ECB', is_active=False)
+        PeriodicTask.objects.create(name='legacy', task='koe_db.tasks.execute_ecb_request', interval=self.every_day)
+        PeriodicTask.objects.create(name='dispatcher', task='koe_db.tasks.dispatch_due_workflows', interval=self.every_day)
+        dispatcher_migration.move_to_dispatcher(apps, None)
+        self.assert_next_local_tick(Workflow.objects.get(id=self.workflow.id).next_run)
+        self.assertIsNone(Workflow.objects.get(id=inactive.id).next_run)
+        self.assertEqual(list(PeriodicTask.objects.values_list('name', flat=True)), ['dispatcher'])
+
+    def test_failing_run_still_advances_next_run(self):
+        other = Workflow.objects.create(name='Other', workflow_type='ECB', schedule_cron='30 6 * * *')
+        ECBRequest.objects.create(workflow=other, table='EXR', parameters='D.GBP.EUR.SP00.A', frequency='D')
+        Workflow.objects.update(next_run=timezone.now() - timedelta(minutes=1))
+        with mock.patch.object(tasks, 'run_pipeline', side_effect=[RuntimeError("upstream exploded"), {}]) as run, \
+                mock.patch.object(tasks, 'ThreadPoolExecutor', InlineExecutor), \
+                mock.patch.object(tasks, 'connections'):
+            self.assertEqual(tasks.dispatch_due_workflows(), 2)
+        self.assertEqual(run.call_count, 2)
+        for workflow in Workflow.objects.all():
+            self.assert_next_local_tick(workflow.next_run)
+
+
+@skipUnless(fakeredis, "fakeredis is not installed")
+class RateLimitTests(TestCase):
+    url = 'https://api.example.org/data'
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch.object(rate_limits, '_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(UPSTREAM_RATE_LIMITS={'api.example.org': {'rate': 1, 'burst': 2}})
+    def test_bucket_grants_its_burst_then_throttles(self):
+        self.assertIsNotNone(rate_limits.acquire(self.url))
+        self.assertIsNotNone(rate_limits.acquire(self.url))
+        with self.assertRaises(rate_limits.Throttled) as raised:
+            rate_limits.acquire(self.url)
+        self.assertEqual(raised.exception.host, 'api.example.org')
+        # About a second until the next token, plus up to a second of jitter
+        self.assertGreater(raised.exception.wait, 0.9)
+        self.assertLess(raised.exception.wait, 2.1)
+
+    @override_settings(UPSTREAM_RATE_LIMITS={'api.example.org': {'concurrency': 1}})
+    def test_released_slot_is_granted_again(self):
+        lease = rate_limits.acquire(self.url)
+        with self.assertRaises(rate_limits.Throttled):
+            rate_limits.acquire(self.url)
+        rate_limits.release(lease)
+        rate_limits.release(rate_limits.acquire(self.url))
+
+    @override_settings(UPSTREAM_RATE_LIMITS={})
+    def test_host_without_limits_is_not_throttled(self):
+        self.assertIsNone(rate_limits.acquire(self.url))
+        self.assertEqual(self.redis.keys(), [])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class RunThrottledTests(TestCase):
+    def test_run_is_failed_after_the_last_retry(self):
+        workflow = Workflow.objects.create(name='Rates', workflow_type='ECB')
+        ecb_request = ECBRequest.objects.create(workflow=workflow, table='EXR', parameters='D.USD.EUR.SP00.A', frequency='D')
+        throttled = rate_limits.Throttled('api.example.org', 5.0)
+        with mock.patch.object(tasks, 'run_pipeline', side_effect=throttled):
+            result = tasks.execute_ecb_request.apply(
+                args=(ecb_request.id,), retries=tasks.execute_ecb_request.max_retries
+            )
+        self.assertTrue(result.successful())
+        run = WorkflowRun.objects.get(workflow=workflow)
+        self.assertEqual(run.status, 'FAILED')
+        self.assertFalse(run.success)
+        self.assertIn('api.example.org stayed throttled', run.error_message)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class AddIndicatorsToTableTests(TestCase):
+    def setUp(self):
+        self.table = CustomTable.objects.create(name='Prices', description='')
+        self.monthly = Indicator.objects.create(name='CPI', frequency=Frequency.MONTHLY)
+        self.table.indicators.add(self.monthly)
+
+    def post(self, indicator_ids):
+        request = RequestFactory().post('/', data=json.dumps(indicator_ids), content_type='application/json')
+        return api_views.add_indicators_to_table(request, self.table.id)
+
+    def test_frequency_mismatch_adds_none_of_the_indicators(self):
+        matching = Indicator.objects.create(name='HICP', frequency=Frequency.MONTHLY)
+        quarterly = Indicator.objects.create(name='GDP', frequency=Frequency.QUARTERLY)
+        response = self.post([matching.id, quarterly.id])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(list(self.table.indicators.all()), [self.monthly])
+
+    def test_matching_indicators_are_added(self):
+        matching = Indicator.objects.create(name='HICP', frequency=Frequency.MONTHLY)
+        response = self.post([self.monthly.id, matching.id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(self.table.indicators.all()), {self.monthly, matching})
+
+
+class ECBFetchTests(TestCase):
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='EUR/USD', frequency=Frequency.MONTHLY)
+        upsert_data([Data(indicator=self.indicator, period='2024-06', value=1)])
+        self.workflow = Workflow.objects.create(name='Rates', workflow_type='ECB')
+        self.ecb_request = ECBRequest.objects.create(
+            workflow=self.workflow, table='EXR', parameters='M.USD.EUR.SP00.A', frequency='M',
+            indicator=self.indicator, etag='"full"', last_full_refresh=timezone.now()
+        )
+
+    def fetch(self, status_code):
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = 'https://data-api.ecb.europa.eu/service/data/EXR/M.USD.EUR.SP00.A'
+        run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+        connector = ECBConnector(ECBRequest.objects.get(id=self.ecb_request.id), run)
+        connector.prepare()
+        with mock.patch.object(http_client, 'download', return_value=(response, None, 'hash')) as download:
+            connector.fetch()
+        return connector, download
+
+    def succeed_earlier_run(self):
+        WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='COMPLETED', success=True)
+
+    def test_windowed_404_after_a_full_fetch_is_unchanged(self):
+        self.succeed_earlier_run()
+        with self.assertRaises(SourceUnchanged):
+            self.fetch(404)
+
+    def test_windowed_404_without_a_successful_run_fails(self):
+        with self.assertRaises(ConnectorError):
+            self.fetch(404)
+
+    def test_windowed_fetch_clears_the_full_history_validators(self):
+        self.succeed_earlier_run()
+        connector, download = self.fetch(200)
+        self.assertIsNotNone(connector.window_start)
+        self.assertEqual(download.call_args.kwargs['headers'], {})
+        self.assertEqual(connector.validators, {'etag': '', 'last_modified': '', 'content_hash': ''})
+
+    def test_full_fetch_sends_its_validators(self):
+        ECBRequest.objects.filter(id=self.ecb_request.id).update(last_full_refresh=None)
+        connector, download = self.fetch(200)
+        self.assertIsNone(connector.window_start)
+        self.assertEqual(download.call_args.kwargs['headers'], {'If-None-Match': '"full"'})
+        self.assertEqual(connector.validators['content_hash'], 'hash')
+
+
+class EurostatFetchTests(TestCase):
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='GDP', frequency=Frequency.ANNUAL)
+        upsert_data([Data(indicator=self.indicator, period='2023', value=1)])
+        self.workflow = Workflow.objects.create(name='GDP', workflow_type='EUROSTAT')
+        self.eurostat_request = EuroStatRequest.objects.create(
+            workflow=self.workflow, url='https://ec.europa.eu/eurostat/api/dissemination/statistics/1.0/data/nama_10_gdp',
+            frequency='Annual', etag='"full"', content_hash='hash', last_full_refresh=timezone.now()
+        )
+        EuroStatIndicatorMapping.objects.create(
+            eurostat_request=self.eurostat_request, indicator=self.indicator, dimension_values={'geo': 'CY'}
+        )
+
+    def fetch(self):
+        response = requests.Response()
+        response.status_code = 200
+        run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+        connector = EurostatConnector(EuroStatRequest.objects.get(id=self.eurostat_request.id), run)
+        connector.prepare()
+        with mock.patch.object(http_client, 'download', return_value=(response, None, 'hash')) as download:
+            connector.fetch()
+        return connector, download
+
+    def test_windowed_fetch_clears_the_full_history_validators(self):
+        # The windowed body hashes like the last full one, which must not make it unchanged
+        connector, download = self.fetch()
+        self.assertEqual(connector.window_start, '2020')
+        self.assertEqual(download.call_args.kwargs['headers'], {})
+        self.assertEqual(connector.validators, {'etag': '', 'last_modified': '', 'content_hash': ''})
+
+    def test_full_fetch_sends_and_compares_its_validators(self):
+        EuroStatRequest.objects.filter(id=self.eurostat_request.id).update(last_full_refresh=None)
+        with mock.patch.object(http_client, 'download') as download:
+            response = requests.Response()
+            response.status_code = 200
+            download.return_value = (response, None, 'hash')
+            run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+            connector = EurostatConnector(EuroStatRequest.objects.get(id=self.eurostat_request.id), run)
+            connector.prepare()
+            with self.assertRaises(SourceUnchanged):
+                connector.fetch()
+        self.assertIsNone(connector.window_start)
+        self.assertEqual(download.call_args.kwargs['headers'], {'If-None-Match': '"full"'})
+
+
+class CyStatFetchTests(TestCase):
+    variables = [
+        {'code': 'MEASURE', 'values': ['1'], 'valueTexts': ['Index']},
+        {'code': 'YEAR', 'values': ['0', '1', '2'], 'valueTexts': ['2020', '2021', '2022']},
+    ]
+
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='Index', frequency=Frequency.ANNUAL)
+        upsert_data([Data(indicator=self.indicator, period='2021', value=1)])
+        self.workflow = Workflow.objects.create(name='Index', workflow_type='CYSTAT')
+        self.cystat_request = CyStatRequest.objects.create(
+            workflow=self.workflow, url='https://cystat.example.org/api/v1/en/index.px',
+            request_body={'query': [], 'response': {'format': 'json'}}, frequency='A', start_period='',
+            etag='"full"', content_hash='', revision_lookback=0, last_full_refresh=timezone.now()
+        )
+        CyStatIndicatorMapping.objects.create(cystat_request=self.cystat_request, indicator=self.indicator, key_indices={'MEASURE': '1'})
+
+    def fetch(self):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"columns": [], "data": []}'
+        run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+        connector = CyStatConnector(CyStatRequest.objects.get(id=self.cystat_request.id), run)
+        connector.prepare()
+        with mock.patch.object(structure_cache, 'get_structure', return_value={'variables': self.variables}), \
+                mock.patch.object(http_client, 'post', return_value=response) as post:
+            connector.fetch()
+        return connector, post
+
+    def test_windowed_query_clears_the_full_query_validators(self):
+        connector, post = self.fetch()
+        self.assertEqual(connector.window_start, '2021')
+        self.assertEqual(post.call_args.kwargs['headers'], {})
+        self.assertEqual(connector.validators, {'etag': '', 'last_modified': '', 'content_hash': ''})
+
+    def test_full_query_sends_its_validators(self):
+        CyStatRequest.objects.filter(id=self.cystat_request.id).update(last_full_refresh=None)
+        connector, post = self.fetch()
+        self.assertIsNone(connector.window_start)
+        self.assertEqual(post.call_args.kwargs['headers'], {'If-None-Match': '"full"'})
+        self.assertEqual(connector.validators['content_hash'], hashlib.sha256(b'{"columns": [], "data": []}').hexdigest())
+
+
+class StaticConnector(Connector):
+    """
+    Serves fixed values for the indicator of an ECBRequest, for pipeline tests.
+    """
+    name = "Static"
+    workflow_type = "ECB"
+    request_model = ECBRequest
+    values = {}
+
+    def fetch(self):
+        return self.values
+
+    def parse(self, payload):
+        return {self.source_request.indicator_id: payload}
+
+
+class MultiIndicatorConnector(StaticConnector):
+    """
+    Serves fixed {indicator id: {period: value}} values, for runs changing several indicators.
+    """
+    def parse(self, payload):
+        return payload
+
+
+@override_settings(CACHES=LOCAL_CACHES, INGESTION_COMMIT_BATCH_SIZE=1, INGESTION_ARCHIVE_ENABLED=False)
+class PropagationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.base_a = Indicator.objects.create(name='Base A', code='A')
+        self.base_b = Indicator.objects.create(name='Base B', code='B')
+        for indicator, value in ((self.base_a, 1), (self.base_b, 10)):
+            upsert_data([Data(indicator=indicator, period=period, value=value) for period in ('2020', '2021', '2022')])
+        self.custom = CustomIndicator.objects.create(
+            indicator=Indicator.objects.create(name='Sum'), formula='@A + @B'
+        )
+        self.custom.base_indicators.set([self.base_a, self.base_b])
+        workflow = Workflow.objects.create(name='Static', workflow_type='ECB')
+        self.ecb_request = ECBRequest.objects.create(
+            workflow=workflow, table='EXR', parameters='M.USD.EUR.SP00.A', frequency='A', indicator=self.base_a
+        )
+        MultiIndicatorConnector.values = {
+            self.base_a.id: {'2020': Decimal('1'), '2021': Decimal('2')},
+            self.base_b.id: {'2021': Decimal('10'), '2022': Decimal('20')},
+        }
+
+    def test_run_queues_one_job_recomputing_each_custom_indicator_once(self):
+        with mock.patch.object(tasks.recompute_custom_indicators, 'delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                pipeline.run_pipeline(MultiIndicatorConnector, self.ecb_request.id)
+        self.assertEqual(delay.call_count, 1)
+        run_id, dependents = delay.call_args.args
+        self.assertEqual(dependents, {self.custom.id: ['2021', '2022']})
+        self.assertEqual(WorkflowRun.objects.get(id=run_id).metrics['custom_indicators_queued'], 1)
+
+        with mock.patch.object(
+            api_views, 'recompute_custom_indicator', wraps=api_views.recompute_custom_indicator
+        ) as recompute:
+            self.assertEqual(tasks.recompute_custom_indicators(run_id, dependents), 1)
+        self.assertEqual(recompute.call_count, 1)
+        self.assertEqual(
+            dict(Data.objects.filter(indicator=self.custom.indicator).values_list('period', 'value')),
+            {'2021': Decimal('12'), '2022': Decimal('21')}
+        )
+        self.assertEqual(WorkflowRun.objects.get(id=run_id).metrics['custom_indicators_recomputed'], 1)
+
+
+@override_settings(CACHES=LOCAL_CACHES, INGESTION_COMMIT_BATCH_SIZE=1, INGESTION_ARCHIVE_ENABLED=False)
+class RunRollbackTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.indicator = Indicator.objects.create(name='Rolled back')
+        upsert_data([
+            Data(indicator=self.indicator, period='2020', value=1),
+            Data(indicator=self.indicator, period='2021', value=2),
+        ])
+        self.workflow = Workflow.objects.create(name='Static', workflow_type='ECB')
+        self.ecb_request = ECBRequest.objects.create(
+            workflow=self.workflow, table='EXR', parameters='M.USD.EUR.SP00.A', frequency='M', indicator=self.indicator
+        )
+        StaticConnector.values = {'2021': Decimal('4'), '2022': Decimal('5'), '2023': Decimal('6')}
+
+    def values(self):
+        return dict(Data.objects.filter(indicator=self.indicator).values_list('period', 'value'))
+
+    def test_failure_after_committed_batches_rolls_them_back(self):
+        calls = []
+
+        def fail_third_batch(*batch):
+            calls.append(batch)
+            if len(calls) == 3:
+                raise RuntimeError("database went away")
+            return apply_indicator_diff(*batch)
+
+        with mock.patch.object(pipeline, 'apply_indicator_diff', side_effect=fail_third_batch):
+            pipeline.run_pipeline(StaticConnector, self.ecb_request.id)
+        run = WorkflowRun.objects.get(workflow=self.workflow)
+        self.assertEqual(run.status, 'FAILED')
+        self.assertIn('database went away', run.error_message)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+        self.assertFalse(DataChange.objects.exists())
+        self.assertFalse(ActionLog.objects.filter(run=run).exists())
+
+    def test_run_left_by_a_stopped_worker_is_rolled_back(self):
+        run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+        # The worker committed its batches and died before finishing the run
+        pipeline.write_batches(
+            run, *diff_indicator_values({self.indicator.id: StaticConnector.values}), {}
+        )
+        self.assertEqual(len(self.values()), 4)
+        self.assertEqual(list(DataChange.objects.filter(created=True).values_list('period', flat=True)), ['2022', '2023'])
+
+        self.assertEqual(pipeline.recover_stale_runs(), 1)
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'FAILED')
+        self.assertEqual(run.error_message, pipeline.STALE_RUN_MESSAGE)
+        self.assertEqual(self.values(), {'2020': Decimal('1'), '2021': Decimal('2')})
+        self.assertEqual(pipeline.recover_stale_runs(), 0)
+
+    def test_run_holding_its_lease_is_left_running(self):
+        run = WorkflowRun.objects.create(workflow=self.workflow, start_time=timezone.now(), status='RUNNING')
+        lease = workflow_leases.acquire(self.workflow.id)
+        lease.attach(run.id)
+        try:
+            self.assertEqual(pipeline.recover_stale_runs(), 0)
+        finally:
+            lease.release()
+        run.refresh_from_db()
+        self.assertEqual(run.status, 'RUNNING')
+
+
+datachange_migration = importlib.import_module('koe_db.migrations.0011_datachange')
+
+
+class DataChangeLogTests(TestCase):
+    def setUp(self):
+        self.user = UserAccount.objects.create(email='logger@example.com')
+        self.first = Indicator.objects.create(name='First')
+        self.second = Indicator.objects.create(name='Second')
+
+    def test_one_header_per_indicator_and_one_row_per_point(self):
+        first_log, second_log = log_data_updates({
+            self.first.id: [
+                {'period': '2020', 'data_id': 7, 'old_value': '1', 'new_value': '2'},
+                {'period': '2021', 'data_id': None, 'old_value': 'None', 'new_value': '3'},
+            ],
+            self.second.id: [{'period': '2020', 'data_id': 8, 'old_value': '4', 'new_value': '5'}],
+        }, user=self.user, created_ids={8})
+        self.assertEqual((first_log.indicator_id, first_log.details, first_log.user), (self.first.id, [], self.user))
+        self.assertEqual(DataChange.objects.filter(action_log=first_log).count(), 2)
+        self.assertEqual(list(DataChange.objects.filter(created=True).values_list('data_id', flat=True)), [8])
+        self.assertTrue(all(row.timestamp == first_log.timestamp for row in DataChange.objects.filter(action_log=first_log)))
+
+        self.assertEqual(details_by_log([first_log.id, second_log.id, 999999]), {
+            first_log.id: [
+                {'period': '2020', 'data_id': 7, 'old_value': '1', 'new_value': '2'},
+                {'period': '2021', 'old_value': 'None', 'new_value': '3'},
+            ],
+            second_log.id: [{'period': '2020', 'data_id': 8, 'old_value': '4', 'new_value': '5'}],
+            999999: [],
+        })
+        self.assertEqual(details_by_log([]), {})
+
+
+class DataChangeMigrationTests(TestCase):
+    def setUp(self):
+        self.indicator = Indicator.objects.create(name='Legacy')
+
+    def test_backfill_and_reverse_with_mixed_legacy_details(self):
+        log = ActionLog.objects.create(indicator=self.indicator, action_type='DATA_UPDATE', details=[
+            {'period': '2020', 'data_id': '123', 'old_value': '1', 'new_value': '2'},
+            {'period': '2021', 'data_id': None, 'old_value': 'None', 'new_value': '3'},
+            {'period': '2022', 'data_id': 'abc', 'old_value': '3', 'new_value': '4'},
+            {'period': '2023', 'data_id': 999999, 'old_value': 4, 'new_value': None},
+            {'period': '2024', 'data_id': '9' * 30, 'old_value': '5', 'new_value': '6'},
+            {'period': '2025', 'old_value': '6', 'new_value': '7'},
+            'not a change',
+        ])
+        edit = ActionLog.objects.create(indicator=self.indicator, action_type='INDICATOR_EDIT', details={'name': 'Legacy'})
+
+        datachange_migration.move_changes_to_table(apps, None)
+        self.assertEqual(
+            list(DataChange.objects.order_by('id').values_list('period', 'data_id', 'old_value', 'new_value')),
+            [
+                ('2020', 123, '1', '2'),
+                ('2021', None, 'None', '3'),
+                ('2022', None, '3', '4'),
+                ('2023', 999999, '4', None),
+                ('2024', None, '5', '6'),
+                ('2025', None, '6', '7'),
+            ]
+        )
+        log.refresh_from_db()
+        edit.refresh_from_db()
+        self.assertEqual((log.details, edit.details), ([], {'name': 'Legacy'}))
+
+        datachange_migration.move_changes_to_details(apps, None)
+        log.refresh_from_db()
+        self.assertEqual(log.details, [
+            {'period': '2020', 'data_id': 123, 'old_value': '1', 'new_value': '2'},
+            {'period': '2021', 'old_value': 'None', 'new_value': '3'},
+            {'period': '2022', 'old_value': '3', 'new_value': '4'},
+            {'period': '2023', 'data_id': 999999, 'old_value': '4', 'new_value': None},
+            {'period': '2024', 'old_value': '5', 'new_value': '6'},
+            {'period': '2025', 'old_value': '6', 'new_value': '7'},
+        ])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ActivityResponseTests(TestCase):
+    """
+    The history and activity views read point changes from DataChange; their responses must
+    match what the same logs produced when the changes were kept in ActionLog.details.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserAccount.objects.create(email='editor@example.com', is_superuser=True, is_staff=True)
+        self.indicator = Indicator.objects.create(name='History', code='HIST')
+        upsert_data([
+            Data(indicator=self.indicator, period='2020', value=Decimal('1.5')),
+            Data(indicator=self.indicator, period='2021', value=3),
+        ])
+        self.data_id = Data.objects.get(indicator=self.indicator, period='2020').id
+        self.workflow = Workflow.objects.create(name='History', workflow_type='ECB')
+        self.run = WorkflowRun.objects.create(
+            workflow=self.workflow, start_time=datetime(2024, 1, 2, tzinfo=dt_timezone.utc), status='COMPLETED', success=True
+        )
+        self.times = [datetime(2024, 1, day, tzinfo=dt_timezone.utc) for day in (1, 2, 3)]
+        # Legacy logs, as written before DataChange existed
+        self.first_changes = [{'period': '2020', 'data_id': self.data_id, 'old_value': 'None', 'new_value': '1'}]
+        self.second_changes = [
+            {'period': '2020', 'data_id': self.data_id, 'old_value': '1', 'new_value': '1.5'},
+            {'period': '2021', 'old_value': '2', 'new_value': '3'},
+        ]
+        self.logs = [
+            self.log('DATA_UPDATE', self.first_changes, self.times[0]),
+            self.log('DATA_UPDATE', self.second_changes, self.times[1], run=self.run),
+            self.log('INDICATOR_EDIT', {'name': 'History'}, self.times[2]),
+        ]
+        datachange_migration.move_changes_to_table(apps, None)
+
+        patcher = mock.patch.object(api_views, 'get_user', return_value=self.user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def log(self, action_type, details, timestamp, run=None):
+        log = ActionLog.objects.create(
+            user=self.user, indicator=self.indicator, action_type=action_type, details=details, run=run
+        )
+        ActionLog.objects.filter(id=log.id).update(timestamp=timestamp)
+        return log
+
+    def get(self, view, *args):
+        return json.loads(view(RequestFactory().get('/'), *args).content)
+
+    def legacy(self, response):
+        return json.loads(json.dumps(response, cls=DjangoJSONEncoder))
+
+    def test_indicator_history(self):
+        self.assertEqual(self.get(api_views.indicator_history, self.indicator.id), self.legacy([
+            {'timestamp': self.times[2], 'details': [
+                {'action_type': 'INDICATOR_EDIT', 'details': {'name': 'History'}, 'user_email': self.user.email}
+            ]},
+            {'action_type': 'DATA_UPDATE', 'history': {
+                str(self.times[1]): [
+                    {'period': '2020', 'value': '1 -> 1.5', 'user': self.user.email},
+                    {'period': '2021', 'value': '2 -> 3', 'user': self.user.email},
+                ],
+                str(self.times[0]): [
+                    {'period': '2020', 'value': 'None -> 1', 'user': self.user.email},
+                    {'period': '2021', 'value': '2'},
+                ],
+            }},
+        ]))
+
+    def test_user_activity(self):
+        response = self.get(api_views.user_activity, self.user.id)
+        self.assertEqual(response['activity'], self.legacy([{
+            'indicator_id': self.indicator.id,
+            'indicator_name': 'History',
+            'indicator_code': 'HIST',
+            'actions': [
+                {'action_type': 'INDICATOR_EDIT', 'timestamp': '2024-01-03 00:00:00', 'details': {'name': 'History'}},
+                {'action_type': 'DATA_UPDATE', 'timestamp': '2024-01-02 00:00:00', 'details': self.second_changes, 'points_changed': 2},
+                {'action_type': 'DATA_UPDATE', 'timestamp': '2024-01-01 00:00:00', 'details': self.first_changes, 'points_changed': 1},
+            ],
+        }]))
+
+    def test_workflow_run_history(self):
+        (run,) = self.get(workflow_views.workflow_run_history, self.workflow.id)
+        self.assertEqual(run['action_logs'], [{
+            'id': self.logs[1].id,
+            'indicator_id': self.indicator.id,
+            'indicator_code': 'HIST',
+            'indicator_name': 'History',
+            'action_type': 'DATA_UPDATE',
+            'timestamp': self.times[1].isoformat(),
+            'details': self.second_changes,
+        }])
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class TableCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserAccount.objects.create(email='reader@example.com', is_superuser=True, is_staff=True)
+        # Two members share a name, so only their ids tell the columns apart
+        self.first = Indicator.objects.create(name='GDP', frequency=Frequency.ANNUAL)
+        self.second = Indicator.objects.create(name='GDP', frequency=Frequency.ANNUAL)
+        upsert_data([
+            Data(indicator=self.first, period='2020', value=1),
+            Data(indicator=self.first, period='2021', value=2),
+            Data(indicator=self.second, period='2021', value=Decimal('1.5')),
+        ])
+        self.table = CustomTable.objects.create(name='Output', description='')
+        self.table.indicators.add(self.first, self.second)
+        patcher = mock.patch.object(api_views, 'get_user', return_value=self.user)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def member_ids(self):
+        return sorted(self.table.indicators.values_list('id', flat=True))
+
+    def test_columns_are_keyed_by_indicator_id(self):
+        response = json.loads(api_views.tables(RequestFactory().get('/'), self.table.id).content)
+        first, second = str(self.first.id), str(self.second.id)
+        self.assertEqual(set(response['indicators']), {first, second})
+        self.assertEqual(response['data'], [
+            {'period': '2020', first: '1.00000', second: None},
+            {'period': '2021', first: '2.00000', second: '1.50000'},
+        ])
+
+    def test_write_to_one_member_reloads_only_its_column(self):
+        table_cache.get_matrix(self.table.id, self.member_ids())
+        key = table_cache._matrix_key(self.table.id, self.member_ids())
+        with self.captureOnCommitCallbacks(execute=True):
+            upsert_data([Data(indicator=self.second, period='2022', value=3)])
+        self.assertNotEqual(table_cache._matrix_key(self.table.id, self.member_ids()), key)
+
+        with mock.patch.object(series_cache, '_load', wraps=series_cache._load) as load:
+            matrix = table_cache.get_matrix(self.table.id, self.member_ids())
+        load.assert_called_once_with([self.second.id])
+        self.assertEqual(matrix.periods, ['2020', '2021', '2022'])
+        self.assertEqual(list(matrix.rows())[2], {'period': '2022', str(self.first.id): None, str(self.second.id): '3.00000'})
+
+        # The rebuilt matrix is then served without touching the database
+        member_ids = self.member_ids()
+        with mock.patch.object(series_cache, '_load') as load, self.assertNumQueries(0):
+            table_cache.get_matrix(self.table.id, member_ids)
+        load.assert_not_called()
+
+    def assert_prebuilt(self, indicator_ids):
+        self.assertIsNotNone(cache.get(table_cache._matrix_key(self.table.id, indicator_ids)))
+
+    def test_membership_changes_rebuild_the_matrix(self):
+        third = Indicator.objects.create(name='CPI', frequency=Frequency.ANNUAL)
+        request = RequestFactory().post('/', data=json.dumps([third.id]), content_type='application/json')
+        api_views.add_indicators_to_table(request, self.table.id)
+        self.assertEqual(self.member_ids(), sorted([self.first.id, self.second.id, third.id]))
+        self.assert_prebuilt(self.member_ids())
+
+        api_views.delete_table_indicator(RequestFactory().delete('/'), self.table.id, self.first.id)
+        self.assertEqual(self.member_ids(), sorted([self.second.id, third.id]))
+        self.assert_prebuilt(self.member_ids())
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class SeriesCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserAccount.objects.create(email='editor@example.com', is_superuser=True, is_staff=True)
+        self.indicator = Indicator.objects.create(name='Cached')
+        self.other = Indicator.objects.create(name='Other')
+        upsert_data([
+            Data(indicator=self.indicator, period='2021', value=Decimal('1.5'), isEstimate=True),
+            Data(indicator=self.indicator, period='2020', value=None),
+            Data(indicator=self.indicator, period='unknown', value=2),
+            Data(indicator=self.other, period='2020', value=7),
+        ])
+
+    def version(self):
+        return series_cache.versions([self.indicator.id])[self.indicator.id]
+
+    def points(self, indicator=None):
+        return [
+            (point['period'], point['value'], point['isEstimate'])
+            for point in series_cache.get_series((indicator or self.indicator).id).points()
+        ]
+
+    def test_pack_round_trip(self):
+        series = series_cache._load([self.indicator.id])[self.indicator.id]
+        unpacked = series_cache.Series.unpack(series.pack())
+        self.assertEqual(unpacked.periods, ['2020', '2021', 'unknown'])
+        self.assertEqual(unpacked.formatted_values(), [None, '1.50000', '2.00000'])
+        self.assertEqual(unpacked.estimates.tolist(), [False, True, False])
+        self.assertEqual(unpacked.ids.tolist(), series.ids.tolist())
+        self.assertEqual([str(start) for start in unpacked.starts], ['2020-01-01', '2021-01-01', 'NaT'])
+        empty = series_cache.Series.unpack(series_cache.Series.from_rows([]).pack())
+        self.assertEqual((empty.periods, len(empty)), ([], 0))
+
+    def test_get_many_loads_only_misses(self):
+        series_cache.get_series(self.indicator.id)
+        with mock.patch.object(series_cache, '_load', wraps=series_cache._load) as load:
+            series = series_cache.get_many([self.indicator.id, self.other.id, self.indicator.id])
+        load.assert_called_once_with([self.other.id])
+        self.assertEqual(set(series), {self.indicator.id, self.other.id})
+        self.assertEqual(series[self.other.id].formatted_values(), ['7.00000'])
+
+    def assert_invalidated_by(self, write):
+        self.points()
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            write()
+        self.assertNotEqual(self.version(), version)
+
+    def test_upsert_data_invalidates(self):
+        self.assert_invalidated_by(lambda: upsert_data([Data(indicator=self.indicator, period='2022', value=3)]))
+        self.assertIn(('2022', '3.00000', False), self.points())
+
+    def test_data_save_invalidates(self):
+        point = Data.objects.get(indicator=self.indicator, period='2021')
+        point.value = 4
+        self.assert_invalidated_by(point.save)
+        self.assertIn(('2021', '4.00000', True), self.points())
+
+    def test_point_moved_in_data_view_invalidates(self):
+        point = Data.objects.get(indicator=self.indicator, period='2021')
+        request = RequestFactory().post(
+            '/', data=json.dumps([{'id': point.id, 'period': '2023', 'value': 1.5}]), content_type='application/json'
+        )
+        with mock.patch.object(api_views, 'get_user', return_value=self.user):
+            self.assert_invalidated_by(lambda: api_views.data(request, self.indicator.id))
+        self.assertEqual([period for period, _, _ in self.points()], ['2020', '2023', 'unknown'])
+
+    def test_revert_invalidates(self):
+        diff = diff_indicator_values({self.indicator.id: {'2022': Decimal('5')}})
+        apply_indicator_diff(*diff)
+        self.assert_invalidated_by(lambda: revert_indicator_changes(diff[2]))
+        self.assertNotIn('2022', [period for period, _, _ in self.points()])
+
+    def test_rebuild_racing_a_write_is_not_served_after_it(self):
+        load = series_cache._load
+
+        def load_then_write(indicator_ids):
+            # A write commits after this reader loaded the rows but before it stores them
+            loaded = load(indicator_ids)
+            with self.captureOnCommitCallbacks(execute=True):
+                upsert_data([Data(indicator=self.indicator, period='2021', value=9)])
+            return loaded
+
+        with mock.patch.object(series_cache, '_load', side_effect=load_then_write):
+            stale = self.points()
+        self.assertIn(('2021', '1.50000', True), stale)
+        # The stale copy went under the replaced version, so the next read rebuilds
+        self.assertIn(('2021', '9.00000', True), self.points())
+
+
+class UnchangedConnector(StaticConnector):
+    def fetch(self):
+        raise SourceUnchanged()
+
+
+@override_settings(CACHES=LOCAL_CACHES, INGESTION_ARCHIVE_ENABLED=False)
+class FullRefreshTests(TestCase):
+    def test_unchanged_full_fetch_counts_as_full_refresh(self):
+        cache.clear()
+        workflow = Workflow.objects.create(name='Static', workflow_type='ECB')
+        ecb_request = ECBRequest.objects.create(
+            workflow=workflow, table='EXR', parameters='M.USD.EUR.SP00.A', frequency='M',
+            indicator=Indicator.objects.create(name='Unchanged')
+        )
+        pipeline.run_pipeline(UnchangedConnector, ecb_request.id)
+        ecb_request.refresh_from_db()
+        self.assertIsNotNone(ecb_request.last_full_refresh)
+        self.assertEqual(WorkflowRun.objects.get(workflow=workflow).status_message, 'No upstream change')
@@ -0,0 +1,130 @@
+import hashlib
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from django.db.models import Max
+from django.utils import timezone
+
+from koe_db.models import Data, WorkflowRun
+from koe_db.periods_utils import shift_period
+
+NO_UPSTREAM_CHANGE = "No upstream change"
+
+
+def conditional_headers(source_request):
+    """
+    Returns the If-None-Match / If-Modified-Since headers for the validators stored on a request model.
+    """
+    headers = {}
+    if source_request.etag:
+        headers['If-None-Match'] = source_request.etag
+    if source_request.last_modified:
+        headers['If-Modified-Since'] = source_request.last_modified
+    return headers
+
+
+def response_validators(response, content_hash=None):
+    """
+    Extracts the validators of an upstream response: ETag, Last-Modified and a SHA-256 of the body.
+    Streamed downloads pass the hash they computed while reading the body.
+    """
+    if content_hash is None:
+        content_hash = hashlib.sha256(response.content or b'').hexdigest()
+    return {
+        'etag': response.headers.get('ETag', ''),
+        'last_modified': response.headers.get('Last-Modified', ''),
+        'content_hash': content_hash,
+    }
+
+
+def cleared_validators():
+    """
+    Validators stored after a windowed fetch: its response only covers the window, so the
+    validators of the full history are cleared rather than compared with it or replaced by it.
+    """
+    return {'etag': '', 'last_modified': '', 'content_hash': ''}
+
+
+def combined_validators(responses):
+    """
+    Validators of a source fetched with several requests: a SHA-256 over all the bodies in order.
+    ETag and Last-Modified belong to a single request, so they are left empty.
+    """
+    digest = hashlib.sha256()
+    for response in responses:
+        digest.update(response.content or b'')
+    return {'etag': '', 'last_modified': '', 'content_hash': digest.hexdigest()}
+
+
+def is_unchanged(source_request, response, validators):
+    """
+    True when the upstream answered 304 Not Modified or returned the body that was ingested last time.
+    """
+    if response.status_code == 304:
+        return True
+    return bool(source_request.content_hash) and source_request.content_hash == validators['content_hash']
+
+
+def store_validators(source_request, validators):
+    """
+    Saves the validators after a successful ingestion, without touching the other request fields.
+    """
+    type(source_request).objects.filter(pk=source_request.pk).update(**validators)
+
+
+def fetch_window_start(source_request, indicator_ids):
+    """
+    Returns the first period an incremental fetch should request, or None when the full history
+    is needed: incremental fetching is disabled, a full refresh is due, or an indicator has no data yet.
+    """
+    indicator_ids = set(indicator_ids)
+    if not source_request.full_refresh_days or not indicator_ids:
+        return None
+    last_full_refresh = source_request.last_full_refresh
+    if last_full_refresh is None or last_full_refresh < timezone.now() - timedelta(days=source_request.full_refresh_days):
+        return None
+
+    newest_starts = dict(
+        Data.objects.filter(indicator_id__in=indicator_ids, period__isnull=False)
+        .values('indicator_id')
+        .annotate(newest=Max('period_start'))
+        .values_list('indicator_id', 'newest')
+    )
+    if len(newest_starts) < len(indicator_ids) or None in newest_starts.values():
+        return None
+
+    # Start from the indicator that is furthest behind, then step back for revisions
+    indicator_id, newest = min(newest_starts.items(), key=lambda item: item[1])
+    period = (
+        Data.objects.filter(indicator_id=indicator_id, period_start=newest)
+        .values_list('period', flat=True)
+        .first()
+    )
+    return shift_period(period, -source_request.revision_lookback)
+
+
+def mark_full_refresh(source_request):
+    """
+    Records that the full history was fetched and ingested successfully.
+    """
+    type(source_request).objects.filter(pk=source_request.pk).update(last_full_refresh=timezone.now())
+
+
+def last_successful_start(workflow):
+    """
+    Start time of the latest successful run of a workflow, used as an 'updated after' bound.
+    """
+    return WorkflowRun.objects.filter(
+        workflow=workflow, success=True
+    ).order_by('-start_time').values_list('start_time', flat=True).first()
+
+
+def with_query_params(url, params):
+    """
+    Adds query parameters to a URL, keeping any value the URL already sets.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    present = {key for key, _ in query}
+    query.extend((key, value) for key, value in params.items() if key not in present)
+    return urlunsplit(parts._replace(query=urlencode(query)))
@@ -74,6 +74,7 @@ urlpatterns = [
     path('api/workflows/<int:id>/', workflow_views.workflow_detail, name='workflow_detail'),
     path('api/workflows/<int:id>/run/', workflow_views.workflow_run, name='workflow_run'),
     path('api/workflows/<int:workflow_id>/run_history/', workflow_views.workflow_run_history, name='workflow_run_history'),
+    path('api/workflows/<int:workflow_id>/run_trends/', workflow_views.workflow_run_trends, name='workflow_run_trends'),
     path('api/workflows/<int:id>/toggle/', workflow_views.workflow_toggle, name='workflow_toggle'),
     path('api/workflows/<int:id>/history/', workflow_views.workflow_history, name='workflow_history'),
     path('api/workflows/indicator/<str:indicator_id>/', workflow_views.workflows_by_indicator, name='workflows_by_indicator'),
@@ -86,6 +87,7 @@ urlpatterns = [
     # ECB workflow endpoints
     path('api/ecb-workflow-config/', workflow_views.ecb_workflow_config, name='ecb_workflow_config'),
     path('api/fetch-ecb-structure/', workflow_views.fetch_ecb_structure, name='fetch_ecb_structure'),
+    path('api/ecb-indicator-mapping/', workflow_views.ecb_indicator_mapping, name='ecb_indicator_mapping'),
     # path('api/ecb-workflow-details/<int:id>/', workflow_views.ecb_workflow_details, name='ecb_workflow_details'),
 
     # Eurostat workflow endpoints
@@ -0,0 +1,165 @@
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+# Extends the lease in KEYS[1] if it still holds the token in ARGV[1], or takes it back when it
+# expired and nobody else took it. ARGV: token, new value, TTL in milliseconds. Returns 1 when held.
+_RENEW_SCRIPT = """
+local held = redis.call('GET', KEYS[1])
+if held and cjson.decode(held)['token'] ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+# Deletes the lease in KEYS[1] only if it still holds the token in ARGV[1]
+_RELEASE_SCRIPT = """
+local held = redis.call('GET', KEYS[1])
+if held and cjson.decode(held)['token'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Serialises the check-then-write steps when the cache is not Redis; such caches are not
+# shared between processes, so a lock of this process is enough to make them atomic
+_local_lock = threading.Lock()
+
+
+class WorkflowRunning(Exception):
+    """
+    Raised by acquire() when another worker holds the workflow's lease; run_id is its
+    WorkflowRun, or None if that run has not been created yet.
+    """
+
+    def __init__(self, workflow_id, run_id):
+        super().__init__(f"Workflow {workflow_id} is already running (run {run_id})")
+        self.workflow_id = workflow_id
+        self.run_id = run_id
+
+
+def _redis():
+    try:
+        from django_redis import get_redis_connection
+        return get_redis_connection('default')
+    except (ImportError, NotImplementedError):
+        # Leases live in the configured cache when it is not Redis
+        return None
+
+
+def lease_key(workflow_id):
+    return f"workflow:lease:{workflow_id}"
+
+
+def current_many(workflow_ids):
+    """
+    Returns {workflow_id: {'token', 'run_id'}} of the leases held on the given workflows;
+    workflows that are not running are left out.
+    """
+    keys = {lease_key(workflow_id): workflow_id for workflow_id in workflow_ids}
+    if not keys:
+        return {}
+    client = _redis()
+    if client is None:
+        return {keys[key]: held for key, held in cache.get_many(list(keys)).items()}
+    return {
+        workflow_id: json.loads(held)
+        for workflow_id, held in zip(keys.values(), client.mget(list(keys)))
+        if held is not None
+    }
+
+
+def current(workflow_id):
+    """
+    Returns {'token', 'run_id'} of the lease held on a workflow, or None when it is not running.
+    """
+    return current_many([workflow_id]).get(workflow_id)
+
+
+class Lease:
+    """
+    Single-flight lease on a workflow, kept alive by a heartbeat thread every third of
+    WORKFLOW_LEASE_TTL. If the worker dies the lease expires and the workflow can run again.
+
+    With Redis the lease is a plain JSON string written by compare-and-set scripts, so a
+    renewal never overwrites a lease another worker took after this one expired.
+    """
+
+    def __init__(self, workflow_id):
+        self.workflow_id = workflow_id
+        self.key = lease_key(workflow_id)
+        self.token = uuid.uuid4().hex
+        self.run_id = None
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    def _value(self):
+        return {'token': self.token, 'run_id': self.run_id}
+
+    def _take(self):
+        client = _redis()
+        if client is None:
+            return cache.add(self.key, self._value(), timeout=settings.WORKFLOW_LEASE_TTL)
+        return bool(client.set(self.key, json.dumps(self._value()), px=settings.WORKFLOW_LEASE_TTL * 1000, nx=True))
+
+    def _renew(self):
+        client = _redis()
+        if client is not None:
+            held = client.eval(
+                _RENEW_SCRIPT, 1, self.key, self.token, json.dumps(self._value()), settings.WORKFLOW_LEASE_TTL * 1000
+            )
+        else:
+            with _local_lock:
+                value = cache.get(self.key)
+                held = value is None or value.get('token') == self.token
+                if held:
+                    # Also takes the lease back if it expired while this worker was stalled
+                    cache.set(self.key, self._value(), timeout=settings.WORKFLOW_LEASE_TTL)
+        if not int(held):
+            print(f"Lost the lease on workflow {self.workflow_id}")
+        return bool(int(held))
+
+    def _beat(self):
+        while not self._stopped.wait(settings.WORKFLOW_LEASE_TTL / 3):
+            try:
+                self._renew()
+            except Exception as e:
+                print(f"Failed to renew the lease on workflow {self.workflow_id}: {str(e)}")
+
+    def attach(self, run_id):
+        """
+        Records the WorkflowRun of this lease, so duplicate triggers can report it.
+        """
+        self.run_id = run_id
+        self._renew()
+
+    def release(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+        client = _redis()
+        if client is not None:
+            client.eval(_RELEASE_SCRIPT, 1, self.key, self.token)
+            return
+        with _local_lock:
+            held = cache.get(self.key)
+            if held is not None and held.get('token') == self.token:
+                cache.delete(self.key)
+
+
+def acquire(workflow_id):
+    """
+    Takes the single-flight lease of a workflow, shared by all workers through Redis.
+    Raises WorkflowRunning when the workflow is already running. Call release() when done.
+    """
+    lease = Lease(workflow_id)
+    if not lease._take():
+        held = current(workflow_id) or {}
+        raise WorkflowRunning(workflow_id, held.get('run_id'))
+    lease._heartbeat = threading.Thread(target=lease._beat, daemon=True)
+    lease._heartbeat.start()
+    return lease
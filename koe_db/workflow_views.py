@@ -7,16 +7,21 @@ from .authentication import CustomJWTAuthentication
 from .api_views import get_user
 from .permissions import check_indicator_permission
 
-from django_celery_beat.models import PeriodicTask, CrontabSchedule
-from koe_db.models import Workflow, CyStatRequest, CyStatIndicatorMapping, Indicator, ECBRequest, WorkflowRun, ActionLog, EuroStatRequest, EuroStatIndicatorMapping
+from django_celery_beat.models import PeriodicTask
+from koe_db.models import Workflow, CyStatRequest, CyStatIndicatorMapping, Indicator, ECBRequest, ECBIndicatorMapping, WorkflowRun, ActionLog, EuroStatRequest, EuroStatIndicatorMapping
 from koe_db.authentication import CustomJWTAuthentication
-import requests
+from koe_db import series_cache, structure_cache, workflow_leases
 from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
 from datetime import datetime, timedelta
+import math
 import re
 from croniter import croniter
 from koe_db.tasks import execute_cystat_request, execute_ecb_request, execute_eurostat_request
+from koe_db.jsonstat import jsonstat_metadata
+from koe_db.sdmx import ecb_data_url, ecb_series
+from koe_db.data_changes import action_details, details_by_log
 
 def get_user(request):
     auth = CustomJWTAuthentication()
@@ -32,115 +37,40 @@ def calculate_next_run(cron_expression):
     """
     Calculate the next run time from now based on a standard 5-part cron expression.
     """
-    now = timezone.now()
+    # Cron expressions are read in the local time zone, as Celery Beat did
+    now = timezone.localtime()
     if not croniter.is_valid(cron_expression):
         raise ValueError("Invalid or unsupported cron expression")
     return croniter(cron_expression, now).get_next(datetime)
 
 def schedule_workflow(workflow):
     """
-    Create or update the Celery Beat schedule for a workflow.
+    Schedule a workflow: dispatch_due_workflows starts it once its next_run is due.
     """
+    source_requests = {
+        "CYSTAT": CyStatRequest,
+        "ECB": ECBRequest,
+        "EUROSTAT": EuroStatRequest,
+    }
+    request_model = source_requests.get(workflow.workflow_type)
+    if request_model is None or not request_model.objects.filter(workflow=workflow).exists():
+        print(f"No {workflow.workflow_type} request found for workflow: {workflow.name}")
+        return
 
-    if workflow.workflow_type == "CYSTAT":
-        cystat_request = CyStatRequest.objects.filter(workflow=workflow).first()
-        if not cystat_request:
-            print(f"No CyStat request found for workflow: {workflow.name}")
-            return
-
-        try:
-            # Use the cron expression from the workflow
-            cron_parts = workflow.schedule_cron.split()
-            crontab, _ = CrontabSchedule.objects.get_or_create(
-                minute=cron_parts[0],
-                hour=cron_parts[1],
-                day_of_month=cron_parts[2],
-                month_of_year=cron_parts[3],
-                day_of_week=cron_parts[4],
-            )
-
-            # Create or update the periodic task
-            task_name = f"execute_cystat_request_{workflow.id}"
-            PeriodicTask.objects.update_or_create(
-                name=task_name,
-                defaults={
-                    "task": "koe_db.tasks.execute_cystat_request",
-                    "crontab": crontab,
-                    "args": json.dumps([cystat_request.id]),
-                    "enabled": workflow.is_active,
-                },
-            )
-            print(f"Scheduled workflow: {workflow.name} with cron: {workflow.schedule_cron}")
-        except Exception as e:
-            print(f"Failed to schedule workflow {workflow.name}: {e}")
-
-    elif workflow.workflow_type == "ECB":
-        ecb_request = ECBRequest.objects.filter(workflow=workflow).first()
-        if not ecb_request:
-            print(f"No ECB request found for workflow: {workflow.name}")
-            return
-
-        try:
-            # Use the cron expression from the workflow
-            cron_parts = workflow.schedule_cron.split()
-            crontab, _ = CrontabSchedule.objects.get_or_create(
-                minute=cron_parts[0],
-                hour=cron_parts[1],
-                day_of_month=cron_parts[2],
-                month_of_year=cron_parts[3],
-                day_of_week=cron_parts[4],
-            )
-
-            # Create or update the periodic task
-            task_name = f"execute_ecb_request_{workflow.id}"
-            PeriodicTask.objects.update_or_create(
-                name=task_name,
-                defaults={
-                    "task": "koe_db.tasks.execute_ecb_request",
-                    "crontab": crontab,
-                    "args": json.dumps([ecb_request.id]),
-                    "enabled": workflow.is_active,
-                },
-            )
-            print(f"Scheduled workflow: {workflow.name} with cron: {workflow.schedule_cron}")
-        except Exception as e:
-            print(f"Failed to schedule workflow {workflow.name}: {e}")
-
-    elif workflow.workflow_type == "EUROSTAT":
-        eurostat_request = EuroStatRequest.objects.filter(workflow=workflow).first()
-        if not eurostat_request:
-            print(f"No Eurostat request found for workflow: {workflow.name}")
-            return
-
-        try:
-            # Use the cron expression from the workflow
-            cron_parts = workflow.schedule_cron.split()
-            crontab, _ = CrontabSchedule.objects.get_or_create(
-                minute=cron_parts[0],
-                hour=cron_parts[1],
-                day_of_month=cron_parts[2],
-                month_of_year=cron_parts[3],
-                day_of_week=cron_parts[4],
-            )
+    try:
+        if workflow.next_run is None or workflow.next_run <= timezone.now():
+            workflow.next_run = calculate_next_run(workflow.schedule_cron)
+            Workflow.objects.filter(pk=workflow.pk).update(next_run=workflow.next_run)
 
-            # Create or update the periodic task
-            task_name = f"execute_eurostat_request_{workflow.id}"
-            PeriodicTask.objects.update_or_create(
-                name=task_name,
-                defaults={
-                    "task": "koe_db.tasks.execute_eurostat_request",
-                    "crontab": crontab,
-                    "args": json.dumps([eurostat_request.id]),
-                    "enabled": workflow.is_active,
-                },
-            )
-            print(f"Scheduled workflow: {workflow.name} with cron: {workflow.schedule_cron}")
-        except Exception as e:
-            print(f"Failed to schedule workflow {workflow.name}: {e}")
+        # Workflows used to have their own beat entry; the dispatcher replaces it
+        delete_workflow_schedule(workflow)
+        print(f"Scheduled workflow: {workflow.name} with cron: {workflow.schedule_cron}")
+    except Exception as e:
+        print(f"Failed to schedule workflow {workflow.name}: {e}")
 
 def delete_workflow_schedule(workflow):
     """
-    Delete the Celery Beat schedule for a workflow.
+    Delete the legacy Celery Beat schedule of a workflow, if it still has one.
     """
     try:
         task_name = f"execute_cystat_request_{workflow.id}" if workflow.workflow_type == "CYSTAT" else f"execute_ecb_request_{workflow.id}" if workflow.workflow_type == "ECB" else f"execute_eurostat_request_{workflow.id}"
@@ -149,11 +79,23 @@ def delete_workflow_schedule(workflow):
     except Exception as e:
         print(f"Failed to delete schedule for workflow {workflow.name}: {e}")
 
+def running_workflow_runs(workflows):
+    """
+    Yields (workflow, id of its WorkflowRun in progress) for the workflows holding a run lease.
+    """
+    leases = workflow_leases.current_many([workflow.id for workflow in workflows])
+    for workflow in workflows:
+        lease = leases.get(workflow.id)
+        if lease is not None:
+            yield workflow, lease.get('run_id')
+
+
 def workflows(request):
     """List all workflows or create a new one"""
     if request.method == 'GET':
         try:
             workflows = Workflow.objects.all()
+            running_runs = {workflow.id: run_id for workflow, run_id in running_workflow_runs(workflows)}
             workflow_list = []
             for workflow in workflows:
                 # Get the latest run for each workflow
@@ -171,6 +113,7 @@ def workflows(request):
                     'next_run': workflow.next_run.isoformat() if workflow.next_run else None,
                     'last_run': workflow.last_run.isoformat() if workflow.last_run else None,
                     'last_run_success': last_run.success if last_run else None,
+                    'running_run_id': running_runs.get(workflow.id),
                 })
             return JsonResponse(workflow_list, safe=False)
         except Exception as e:
@@ -220,7 +163,9 @@ def workflows_by_indicator(request, indicator_id):
             cystat_workflows = Workflow.objects.filter(cystat_request__in=cystat_request_ids)
 
             # Check ECB workflows
-            ecb_workflows = Workflow.objects.filter(ecb_request__indicator_id=indicator_id)
+            ecb_workflows = Workflow.objects.filter(
+                Q(ecb_request__indicator_id=indicator_id) | Q(ecb_request__indicator_mappings__indicator_id=indicator_id)
+            ).distinct()
 
             # Check Eurostat workflows
             eurostat_mappings = EuroStatIndicatorMapping.objects.filter(indicator_id=indicator_id)
@@ -441,6 +386,15 @@ def workflow_run(request, id):
         try:
             workflow = Workflow.objects.get(id=id)
 
+            # A run in progress is reported instead of queueing a second one
+            running = workflow_leases.current(workflow.id)
+            if running is not None:
+                return JsonResponse({
+                    'success': 'Workflow is already running',
+                    'workflow_id': workflow.id,
+                    'running_run_id': running.get('run_id'),
+                })
+
             if workflow.workflow_type == "CYSTAT":
                 # Fetch the associated CyStatRequest
                 cystat_request = CyStatRequest.objects.filter(workflow=workflow).first()
@@ -499,13 +453,9 @@ def workflow_toggle(request, id):
                 workflow.is_active = data.get('is_active', not workflow.is_active)
                 workflow.save()
 
-                task_name = f"execute_cystat_request_{workflow.id}"
-                periodic_task = PeriodicTask.objects.filter(name=task_name).first()
-                if periodic_task:
-                    periodic_task.enabled = workflow.is_active
-                    periodic_task.save()
-                else:
-                    print(f"PeriodicTask with name '{task_name}' not found.")
+                # Inactive workflows are skipped by the dispatcher; a reactivated one waits for its next cron tick
+                if workflow.is_active:
+                    schedule_workflow(workflow)
 
             return JsonResponse({
                 'success': f"Workflow {'activated' if workflow.is_active else 'deactivated'} successfully",
@@ -525,7 +475,9 @@ def workflow_history(request, id):
             # Assuming there's a WorkflowRun model to track execution history
             from koe_db.models import WorkflowRun
 
-            runs = WorkflowRun.objects.filter(workflow=workflow).order_by('-start_time')[:10]  # Latest 10 runs
+            runs = WorkflowRun.objects.filter(workflow=workflow).annotate(
+                indicators_updated=Count('action_logs')
+            ).order_by('-start_time')[:10]  # Latest 10 runs
 
             history = [{
                 'id': run.id,
@@ -561,8 +513,8 @@ def cystat_workflow_config(request):
 
             # Fetch workflow title from URL
             try:
-                response = requests.get(url)
-                response_data = response.json()
+                # Reconfiguring always reloads the structure
+                response_data = structure_cache.get_structure(url, refresh=True)
                 workflow_title = response_data.get('title', 'CyStat Workflow')
             except Exception as e:
                 return JsonResponse({'error': f'Failed to fetch data from URL: {str(e)}'}, status=400)
@@ -577,9 +529,12 @@ def cystat_workflow_config(request):
                 if cystat_request_id:
                     try:
                         cystat_request = CyStatRequest.objects.get(id=cystat_request_id)
+                        if cystat_request.url != url:
+                            structure_cache.invalidate(cystat_request.url)
                         cystat_request.url = url
                         cystat_request.frequency = frequency
                         cystat_request.start_period = start_period
+                        cystat_request.clear_validators()
                         cystat_request.save()
                     except CyStatRequest.DoesNotExist:
                         # If the record doesn't exist, create a new one
@@ -600,6 +555,13 @@ def cystat_workflow_config(request):
                         start_period=start_period
                     )
 
+                # Incremental fetch settings; a reconfigured request starts with a full refresh
+                for field in ('revision_lookback', 'full_refresh_days'):
+                    if data.get(field) is not None:
+                        setattr(cystat_request, field, int(data[field]))
+                cystat_request.last_full_refresh = None
+                cystat_request.save()
+
             schedule_workflow(workflow)
 
             return JsonResponse({
@@ -627,8 +589,7 @@ def cystat_workflow_details(id):
             # Get the structure data from URL
             structure_data = None
             try:
-                response = requests.get(cystat_request.url)
-                json_data = response.json()
+                json_data = structure_cache.get_structure(cystat_request.url)
 
                 # Extract variables from the API
                 variables = json_data.get('variables', [])
@@ -726,6 +687,9 @@ def cystat_workflow_details(id):
                 'url': cystat_request.url,
                 'frequency': cystat_request.frequency,
                 'start_period': cystat_request.start_period,
+                'revision_lookback': cystat_request.revision_lookback,
+                'full_refresh_days': cystat_request.full_refresh_days,
+                'last_full_refresh': cystat_request.last_full_refresh.isoformat() if cystat_request.last_full_refresh else None,
                 'request_body': cystat_request.request_body,
                 'data_structure': structure_data,
                 'indicators': indicators,
@@ -771,8 +735,7 @@ def cystat_indicator_mapping(request):
             # Fetch variable data to get actual values
             structure_data = None
             try:
-                response = requests.get(cystat_request.url)
-                json_data = response.json()
+                json_data = structure_cache.get_structure(cystat_request.url)
                 variables = json_data.get('variables', [])
                 structure_data = {
                     'variables': variables
@@ -832,6 +795,8 @@ def cystat_indicator_mapping(request):
             with transaction.atomic():
                 # Update the request body
                 cystat_request.request_body = query
+                cystat_request.clear_validators()
+                cystat_request.last_full_refresh = None
                 cystat_request.save()
 
                 # If updating, delete old mappings first
@@ -885,8 +850,7 @@ def fetch_cystat_structure(request):
             if not url:
                 return JsonResponse({'error': 'URL is required'}, status=400)
 
-            response = requests.get(url)
-            json_data = response.json()
+            json_data = structure_cache.get_structure(url)
 
             # Extract the structure information
             variables = json_data.get('variables', [])
@@ -946,13 +910,13 @@ def ecb_workflow_config(request):
             ecb_request_id = data.get('ecb_request_id')  # Check if a request ID is provided
 
             # Construct the full URL
-            url = f"https://data-api.ecb.europa.eu/service/data/{table}/{parameters}?format=jsondata"
+            url = ecb_data_url(table, parameters)
 
             # Try to fetch the title from the ECB API response
             workflow_title = ''
             try:
-                response = requests.get(url)
-                response_data = response.json()
+                # Reconfiguring always reloads the structure
+                response_data = structure_cache.get_structure(url, refresh=True)
 
                 # Find the title in the response data
                 title_attrs = None
@@ -982,10 +946,14 @@ def ecb_workflow_config(request):
                 if ecb_request_id:
                     try:
                         ecb_request = ECBRequest.objects.get(id=ecb_request_id)
+                        old_url = ecb_data_url(ecb_request.table, ecb_request.parameters)
+                        if old_url != url:
+                            structure_cache.invalidate(old_url)
                         ecb_request.table = table
                         ecb_request.parameters = parameters
                         ecb_request.frequency = frequency
                         ecb_request.indicator_id = indicator_id
+                        ecb_request.clear_validators()
                         ecb_request.save()
                     except ECBRequest.DoesNotExist:
                         # Create a new request if the ID doesn't exist
@@ -1006,6 +974,13 @@ def ecb_workflow_config(request):
                         indicator_id=indicator_id
                     )
 
+                # Incremental fetch settings; a reconfigured request starts with a full refresh
+                for field in ('revision_lookback', 'full_refresh_days'):
+                    if data.get(field) is not None:
+                        setattr(ecb_request, field, int(data[field]))
+                ecb_request.last_full_refresh = None
+                ecb_request.save()
+
             schedule_workflow(workflow)
 
             return JsonResponse({
@@ -1018,6 +993,49 @@ def ecb_workflow_config(request):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
+def ecb_indicator_mapping(request):
+    """Map indicators to the series of a multi-series ECB request"""
+    if request.method == 'POST':
+        try:
+            user = get_user(request)
+            if not user:
+                return JsonResponse({'error': 'User not authenticated'}, status=401)
+
+            data = json.loads(request.body)
+            ecb_request_id = data.get('ecb_request_id')
+            indicator_mappings = data.get('indicator_mappings', [])
+            is_update = data.get('is_update', False)  # Check if this is an update
+
+            ecb_request = ECBRequest.objects.get(id=ecb_request_id)
+
+            with transaction.atomic():
+                # New mappings need a full ingestion even if the source is unchanged
+                ecb_request.clear_validators()
+                ecb_request.last_full_refresh = None
+                ecb_request.save()
+
+                # If updating, delete old mappings first
+                if is_update:
+                    ECBIndicatorMapping.objects.filter(ecb_request=ecb_request).delete()
+
+                # Create indicator mappings
+                for mapping in indicator_mappings:
+                    ECBIndicatorMapping.objects.create(
+                        ecb_request=ecb_request,
+                        indicator_id=mapping.get('indicator_id'),
+                        series_key=mapping.get('series_key')
+                    )
+
+            return JsonResponse({
+                'success': f'Indicator mappings {("updated" if is_update else "created")} successfully',
+                'workflow_id': ecb_request.workflow.id
+            })
+
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            return JsonResponse({'error': str(e)}, status=500)
+
 def fetch_ecb_structure(request):
     """Fetch the structure of an ECB data source"""
     if request.method == 'POST':
@@ -1029,9 +1047,8 @@ def fetch_ecb_structure(request):
             if not table or not parameters:
                 return JsonResponse({'error': 'Table and parameters are required'}, status=400)
 
-            url = f"https://data-api.ecb.europa.eu/service/data/{table}/{parameters}?format=jsondata"
-            response = requests.get(url)
-            json_data = response.json()
+            url = ecb_data_url(table, parameters)
+            json_data = structure_cache.get_structure(url)
 
             # Extract title
             title = ""
@@ -1089,11 +1106,22 @@ def fetch_ecb_structure(request):
                                 data_sample.append({"period": period, "value": value})
                         break
 
+            # List every series so several indicators can be mapped to one request
+            series = [
+                {
+                    'series_key': series_key,
+                    'title': series_data['title'],
+                    'observations': len(series_data['values'])
+                }
+                for series_key, series_data in ecb_series(json_data).items()
+            ]
+
             # Build structure information
             structure = {
                 'title': title,
                 'frequency': frequency,
                 'periods': periods,
+                'series': series,
                 'data_sample': data_sample[:10] if data_sample else []  # Just send a few samples
             }
 
@@ -1116,13 +1144,12 @@ def ecb_workflow_details(id):
             ecb_request = ECBRequest.objects.get(workflow=workflow)
 
             # Construct the ECB API URL
-            url = f"https://data-api.ecb.europa.eu/service/data/{ecb_request.table}/{ecb_request.parameters}?format=jsondata"
+            url = ecb_data_url(ecb_request.table, ecb_request.parameters)
 
             # Fetch data from the ECB API
             structure_data = None
             try:
-                response = requests.get(url)
-                json_data = response.json()
+                json_data = structure_cache.get_structure(url)
 
                 # Extract title
                 title = ""
@@ -1155,7 +1182,8 @@ def ecb_workflow_details(id):
                 structure_data = None
 
             # Get indicator information
-            indicator = Indicator.objects.get(id=ecb_request.indicator_id)
+            indicator = ecb_request.indicator
+            indicator_mappings = ECBIndicatorMapping.objects.filter(ecb_request=ecb_request).select_related('indicator')
 
             result = {
                 'id': workflow.id,
@@ -1169,12 +1197,27 @@ def ecb_workflow_details(id):
                 'table': ecb_request.table,
                 'parameters': ecb_request.parameters,
                 'frequency': ecb_request.frequency,
+                'revision_lookback': ecb_request.revision_lookback,
+                'full_refresh_days': ecb_request.full_refresh_days,
+                'last_full_refresh': ecb_request.last_full_refresh.isoformat() if ecb_request.last_full_refresh else None,
                 'indicator_id': ecb_request.indicator_id,
                 'indicator': {
                     'id': indicator.id,
                     'name': indicator.name,
                     'code': indicator.code
-                },
+                } if indicator else None,
+                'indicator_mappings': [
+                    {
+                        'id': mapping.id,
+                        'series_key': mapping.series_key,
+                        'indicator': {
+                            'id': mapping.indicator.id,
+                            'name': mapping.indicator.name,
+                            'code': mapping.indicator.code
+                        }
+                    }
+                    for mapping in indicator_mappings
+                ],
                 'data_structure': structure_data
             }
 
@@ -1215,8 +1258,8 @@ def eurostat_workflow_config(request):
 
             # Fetch workflow title from URL
             try:
-                response = requests.get(url)
-                response_data = response.json()
+                # Reconfiguring always reloads the structure
+                response_data = structure_cache.get_structure(url, refresh=True, extract=jsonstat_metadata)
                 workflow_title = response_data.get('label', None)
             except Exception as e:
                 return JsonResponse({'error': f'Failed to fetch data from URL: {str(e)}'}, status=400)
@@ -1231,8 +1274,11 @@ def eurostat_workflow_config(request):
                 if eurostat_request_id:
                     try:
                         eurostat_request = EuroStatRequest.objects.get(id=eurostat_request_id)
+                        if eurostat_request.url != url:
+                            structure_cache.invalidate(eurostat_request.url)
                         eurostat_request.url = url
                         eurostat_request.frequency = frequency
+                        eurostat_request.clear_validators()
                         eurostat_request.save()
                     except EuroStatRequest.DoesNotExist:
                         # If the record doesn't exist, create a new one
@@ -1249,6 +1295,13 @@ def eurostat_workflow_config(request):
                         frequency=frequency
                     )
 
+                # Incremental fetch settings; a reconfigured request starts with a full refresh
+                for field in ('revision_lookback', 'full_refresh_days'):
+                    if data.get(field) is not None:
+                        setattr(eurostat_request, field, int(data[field]))
+                eurostat_request.last_full_refresh = None
+                eurostat_request.save()
+
             schedule_workflow(workflow)
 
             return JsonResponse({
@@ -1277,8 +1330,7 @@ def eurostat_workflow_details(id):
             # Get the structure data from URL
             structure_data = None
             try:
-                response = requests.get(eurostat_request.url)
-                json_data = response.json()
+                json_data = structure_cache.get_structure(eurostat_request.url, extract=jsonstat_metadata)
 
                 # Extract title
                 title = json_data.get('title', '')
@@ -1390,6 +1442,9 @@ def eurostat_workflow_details(id):
                 'eurostat_request_id': eurostat_request.id,
                 'url': eurostat_request.url,
                 'frequency': eurostat_request.frequency,
+                'revision_lookback': eurostat_request.revision_lookback,
+                'full_refresh_days': eurostat_request.full_refresh_days,
+                'last_full_refresh': eurostat_request.last_full_refresh.isoformat() if eurostat_request.last_full_refresh else None,
                 'data_structure': structure_data,
                 'indicators': indicators,
                 'indicator_mappings': mappings
@@ -1432,6 +1487,11 @@ def eurostat_indicator_mapping(request):
             eurostat_request = EuroStatRequest.objects.get(id=eurostat_request_id)
 
             with transaction.atomic():
+                # New mappings need a full ingestion even if the source is unchanged
+                eurostat_request.clear_validators()
+                eurostat_request.last_full_refresh = None
+                eurostat_request.save()
+
                 # If updating, delete old mappings first
                 if is_update:
                     EuroStatIndicatorMapping.objects.filter(eurostat_request=eurostat_request).delete()
@@ -1472,8 +1532,7 @@ def fetch_eurostat_structure(request):
             if not url:
                 return JsonResponse({'error': 'URL is required'}, status=400)
 
-            response = requests.get(url)
-            json_data = response.json()
+            json_data = structure_cache.get_structure(url, extract=jsonstat_metadata)
 
             # Extract the title
             title = json_data.get('title', '')
@@ -1644,33 +1703,22 @@ def workflow_run_history(request, workflow_id):
 
             history = []
             for run in runs:
-                # Get action logs for this workflow run
-                action_logs = ActionLog.objects.filter(run=run).order_by('-timestamp')
+                # Get action logs for this workflow run; point changes come from the DataChange table
+                action_logs = ActionLog.objects.filter(run=run).select_related('indicator').order_by('-timestamp')
+                changes_by_log = details_by_log(log.id for log in action_logs if log.action_type == 'DATA_UPDATE')
                 action_logs_data = []
 
                 # Build data for each action log
                 for log in action_logs:
-                    try:
-                        indicator = Indicator.objects.get(id=log.indicator_id)
-                        action_logs_data.append({
-                            'id': log.id,
-                            'indicator_id': log.indicator_id,
-                            'indicator_code': indicator.code,
-                            'indicator_name': indicator.name,
-                            'action_type': log.action_type,
-                            'timestamp': log.timestamp.isoformat(),
-                            'details': log.details
-                        })
-                    except Indicator.DoesNotExist:
-                        # Handle case where indicator might have been deleted
-                        action_logs_data.append({
-                            'id': log.id,
-                            'indicator_id': log.indicator_id,
-                            'indicator_name': 'Unknown Indicator',
-                            'action_type': log.action_type,
-                            'timestamp': log.timestamp.isoformat(),
-                            'details': log.details
-                        })
+                    action_logs_data.append({
+                        'id': log.id,
+                        'indicator_id': log.indicator_id,
+                        'indicator_code': log.indicator.code,
+                        'indicator_name': log.indicator.name,
+                        'action_type': log.action_type,
+                        'timestamp': log.timestamp.isoformat(),
+                        'details': action_details(log, changes_by_log)
+                    })
 
                 # Add run data to history
                 run_data = {
@@ -1680,6 +1728,9 @@ def workflow_run_history(request, workflow_id):
                     'status': run.status,
                     'success': run.success,
                     'error_message': run.error_message,
+                    'status_message': run.status_message,
+                    'metrics': run.metrics,
+                    'archive_path': run.archive_path,
                     'action_logs': action_logs_data
                 }
                 history.append(run_data)
@@ -1693,6 +1744,65 @@ def workflow_run_history(request, workflow_id):
 
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def workflow_run_trends(request, workflow_id):
+    """Get duration and throughput percentiles over the latest completed runs of a workflow"""
+    if request.method == 'GET':
+        try:
+            workflow = Workflow.objects.get(id=workflow_id)
+            try:
+                limit = min(max(int(request.GET.get('runs', 50)), 1), 500)
+            except ValueError:
+                return JsonResponse({'error': 'runs must be an integer'}, status=400)
+
+            runs = WorkflowRun.objects.filter(
+                workflow=workflow, status='COMPLETED', start_time__isnull=False, end_time__isnull=False
+            ).order_by('-start_time')[:limit]
+
+            durations = []
+            rows_per_second = []
+            stage_durations = {}
+            for run in runs:
+                metrics = run.metrics or {}
+                duration = metrics.get('duration_ms', (run.end_time - run.start_time).total_seconds() * 1000) / 1000
+                durations.append(duration)
+                matched = (metrics.get('rows') or {}).get('matched')
+                if matched is not None and duration > 0:
+                    rows_per_second.append(matched / duration)
+                for stage, stage_ms in (metrics.get('stages_ms') or {}).items():
+                    stage_durations.setdefault(stage, []).append(stage_ms)
+
+            return JsonResponse({
+                'workflow_id': workflow.id,
+                'runs': len(durations),
+                'duration_seconds': {
+                    'p50': _percentile(durations, 0.5),
+                    'p95': _percentile(durations, 0.95),
+                },
+                'rows_per_second': {
+                    'p50': _percentile(rows_per_second, 0.5),
+                    'p95': _percentile(rows_per_second, 0.95),
+                },
+                'stages_ms': {
+                    stage: {'p50': _percentile(values, 0.5), 'p95': _percentile(values, 0.95)}
+                    for stage, values in stage_durations.items()
+                },
+            })
+
+        except Workflow.DoesNotExist:
+            return JsonResponse({'error': 'Workflow not found'}, status=404)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
 def latest_workflow_run(request):
     """
     Returns the latest workflow run with indicator data and time series
@@ -1737,6 +1847,7 @@ def latest_workflow_run(request):
 
                     # Build the response data
                     indicators_data = []
+                    affected_series = series_cache.get_many(affected_indicators)
 
                     for indicator_id in affected_indicators:
                         try:
@@ -1747,14 +1858,11 @@ def latest_workflow_run(request):
                                 continue
 
                             # Get indicator data points
-                            data_points = Data.objects.filter(indicator=indicator).order_by('period')
-                            data_list = []
-
-                            for point in data_points:
-                                data_list.append({
-                                    'period': point.period,
-                                    'value': point.value
-                                })
+                            series = affected_series[indicator_id]
+                            data_list = [
+                                {'period': period, 'value': value}
+                                for period, value in zip(series.periods, series.formatted_values())
+                            ]
 
                             indicators_data.append({
                                 'id': str(indicator.id),